@@ -1,7 +1,10 @@
 import random
 
+from collections import namedtuple
 from enum import Enum
 
+from shardmap import ShardMap
+
 
 class Role(Enum):
     PARTICIPANT = 0
@@ -10,51 +13,309 @@ class Role(Enum):
 
 
 class Blockchain(object):
+    """Fork-aware store of collations
+
+    Collations are indexed by hash and linked to their parent, and the
+    canonical chain is additionally indexed by height. Every collation that
+    has no children yet is a tip; the head is the tip with the best score
+    (by default the greatest height, keeping the earlier tip on ties).
+    Collations whose parent is unknown are held back until it arrives.
+    """
 
     # hash is 32 byte string of 0's
     GENESIS_COLLATION_HASH = b'\x00' * 32
 
-    class BlockchainNode:
-        def __init__(self, block_data=None, child_hash=None):
+    # number of orphans held back before the oldest are dropped
+    MAX_ORPHANS = 1024
+
+    class BlockchainNode(object):
+        __slots__ = ('data', 'parent_hash', 'height')
+
+        def __init__(self, block_data=None, parent_hash=None, height=0):
             self.data = block_data
-            self.child_hash = child_hash
+            self.parent_hash = parent_hash
+            self.height = height
+
+    # collations removed from and added to the canonical chain by an update,
+    # each in chain order
+    ChainUpdate = namedtuple('ChainUpdate', ['removed', 'added'])
+
+    def __init__(self, score=None):
+        """
+        Args:
+            score (callable, optional): Defaults to the node height. Maps a
+                BlockchainNode to a comparable score; the best scoring tip
+                becomes the head.
+        """
 
-    def __init__(self):
         self._nodes = dict()
+        # canonical chain: _canonical[h] is the hash at height h + 1
+        self._canonical = list()
+        # parent hash -> {collation hash: collation} waiting for that parent
+        self._orphans = dict()
+        self._orphan_count = 0
+        self.tips = set()
         self.head = None
+        self.score = score if score is not None else \
+            (lambda node: node.height)
 
-    def add_collation(self, new_collation):
-        block_hash = new_collation.header.collation_id
-        block_node = Blockchain.BlockchainNode(block_data=new_collation)
-        self._nodes[block_hash] = block_node
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, block_hash):
+        return block_hash in self._nodes
+
+    @property
+    def height(self):
+        return len(self._canonical)
 
-        # set the child of the current head, and change current head
-        self._nodes[self.head].child_hash = block_hash
-        self.head = block_hash
+    def get(self, block_hash):
+        node = self._nodes.get(block_hash)
+        return node.data if node is not None else None
+
+    def get_node(self, block_hash):
+        return self._nodes.get(block_hash)
 
     def get_head(self):
+        if self.head is None:
+            return None
         return self._nodes[self.head].data
 
-    def add_fork_node(self, new_collation):
-        block_hash = new_collation.header.collation_id
-        block_node = Blockchain.BlockchainNode(block_data=new_collation)
-        self._nodes[block_hash] = block_node
+    def head_hash(self):
+        """Hash to use as the parent of the next collation"""
+        if self.head is None:
+            return Blockchain.GENESIS_COLLATION_HASH
+        return self.head
+
+    def get_by_height(self, height):
+        """The canonical collation at `height` (the first one is at 1)"""
+        if not 1 <= height <= len(self._canonical):
+            return None
+        return self._nodes[self._canonical[height - 1]].data
+
+    def add_collation(self, new_collation):
+        """Insert a collation, possibly switching the canonical chain
+
+        Args:
+            new_collation (Collation): The collation to store
+
+        Returns:
+            Blockchain.ChainUpdate: The collations leaving and joining the
+                canonical chain. Both are empty if the head did not change.
+        """
+
+        removed, added = list(), list()
+        pending = [new_collation]
+        while pending:
+            collation = pending.pop()
+            update = self._insert(collation)
+            if update is None:
+                continue
+
+            # a reorg may undo collations added earlier in this call; the
+            # rest of what it removes sits below anything removed so far
+            undone = list()
+            for c in reversed(update.removed):
+                if added and added[-1] is c:
+                    added.pop()
+                else:
+                    undone.append(c)
+            removed[:0] = reversed(undone)
+            added.extend(update.added)
+
+            # the new collation may be the parent some orphans waited for
+            orphans = self._orphans.pop(collation.header.collation_id, {})
+            self._orphan_count -= len(orphans)
+            pending.extend(orphans.values())
+
+        return Blockchain.ChainUpdate(removed, added)
+
+    def _insert(self, collation):
+        block_hash = collation.header.collation_id
+        if block_hash in self._nodes:
+            return None
+
+        parent_hash = collation.header.parent_hash
+        if parent_hash == Blockchain.GENESIS_COLLATION_HASH:
+            height = 1
+        elif parent_hash in self._nodes:
+            height = self._nodes[parent_hash].height + 1
+        else:
+            self._add_orphan(parent_hash, collation)
+            return None
+
+        node = Blockchain.BlockchainNode(collation, parent_hash, height)
+        self._nodes[block_hash] = node
+        self.tips.discard(parent_hash)
+        self.tips.add(block_hash)
+
+        if self.head is not None and \
+                self.score(node) <= self.score(self._nodes[self.head]):
+            return Blockchain.ChainUpdate([], [])
+        return self._set_head(block_hash)
+
+    def remove_collation(self, block_hash):
+        """Drop a collation along with the collations built on it
+
+        The head moves to the best of the remaining tips if it was dropped.
+
+        Returns:
+            Blockchain.ChainUpdate: As for `add_collation`
+        """
+
+        node = self._nodes.get(block_hash)
+        if node is None:
+            return Blockchain.ChainUpdate([], [])
+
+        dropped = {block_hash}
+        for tip in self.tips:
+            branch = self._branch(tip, block_hash)
+            if branch is not None:
+                dropped.update(branch)
+        for dropped_hash in dropped:
+            self._orphan_count -= len(self._orphans.pop(dropped_hash, {}))
+
+        tips = self.tips - dropped
+        if node.parent_hash in self._nodes and not any(
+                self._branch(tip, node.parent_hash) is not None
+                for tip in tips):
+            tips.add(node.parent_hash)
+
+        update = Blockchain.ChainUpdate([], [])
+        if self.head in dropped:
+            new_head = max(tips, key=lambda h: self.score(self._nodes[h]),
+                           default=None)
+            update = self._set_head(new_head)
+        for dropped_hash in dropped:
+            del self._nodes[dropped_hash]
+        self.tips = tips
+        return update
+
+    def _branch(self, tip, block_hash):
+        # hashes from `tip` down to just above `block_hash`, or None if
+        # `tip` does not descend from `block_hash`
+        height = self._nodes[block_hash].height
+        branch = list()
+        while self._nodes[tip].height > height:
+            branch.append(tip)
+            tip = self._nodes[tip].parent_hash
+        return branch if tip == block_hash else None
+
+    def _add_orphan(self, parent_hash, collation):
+        orphans = self._orphans.setdefault(parent_hash, dict())
+        if collation.header.collation_id in orphans:
+            return
+        orphans[collation.header.collation_id] = collation
+        self._orphan_count += 1
+        # drop the orphans waiting the longest, oldest parent first
+        while self._orphan_count > Blockchain.MAX_ORPHANS:
+            oldest_parent = next(iter(self._orphans))
+            oldest = self._orphans[oldest_parent]
+            del oldest[next(iter(oldest))]
+            self._orphan_count -= 1
+            if not oldest:
+                del self._orphans[oldest_parent]
+
+    def _set_head(self, new_head):
+        old_head = self.head
+        ancestor = self.common_ancestor(old_head, new_head)
+        ancestor_height = 0 if ancestor is None else \
+            self._nodes[ancestor].height
+
+        removed = [self._nodes[h].data
+                   for h in self._canonical[ancestor_height:]]
+        added = [self._nodes[h].data
+                 for h in self._path(new_head, ancestor)]
+
+        del self._canonical[ancestor_height:]
+        self._canonical.extend(c.header.collation_id for c in added)
+        self.head = new_head
+        return Blockchain.ChainUpdate(removed, added)
+
+    def _path(self, block_hash, ancestor):
+        # hashes from just after `ancestor` up to `block_hash`, in chain order
+        path = list()
+        while block_hash != ancestor and block_hash in self._nodes:
+            path.append(block_hash)
+            block_hash = self._nodes[block_hash].parent_hash
+        path.reverse()
+        return path
+
+    def common_ancestor(self, a, b):
+        """Latest collation both `a` and `b` descend from, or None
+
+        Walks both branches down to the same height and then in lockstep,
+        so this takes time proportional to the depth of the fork.
+        """
+
+        if a is None or b is None:
+            return None
+
+        node_a, node_b = self._nodes[a], self._nodes[b]
+        while node_a.height > node_b.height:
+            a, node_a = node_a.parent_hash, self._nodes.get(node_a.parent_hash)
+        while node_b.height > node_a.height:
+            b, node_b = node_b.parent_hash, self._nodes.get(node_b.parent_hash)
+
+        while a != b:
+            if node_a.height == 1:
+                return None
+            a, node_a = node_a.parent_hash, self._nodes[node_a.parent_hash]
+            b, node_b = node_b.parent_hash, self._nodes[node_b.parent_hash]
+        return a
 
 
 class Shard(object):
 
     TOTAL_SHARDS = 3
+    shard_map = ShardMap(TOTAL_SHARDS)
 
     def __init__(self, shard_number=0):
         self.shard_number = shard_number
         self.role = Role.PARTICIPANT
+        # shard -> VRF proof, for the committees this node sits on
+        self.committees = dict()
+
+    @staticmethod
+    def configure(total_shards):
+        """Change the number of shards used by `shard_of_key`"""
+        if total_shards != Shard.TOTAL_SHARDS:
+            Shard.TOTAL_SHARDS = total_shards
+            Shard.shard_map = ShardMap(total_shards)
 
-    def generate_new(self, total_nodes):
-        self.shard_number = random.randrange(Shard.TOTAL_SHARDS)
+    @staticmethod
+    def shard_of_key(public_key):
+        """The shard owning transactions sent by `public_key`"""
+        return Shard.shard_map.shard_of_key(public_key)
+
+    def generate_new(self, total_nodes, public_key=None):
+        """Pick the shard served by this node
+
+        A node with a key serves the shard its key maps to, so it keeps
+        serving the same shard across restarts as long as the shard count
+        stays the same.
+        """
+
+        if public_key is not None:
+            self.shard_number = Shard.shard_of_key(public_key)
+        else:
+            self.shard_number = random.randrange(Shard.TOTAL_SHARDS)
         self.role = Role.PROPOSER
 
+    def assign(self, committees):
+        """Set the committees this node sits on for the current epoch
+
+        Args:
+            committees (dict): shard -> VRF proof of the seat, as returned
+                by sampling.CommitteeSampler.assign
+        """
+
+        self.committees = dict(committees)
+        self.role = Role.COLLATOR if self.committees else Role.PROPOSER
+
     def is_proposer(self):
-        return self.role == Role.PROPOSER
+        # collators keep proposing collations of their own shard
+        return self.role in (Role.PROPOSER, Role.COLLATOR)
 
     def is_collator(self):
         return self.role == Role.COLLATOR
@@ -3,16 +3,17 @@ import asyncio
 import logging
 import sys
 
+from membership import BootstrapServer, MembershipView
 from p2p import BootstrapServerProtocol
 
 
 def main(args):
     loop = asyncio.get_event_loop()
-    nodes = set()
+    server = BootstrapServer(loop, MembershipView(expiry=args.expiry))
 
+    port = args.port or BootstrapServerProtocol.BOOTSTRAP_PORT
     coro = loop.create_server(
-        lambda: BootstrapServerProtocol(nodes), host='0.0.0.0',
-        port=BootstrapServerProtocol.BOOTSTRAP_PORT)
+        lambda: BootstrapServerProtocol(server), host='0.0.0.0', port=port)
     loop.run_until_complete(coro)
 
     try:
@@ -20,6 +21,7 @@ def main(args):
     except KeyboardInterrupt:
         print('Quitting...', file=sys.stderr)
 
+    server.close()
     loop.close()
 
 
@@ -29,6 +31,11 @@ def parse_arguments():
     parser.add_argument('-p', '--port',
                         dest='port', default=None,
                         help='Port to use to listen for incoming connections')
+    parser.add_argument('--expiry',
+                        dest='expiry', type=float,
+                        default=MembershipView.EXPIRY,
+                        help=('Seconds without a heartbeat after which a node '
+                              'is dropped'))
     parser.add_argument('--log-file',
                         dest='log_file', default='/tmp/bootstrapper.log',
                         help='The file to write output log to')
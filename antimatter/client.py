@@ -6,9 +6,11 @@ import random
 import sys
 import time
 
-from blockchain import Blockchain
-from crypto import RSA
-from objects import State, Transaction
+from blockchain import Blockchain, Shard
+from crypto import get_pub_key_bytes, load_private_key
+from objects import (
+    Coin, Collation, ShardAnnouncement, State, Transaction, VALUE_SCALE,
+    genesis_coins)
 from p2p import Network, NetworkClientProtocol
 
 
@@ -23,7 +25,7 @@ class Client(object):
         self.priv_key = None
         if rsa_key_file is not None:
             # use the supplied keyfile
-            self.priv_key = RSA.get_rsa_key(rsa_key_file)
+            self.priv_key = load_private_key(rsa_key_file)
 
         # load the private key files
         self.keys = set()
@@ -31,46 +33,119 @@ class Client(object):
         for key_file in glob.glob('client_keys/*.pem'):
             if key_file == rsa_key_file:
                 continue
-            self.keys.add(RSA.get_rsa_key(key_file))
+            self.keys.add(load_private_key(key_file))
 
+        # start out with the coins participants allocate to our keys
         self.state = State()
+        owners = [get_pub_key_bytes(key) for key in self.keys]
+        if self.priv_key is not None:
+            owners.append(get_pub_key_bytes(self.priv_key))
+        for coin in genesis_coins(owners):
+            self.state.add_coin(coin)
+        # txn_id -> total value of the coins it spends, for our own txns
+        self.pending_spends = dict()
         self.blockchain = Blockchain()
+        # shard number -> peers serving that shard
+        self.shard_peers = dict()
 
         # get and create connections
-        self.network = Network(self, self.evloop)
+        self.network = Network(self, self.evloop, handshake=False)
         self.evloop.run_until_complete(
             self.network.create_connections(NetworkClientProtocol.CLIENT_PORT))
 
-    def handle_message(self, message):
+    def handle_peer_connected(self, peer):
+        pass
+
+    def handle_peer_lost(self, peer):
+        pass
+
+    def handle_message(self, message, peer=None):
         if isinstance(message, Transaction):
             return self.handle_transaction(message)
 
+        elif isinstance(message, Collation):
+            return self.handle_collation(message)
+
+        elif isinstance(message, ShardAnnouncement):
+            return self.handle_shard_announcement(message, peer)
+
         self.logger.error('Received message cannot be handled by Client')
 
+    def handle_shard_announcement(self, announcement, peer):
+        if announcement.total_shards != Shard.TOTAL_SHARDS:
+            # the network runs a different shard count, start over
+            Shard.configure(announcement.total_shards)
+            self.shard_peers = dict()
+
+        for peers in self.shard_peers.values():
+            peers.discard(peer)
+        self.shard_peers.setdefault(
+            announcement.shard_number, set()).add(peer)
+        self.logger.info(
+            f'{peer} serves shard {announcement.shard_number}')
+
+    def send_txn(self, txn):
+        """Send `txn` to the peers of its shard, or to all if none is known"""
+        peers = self.shard_peers.get(Shard.shard_of_key(txn.src_pk))
+        if peers:
+            self.network.send_obj(peers, txn)
+        else:
+            self.network.broadcast_obj(txn)
+
+    def handle_collation(self, collation):
+        # track coins from accepted collations so transactions can name
+        # their inputs; participants have already validated them
+        for txn in collation.txns:
+            total = self.pending_spends.pop(txn.txn_id, None)
+            if total is None:
+                total = 0
+                for coin_id in txn.inputs:
+                    if coin_id in self.state.utxo:
+                        total += self.state.remove_coin(coin_id).value
+
+            if total > txn.value:
+                self.state.add_coin(Coin(owner=txn.src_pk,
+                                         value=total - txn.value,
+                                         parent_txn=txn.txn_id))
+            self.state.add_coin(Coin(owner=txn.dst_pk, value=txn.value,
+                                     parent_txn=txn.txn_id))
+
     async def send_txns(self):
         while True:
             if self.priv_key is None:
-                src_key, dst_key = random.sample(self.keys, 2)
+                src_key, dst_key = random.sample(list(self.keys), 2)
             else:
                 src_key = self.priv_key
-                dst_key = random.sample(self.keys, 1)
+                dst_key, = random.sample(list(self.keys), 1)
 
+            src_pk = get_pub_key_bytes(src_key)
             dst_key = dst_key.public_key()
-            value = random.uniform(1., 10.)
+            value = random.randint(1 * VALUE_SCALE, 10 * VALUE_SCALE)
+
+            selection = self.state.select_coins(src_pk, value)
+            if selection is None:
+                self.logger.debug('Not enough coins to send a transaction')
+                await asyncio.sleep(1 / Client.TPS)
+                continue
 
             # Create transaction
             args = {
-                'src_pk': RSA.get_pub_key_bytes(src_key),
-                'dst_pk': RSA.get_pub_key_bytes(dst_key),
+                'src_pk': src_pk,
+                'dst_pk': get_pub_key_bytes(dst_key),
                 'value': value,
-                # 'inputs': ???
+                'inputs': selection.coin_ids,
             }
             txn = Transaction(**args)
             txn.sign(src_key)
             self.logger.info(f'Created txn: {txn}')
 
+            # the inputs are spent as far as later transactions are concerned
+            for coin_id in selection.coin_ids:
+                self.state.remove_coin(coin_id)
+            self.pending_spends[txn.txn_id] = selection.total
+
             # Send transaction
-            self.network.broadcast_obj(txn)
+            self.send_txn(txn)
 
             # sleep until next transaction
             await asyncio.sleep(1 / Client.TPS)
@@ -0,0 +1,554 @@
+"""Compact binary wire codec for the objects exchanged between nodes
+
+Every message starts with a one byte codec version and a one byte type tag,
+followed by the fields of the type's schema in order. Fields are encoded as:
+
+    hash        32 raw bytes
+    array       u32 count, followed by count elements
+    key         u16 length, followed by the DER encoded public key
+    blob        u32 length, followed by the raw bytes
+    text        u16 length, followed by the utf-8 encoded string
+    u32/u64     fixed width, big-endian; u64 values are at most 2**63 - 1,
+                the range of the integers objects serialize
+    bool        a single byte
+    timestamp   i64 microseconds since the unix epoch
+    optional    a presence byte, followed by the wrapped field if present
+
+All integers are big-endian.
+"""
+
+import base64
+import functools
+import struct
+
+from datetime import datetime, timedelta
+
+from framing import frame
+from objects import (
+    Transaction, CollationHeader, Collation, CollationVote, CollationRequest,
+    ShardAnnouncement, GossipSubscribe, GossipIHave, GossipIWant, PeerHello,
+    MembershipHeartbeat, MembershipUpdate, CollationResponse, VoteCertificate,
+    CrossShardReceipt, SnapshotManifest, SnapshotRequest, SnapshotResponse,
+    MAX_INT)
+
+
+CODEC_VERSION = 8
+
+_PREAMBLE = struct.Struct('!BB')
+_U8 = struct.Struct('!B')
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+_I64 = struct.Struct('!q')
+_U64 = struct.Struct('!Q')
+
+_PEM_HEADER = b'-----BEGIN PUBLIC KEY-----\n'
+_PEM_FOOTER = b'-----END PUBLIC KEY-----\n'
+
+_EPOCH = datetime(1970, 1, 1)
+_ISO_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+class CodecError(Exception):
+    pass
+
+
+# nodes see the same few keys over and over, so the conversions are memoized
+@functools.lru_cache(maxsize=4096)
+def pem_to_der(pem):
+    """Strip the PEM armor off a SubjectPublicKeyInfo public key"""
+    lines = pem.strip().split(b'\n')
+    return base64.b64decode(b''.join(lines[1:-1]))
+
+
+@functools.lru_cache(maxsize=4096)
+def der_to_pem(der):
+    """Re-armor a DER public key exactly as `get_pub_key_bytes` does"""
+    b64 = base64.b64encode(der)
+    lines = [b64[i:i + 64] for i in range(0, len(b64), 64)]
+    return _PEM_HEADER + b'\n'.join(lines) + b'\n' + _PEM_FOOTER
+
+
+class Field(object):
+    """Base class of the schema field types"""
+
+    def pack(self, value, out):
+        raise NotImplementedError
+
+    def unpack(self, view, offset):
+        raise NotImplementedError
+
+    def nested(self, value):
+        """The objects embedded in `value`"""
+        return ()
+
+
+class Struct(Field):
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+
+    def pack(self, value, out):
+        out += self.fmt.pack(value)
+
+    def unpack(self, view, offset):
+        value, = self.fmt.unpack_from(view, offset)
+        return value, offset + self.fmt.size
+
+
+class UInt64(Struct):
+
+    def __init__(self):
+        super().__init__(_U64)
+
+    def pack(self, value, out):
+        if not 0 <= value <= MAX_INT:
+            raise CodecError(f'Integer out of range: {value}')
+        super().pack(value, out)
+
+    def unpack(self, view, offset):
+        value, offset = super().unpack(view, offset)
+        if value > MAX_INT:
+            raise CodecError(f'Integer out of range: {value}')
+        return value, offset
+
+
+class Bool(Struct):
+
+    def __init__(self):
+        super().__init__(_U8)
+
+    def unpack(self, view, offset):
+        value, offset = super().unpack(view, offset)
+        return bool(value), offset
+
+
+class Hash(Field):
+
+    SIZE = 32
+
+    def pack(self, value, out):
+        if len(value) != Hash.SIZE:
+            raise CodecError(f'Hash must be {Hash.SIZE} bytes')
+        out += value
+
+    def unpack(self, view, offset):
+        end = offset + Hash.SIZE
+        if end > len(view):
+            raise CodecError('Truncated hash')
+        return bytes(view[offset:end]), end
+
+
+class Blob(Field):
+
+    def __init__(self, length_fmt=_U32):
+        self.length_fmt = length_fmt
+
+    def pack(self, value, out):
+        out += self.length_fmt.pack(len(value))
+        out += value
+
+    def unpack(self, view, offset):
+        length, = self.length_fmt.unpack_from(view, offset)
+        start = offset + self.length_fmt.size
+        end = start + length
+        if end > len(view):
+            raise CodecError('Truncated blob')
+        return bytes(view[start:end]), end
+
+
+class PublicKey(Blob):
+    """A PEM public key, sent as raw DER"""
+
+    def __init__(self):
+        super().__init__(_U16)
+
+    def pack(self, value, out):
+        super().pack(pem_to_der(bytes(value)), out)
+
+    def unpack(self, view, offset):
+        der, offset = super().unpack(view, offset)
+        return der_to_pem(der), offset
+
+
+class Text(Blob):
+    """A short unicode string"""
+
+    def __init__(self):
+        super().__init__(_U16)
+
+    def pack(self, value, out):
+        super().pack(value.encode('utf-8'), out)
+
+    def unpack(self, view, offset):
+        data, offset = super().unpack(view, offset)
+        return data.decode('utf-8'), offset
+
+
+class Timestamp(Field):
+    """A naive `datetime.isoformat()` string, sent as microseconds"""
+
+    def pack(self, value, out):
+        for fmt in _ISO_FORMATS:
+            try:
+                dt = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            raise CodecError(f'Unsupported timestamp: {value}')
+        out += _I64.pack((dt - _EPOCH) // timedelta(microseconds=1))
+
+    def unpack(self, view, offset):
+        us, = _I64.unpack_from(view, offset)
+        dt = _EPOCH + timedelta(microseconds=us)
+        return dt.isoformat(), offset + _I64.size
+
+
+class Optional(Field):
+
+    def __init__(self, field):
+        self.field = field
+
+    def pack(self, value, out):
+        if value is None:
+            out += b'\x00'
+        else:
+            out += b'\x01'
+            self.field.pack(value, out)
+
+    def unpack(self, view, offset):
+        present, = _U8.unpack_from(view, offset)
+        if not present:
+            return None, offset + 1
+        return self.field.unpack(view, offset + 1)
+
+    def nested(self, value):
+        return () if value is None else self.field.nested(value)
+
+
+class Nested(Field):
+    """Another schema embedded without its preamble"""
+
+    def __init__(self, schema_cls):
+        self.schema_cls = schema_cls
+
+    def pack(self, value, out):
+        _SCHEMAS_BY_CLASS[self.schema_cls].pack_fields(value, out)
+
+    def unpack(self, view, offset):
+        return _SCHEMAS_BY_CLASS[self.schema_cls].unpack_fields(view, offset)
+
+    def nested(self, value):
+        return (value,)
+
+
+class Array(Field):
+
+    def __init__(self, field):
+        self.field = field
+
+    def pack(self, value, out):
+        value = list(value)
+        out += _U32.pack(len(value))
+        for item in value:
+            self.field.pack(item, out)
+
+    def unpack(self, view, offset):
+        count, = _U32.unpack_from(view, offset)
+        offset += _U32.size
+        items = list()
+        for _ in range(count):
+            item, offset = self.field.unpack(view, offset)
+            items.append(item)
+        return items, offset
+
+    def nested(self, value):
+        # arrays of plain fields, such as hashes, hold no objects
+        if type(self.field).nested is Field.nested:
+            return ()
+        return [obj for item in value for obj in self.field.nested(item)]
+
+
+class Schema(object):
+
+    def __init__(self, tag, cls, fields, factory=None):
+        """Describe how an object is laid out on the wire
+
+        Args:
+            tag (int): The type tag identifying `cls` on the wire
+            cls (type): The class being encoded
+            fields (list): (attribute, Field) pairs, in wire order
+            factory (callable, optional): Defaults to `cls(**fields)`.
+                Builds the object from the decoded fields.
+        """
+
+        self.tag = tag
+        self.cls = cls
+        self.fields = fields
+        self.factory = factory if factory is not None else cls
+
+    def pack_fields(self, obj, out):
+        for name, field in self.fields:
+            field.pack(getattr(obj, name), out)
+
+    def unpack_fields(self, view, offset):
+        kwargs = dict()
+        for name, field in self.fields:
+            kwargs[name], offset = field.unpack(view, offset)
+        return self.factory(**kwargs), offset
+
+    def nested(self, obj):
+        """The objects embedded in `obj` on the wire"""
+        return [nested for name, field in self.fields
+                for nested in field.nested(getattr(obj, name))]
+
+
+def _collation_factory(header, txns, receipts):
+    return Collation(
+        shard_id=header.shard_id, parent_hash=header.parent_hash,
+        txns_merkle_root=header.txns_merkle_root,
+        creation_timestamp=header.creation_timestamp,
+        proposer_pk=header.proposer_pk, proposer_sig=header.proposer_sig,
+        txns=txns, receipts=receipts)
+
+
+_TRANSACTION_FIELDS = [
+    ('src_pk', PublicKey()),
+    ('dst_pk', PublicKey()),
+    ('inputs', Array(Hash())),
+    ('value', UInt64()),
+    ('src_sig', Optional(Blob(_U16))),
+]
+
+_HEADER_FIELDS = [
+    ('shard_id', Struct(_U32)),
+    ('parent_hash', Optional(Hash())),
+    ('txns_merkle_root', Optional(Hash())),
+    ('creation_timestamp', Optional(Timestamp())),
+    ('proposer_pk', Optional(PublicKey())),
+    ('proposer_sig', Optional(Blob(_U16))),
+]
+
+_SCHEMAS = [
+    Schema(1, Transaction, _TRANSACTION_FIELDS),
+    Schema(2, CollationHeader, _HEADER_FIELDS),
+    Schema(3, Collation, [
+        ('header', Nested(CollationHeader)),
+        ('txns', Array(Nested(Transaction))),
+        ('receipts', Array(Nested(CrossShardReceipt))),
+    ], factory=_collation_factory),
+    Schema(4, CollationVote, [
+        ('collation_id', Hash()),
+        ('collator_pk', PublicKey()),
+        ('shard_number', Struct(_U32)),
+        ('proof', Optional(Blob())),
+        ('epoch', UInt64()),
+        ('collator_sig', Blob(_U16)),
+    ]),
+    Schema(5, CollationRequest, [
+        ('collation_id', Optional(Hash())),
+        ('latest', Bool()),
+        ('request_id', Struct(_U32)),
+        ('shard_id', Optional(Struct(_U32))),
+        ('start_height', UInt64()),
+        ('count', Struct(_U32)),
+        ('collation_ids', Array(Hash())),
+    ]),
+    Schema(6, ShardAnnouncement, [
+        ('shard_number', Struct(_U32)),
+        ('total_shards', Struct(_U32)),
+    ]),
+    Schema(7, GossipSubscribe, [
+        ('topics', Array(Struct(_U32))),
+    ]),
+    Schema(8, GossipIHave, [
+        ('topic', Struct(_U32)),
+        ('msg_ids', Array(Hash())),
+    ]),
+    Schema(9, GossipIWant, [
+        ('msg_ids', Array(Hash())),
+    ]),
+    Schema(10, PeerHello, [
+        ('name', Text()),
+        ('port', Struct(_U16)),
+    ]),
+    Schema(11, MembershipHeartbeat, [
+        ('name', Text()),
+        ('port', Struct(_U16)),
+        ('version', UInt64()),
+    ]),
+    Schema(12, MembershipUpdate, [
+        ('version', UInt64()),
+        ('full', Bool()),
+        ('joined', Array(Nested(PeerHello))),
+        ('left', Array(Text())),
+    ]),
+    Schema(13, CollationResponse, [
+        ('request_id', Struct(_U32)),
+        ('tip_height', UInt64()),
+        ('headers', Array(Nested(CollationHeader))),
+        ('collations', Array(Nested(Collation))),
+    ]),
+    Schema(14, VoteCertificate, [
+        ('collation_id', Hash()),
+        ('shard_number', Struct(_U32)),
+        ('epoch', UInt64()),
+        ('committee', Array(PublicKey())),
+        ('proofs', Array(Blob(_U16))),
+        ('signers', Blob(_U16)),
+        ('signatures', Array(Blob(_U16))),
+    ]),
+    Schema(15, CrossShardReceipt, [
+        ('header', Nested(CollationHeader)),
+        ('certificate', Nested(VoteCertificate)),
+        ('shard_id', Struct(_U32)),
+        ('txns', Array(Nested(Transaction))),
+        ('leaf_count', Struct(_U32)),
+        ('indices', Array(Struct(_U32))),
+        ('branches', Array(Array(Hash()))),
+    ]),
+    Schema(16, SnapshotManifest, [
+        ('shard_id', Struct(_U32)),
+        ('height', UInt64()),
+        ('collation_id', Optional(Hash())),
+        ('chunk_hashes', Array(Hash())),
+    ]),
+    Schema(17, SnapshotRequest, [
+        ('request_id', Struct(_U32)),
+        ('shard_id', Struct(_U32)),
+        ('chunk_hashes', Array(Hash())),
+    ]),
+    Schema(18, SnapshotResponse, [
+        ('request_id', Struct(_U32)),
+        ('manifest', Optional(Nested(SnapshotManifest))),
+        ('chunks', Array(Blob())),
+    ]),
+]
+
+_SCHEMAS_BY_CLASS = {schema.cls: schema for schema in _SCHEMAS}
+_SCHEMAS_BY_TAG = {schema.tag: schema for schema in _SCHEMAS}
+
+
+def encode(obj):
+    """Encode a wire object into bytes
+
+    Args:
+        obj (BlockchainObject): One of the objects with a registered schema
+
+    Raises:
+        CodecError: If the object type has no schema or a field is invalid
+
+    Returns:
+        bytes: The encoded message
+    """
+
+    schema = _SCHEMAS_BY_CLASS.get(type(obj))
+    if schema is None:
+        raise CodecError(f'No schema for {type(obj).__name__}')
+
+    out = bytearray(_PREAMBLE.pack(CODEC_VERSION, schema.tag))
+    try:
+        schema.pack_fields(obj, out)
+    except (struct.error, TypeError, ValueError) as e:
+        raise CodecError(f'Cannot encode {type(obj).__name__}: {e}')
+    return bytes(out)
+
+
+def decode(data):
+    """Decode bytes produced by `encode` back into an object
+
+    Args:
+        data (bytes): The encoded message
+
+    Raises:
+        CodecError: If the message is malformed or of an unknown version
+
+    Returns:
+        BlockchainObject: The decoded object
+    """
+
+    view = memoryview(data)
+    try:
+        version, tag = _PREAMBLE.unpack_from(view, 0)
+        if version != CODEC_VERSION:
+            raise CodecError(f'Unsupported codec version {version}')
+
+        schema = _SCHEMAS_BY_TAG.get(tag)
+        if schema is None:
+            raise CodecError(f'Unknown type tag {tag}')
+
+        obj, offset = schema.unpack_fields(view, _PREAMBLE.size)
+    except (struct.error, ValueError, TypeError) as e:
+        raise CodecError(f'Malformed message: {e}')
+
+    if offset != len(view):
+        raise CodecError(f'{len(view) - offset} trailing bytes')
+    return obj
+
+
+def _wire_stamp(obj):
+    # the objects nested in `obj` on the wire, each followed by its version;
+    # an encoding of `obj` is valid while they are the same
+    stamp = list()
+    pending = [obj]
+    while pending:
+        parent = pending.pop()
+        for nested in _SCHEMAS_BY_CLASS[type(parent)].nested(parent):
+            stamp += (nested, getattr(nested, '_version', 0))
+            pending.append(nested)
+    return stamp
+
+
+class EncodedMessage(object):
+    """The wire form of an object, encoded and framed once
+
+    `framed` is a memoryview over the framed bytes, handed as is to every
+    connection the message is written to, and `payload` is a view of the
+    encoded message inside it. The encoding of an object is cached on the
+    object by `of`, so sending a message to many peers, or relaying a
+    received one, does not encode it again. The cache is dropped when an
+    attribute of the object, or of an object nested in it, is assigned.
+    """
+
+    __slots__ = ('framed', 'payload')
+
+    def __init__(self, payload):
+        """
+        Args:
+            payload (bytes): The message as produced by `encode`
+        """
+
+        framed = frame(payload)
+        self.framed = memoryview(framed)
+        self.payload = self.framed[len(framed) - len(payload):]
+
+    def __len__(self):
+        return len(self.framed)
+
+    @staticmethod
+    def of(obj):
+        """The cached EncodedMessage of `obj`, encoding it on first use
+
+        Raises:
+            CodecError: If the object cannot be encoded
+        """
+
+        cached = getattr(obj, '_encoded', None)
+        if cached is not None and cached[1] == _wire_stamp(obj):
+            return cached[0]
+        message = EncodedMessage(encode(obj))
+        object.__setattr__(obj, '_encoded', (message, _wire_stamp(obj)))
+        return message
+
+    @staticmethod
+    def received(payload):
+        """Decode a received payload, keeping it as the object's encoding
+
+        Raises:
+            CodecError: If the message is malformed
+        """
+
+        obj = decode(payload)
+        object.__setattr__(
+            obj, '_encoded', (EncodedMessage(payload), _wire_stamp(obj)))
+        return obj
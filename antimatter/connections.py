@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import random
+import socket
+import time
+
+
+class Resolver(object):
+    """Asynchronous, caching name resolution
+
+    Lookups run on the event loop's default executor, so a slow DNS server
+    never blocks the loop, and answers are cached for `ttl` seconds.
+    Concurrent lookups of the same name share a single query.
+    """
+
+    TTL = 300.
+
+    def __init__(self, evloop, ttl=None):
+        self.logger = logging.getLogger(Resolver.__name__)
+        self.evloop = evloop
+        self.ttl = ttl or Resolver.TTL
+        # (kind, name) -> (expiry, future)
+        self._cache = dict()
+
+    async def _lookup(self, key, query):
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return await entry[1]
+
+        future = asyncio.ensure_future(query(), loop=self.evloop)
+        self._cache[key] = (time.monotonic() + self.ttl, future)
+        try:
+            return await future
+        except OSError:
+            # failures are not cached
+            if self._cache.get(key, (None, None))[1] is future:
+                del self._cache[key]
+            raise
+
+    async def resolve(self, host, port):
+        """The first IP address of `host`
+
+        Raises:
+            OSError: If the name cannot be resolved
+        """
+
+        async def query():
+            infos = await self.evloop.getaddrinfo(
+                host, port, type=socket.SOCK_STREAM)
+            return infos[0][4][0]
+        return await self._lookup(('forward', host), query)
+
+    async def reverse(self, ip):
+        """The host name of `ip`, or `ip` itself if it has none"""
+        async def query():
+            try:
+                host, _ = await self.evloop.getnameinfo((ip, 0))
+            except OSError:
+                return ip
+            return host
+        return await self._lookup(('reverse', ip), query)
+
+
+class ConnectionManager(object):
+    """Dials peers concurrently and redials them when connections drop
+
+    At most `max_parallel` dials are in flight at once. A peer whose
+    connection is lost is redialed after an exponentially growing, jittered
+    delay, up to `max_attempts` times in a row.
+    """
+
+    MAX_PARALLEL = 8
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 30.
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, evloop, protocol_factory, resolver=None,
+                 max_parallel=None, backoff_base=None, backoff_max=None,
+                 max_attempts=None):
+        """
+        Args:
+            evloop (asyncio.AbstractEventLoop): The loop to dial on
+            protocol_factory (callable): Called with the dialed host name,
+                returns the protocol of the new connection
+            resolver (Resolver, optional): Defaults to a new Resolver
+            max_parallel (int, optional): Defaults to MAX_PARALLEL
+            backoff_base (float, optional): Defaults to BACKOFF_BASE. Delay
+                before the first redial.
+            backoff_max (float, optional): Defaults to BACKOFF_MAX
+            max_attempts (int, optional): Defaults to MAX_ATTEMPTS. Failed
+                redials before a peer is given up on.
+        """
+
+        self.logger = logging.getLogger(ConnectionManager.__name__)
+        self.evloop = evloop
+        self.protocol_factory = protocol_factory
+        self.resolver = resolver or Resolver(evloop)
+        self.backoff_base = backoff_base or ConnectionManager.BACKOFF_BASE
+        self.backoff_max = backoff_max or ConnectionManager.BACKOFF_MAX
+        self.max_attempts = max_attempts or ConnectionManager.MAX_ATTEMPTS
+        self.max_parallel = max_parallel or ConnectionManager.MAX_PARALLEL
+        self._dial_slots = asyncio.Semaphore(self.max_parallel)
+
+        # host -> consecutive failed redials
+        self.attempts = dict()
+        # host -> pending redial handle
+        self._redials = dict()
+        self.closed = False
+
+    async def dial(self, host, port):
+        """Open a connection to `host`
+
+        Returns:
+            asyncio.Protocol: The protocol of the connection, or None if
+                the host could not be reached
+        """
+
+        async with self._dial_slots:
+            try:
+                address = await self.resolver.resolve(host, port)
+                _, protocol = await self.evloop.create_connection(
+                    lambda: self.protocol_factory(host),
+                    host=address, port=port)
+            except OSError as e:
+                self.logger.info(f'Cannot connect to {host}: {e}')
+                return None
+        return protocol
+
+    async def dial_all(self, hosts, port, max_failures):
+        """Dial an open-ended sequence of hosts, such as StatefulSet pods
+
+        Hosts are taken from `hosts` in order and dialed concurrently until
+        `max_failures` hosts in a row after the last reachable one failed.
+        A None host counts as reachable without being dialed, to skip the
+        node itself.
+
+        Returns:
+            list: The protocols of the new connections
+        """
+
+        hosts = iter(hosts)
+        state = {'next': 0, 'last_ok': -1}
+        protocols = list()
+
+        async def worker():
+            while state['next'] <= state['last_ok'] + max_failures:
+                index = state['next']
+                state['next'] += 1
+                host = next(hosts)
+                protocol = None
+                if host is not None:
+                    protocol = await self.dial(host, port)
+                if host is None or protocol is not None:
+                    state['last_ok'] = max(state['last_ok'], index)
+                if protocol is not None:
+                    protocols.append(protocol)
+
+        await asyncio.gather(*[worker() for _ in range(self.max_parallel)])
+        return protocols
+
+    def connected(self, host):
+        """Reset the backoff of `host` after a successful connection"""
+        self.attempts.pop(host, None)
+        handle = self._redials.pop(host, None)
+        if handle is not None:
+            handle.cancel()
+
+    def forget(self, host):
+        """Stop redialing `host`"""
+        self.connected(host)
+
+    def redial(self, host, port):
+        """Schedule a reconnect to `host` with exponential backoff"""
+        if self.closed or host in self._redials:
+            return
+
+        attempt = self.attempts.get(host, 0)
+        if attempt >= self.max_attempts:
+            self.logger.warning(f'Giving up on {host} after {attempt} '
+                                f'attempts')
+            self.attempts.pop(host, None)
+            return
+        self.attempts[host] = attempt + 1
+
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        # jitter keeps peers that lost each other from redialing in lockstep
+        delay *= random.uniform(0.5, 1.)
+        self.logger.info(f'Reconnecting to {host} in {delay:.1f}s')
+        self._redials[host] = self.evloop.call_later(
+            delay, self._start_redial, host, port)
+
+    def _start_redial(self, host, port):
+        del self._redials[host]
+        self.connect(host, port)
+
+    def connect(self, host, port):
+        """Dial `host` in the background, redialing until it succeeds"""
+        future = asyncio.ensure_future(self.dial(host, port), loop=self.evloop)
+        future.add_done_callback(
+            lambda f: self._redial_done(f.result(), host, port))
+
+    def _redial_done(self, protocol, host, port):
+        if protocol is None:
+            self.redial(host, port)
+
+    def close(self):
+        self.closed = True
+        for handle in self._redials.values():
+            handle.cancel()
+        self._redials = dict()
@@ -1,7 +1,9 @@
+from collections import OrderedDict
+
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
 
 
 def generate_hash(data):
@@ -12,7 +14,102 @@ def generate_hash(data):
     return digest.finalize()
 
 
+class KeyCache(object):
+    """Bounded LRU cache of deserialized public keys
+
+    Maps the serialized (PEM) bytes of a public key to an `Entry` holding
+    the loaded key object and the key's fingerprint, so each key is only
+    parsed once while it stays in the cache.
+    """
+
+    DEFAULT_SIZE = 1024
+
+    class Entry(object):
+        __slots__ = ('key', 'fingerprint', 'shard')
+
+        def __init__(self, key, fingerprint):
+            self.key = key
+            self.fingerprint = fingerprint
+            # (ShardMap, shard) of the last shard assignment computed
+            self.shard = None
+
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = KeyCache.DEFAULT_SIZE
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key_bytes):
+        """Look up, loading on a miss, the public key serialized as `key_bytes`
+
+        Args:
+            key_bytes (bytes): The PEM encoded public key
+
+        Returns:
+            KeyCache.Entry: The cached key object and fingerprint
+        """
+
+        if not isinstance(key_bytes, bytes):
+            key_bytes = bytes(key_bytes)
+
+        entry = self._entries.get(key_bytes)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key_bytes)
+            return entry
+
+        self.misses += 1
+        entry = KeyCache.Entry(
+            serialization.load_pem_public_key(
+                key_bytes, backend=default_backend()),
+            generate_hash(key_bytes))
+        self._entries[key_bytes] = entry
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+        }
+
+
+# process-wide cache of parsed public keys
+key_cache = KeyCache()
+
+
+def load_public_key(public_key):
+    """Return the key object for a PEM public key, using `key_cache`
+
+    Args:
+        public_key (bytes or public key object): Key objects are returned
+            unchanged
+
+    Returns:
+        rsa.RSAPublicKey or ed25519.Ed25519PublicKey: The public key object
+    """
+
+    if isinstance(public_key, (rsa.RSAPublicKey, ed25519.Ed25519PublicKey)):
+        return public_key
+    return key_cache.get(public_key).key
+
+
 class RSA:
+
     @staticmethod
     def generate_rsa_key():
         """Generate a new RSA private key
@@ -86,12 +183,7 @@ class RSA:
         if not isinstance(data, bytes):
             data = bytes(data)
 
-        if not (isinstance(public_key, rsa.RSAPublicKey) or
-                isinstance(public_key, rsa.RSAPublicKeyWithSerialization)):
-            public_key = serialization.load_pem_public_key(
-                public_key,
-                backend=default_backend()
-            )
+        public_key = load_public_key(public_key)
 
         try:
             public_key.verify(
@@ -108,8 +200,137 @@ class RSA:
         return True
 
 
+class Ed25519:
+    @staticmethod
+    def generate_key():
+        """Generate a new Ed25519 private key
+
+        Returns:
+            ed25519.Ed25519PrivateKey: The Ed25519 private key object
+        """
+
+        return ed25519.Ed25519PrivateKey.generate()
+
+    @staticmethod
+    def generate_signature(private_key, data):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        return private_key.sign(data)
+
+    @staticmethod
+    def verify_signature(public_key, data, sig):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+
+        public_key = load_public_key(public_key)
+
+        try:
+            public_key.verify(sig, data)
+        except InvalidSignature:
+            return False
+        return True
+
+
+# signature schemes selectable by name, e.g. for newly generated keys
+SIGNATURE_SCHEMES = {
+    'rsa': RSA,
+    'ed25519': Ed25519,
+}
+
+
+def get_scheme(key):
+    """The signature scheme (`RSA` or `Ed25519`) a key object belongs to"""
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return RSA
+    elif isinstance(key, (ed25519.Ed25519PrivateKey,
+                          ed25519.Ed25519PublicKey)):
+        return Ed25519
+    else:
+        raise TypeError(f'Unsupported key type {type(key).__name__}')
+
+
+def generate_key(scheme='rsa'):
+    scheme = SIGNATURE_SCHEMES[scheme]
+    if scheme is RSA:
+        return RSA.generate_rsa_key()
+    return scheme.generate_key()
+
+
+def load_private_key(key_file):
+    """Load a PEM private key of any supported scheme
+
+    Returns:
+        The private key object, or None if the file cannot be loaded
+    """
+
+    private_key = RSA.get_rsa_key(key_file)
+    if private_key is None:
+        return None
+    try:
+        get_scheme(private_key)
+    except TypeError:
+        return None
+    return private_key
+
+
+def save_private_key(private_key, key_file):
+    if get_scheme(private_key) is RSA:
+        return RSA.save_rsa_key(private_key, key_file)
+
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    with open(key_file, 'wb') as f:
+        f.write(pem)
+
+
+def get_pub_key_bytes(key):
+    if isinstance(key, (rsa.RSAPrivateKey, ed25519.Ed25519PrivateKey)):
+        key = key.public_key()
+    get_scheme(key)
+    return key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+def generate_signature(private_key, data):
+    return get_scheme(private_key).generate_signature(private_key, data)
+
+
+def verify_signature(public_key, data, sig):
+    """Verify `sig` with whichever scheme `public_key` belongs to
+
+    Args:
+        public_key (bytes or public key object): PEM bytes or a key object
+        data (bytes): The signed data
+        sig (bytes): The signature
+
+    Returns:
+        bool: True if the signature is valid, False for keys that do not
+            load or belong to no supported scheme
+    """
+
+    try:
+        public_key = load_public_key(public_key)
+        scheme = get_scheme(public_key)
+    except (ValueError, TypeError):
+        return False
+    return scheme.verify_signature(public_key, data, sig)
+
+
 class VRF:
-    """RSA-based VRF
+    """Verifiable random function over a node's signing key
+
+    The proof pi is a deterministic signature of the input, and the output
+    beta is the hash of pi. Only the owner of the key can compute beta for
+    an input, always gets the same beta for it, and anyone holding the
+    public key can check it. Keys sign with RSA PKCS#1 v1.5, whose
+    signatures are unique, like the RSA-FDH VRF of the draft below. Ed25519
+    keys are not accepted: their owner can make many valid signatures of
+    the same input, and so pick among many outputs.
 
     Adapted from https://tools.ietf.org/html/draft-irtf-cfrg-vrf-01
     """
@@ -124,38 +345,30 @@ class VRF:
         self.proof = proof
 
     @staticmethod
-    def compute_vrf(private_key, data):
-        pi = private_key.sign(
-            data,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
+    def from_proof(proof):
+        """The VRF claimed by `proof`, to be checked with `verify`"""
+        return VRF(value=generate_hash(proof), proof=proof)
 
-        digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-        digest.update(data)
-        beta = digest.finalize()
+    @staticmethod
+    def supports(key):
+        """Whether `key`, private or public, can prove VRF outputs"""
+        return get_scheme(key) is RSA
 
-        return VRF(value=beta, proof=pi)
+    @staticmethod
+    def compute_vrf(private_key, data):
+        if not VRF.supports(private_key):
+            raise ValueError('VRF proofs need an RSA key')
+        pi = private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        return VRF.from_proof(pi)
 
     def verify(self, public_key, data):
         try:
+            public_key = load_public_key(public_key)
+            if not VRF.supports(public_key):
+                return False
             public_key.verify(
-                self.proof,
-                data,
-                padding.PSS(
-                    mgf=padding.MGF1(hashes.SHA256()),
-                    salt_length=padding.PSS.MAX_LENGTH
-                ),
-                hashes.SHA256()
-            )
-        except Exception:
+                self.proof, data, padding.PKCS1v15(), hashes.SHA256())
+        except (InvalidSignature, TypeError, ValueError):
             return False
 
-        digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-        digest.update(data)
-        beta = digest.finalize()
-
-        return beta == self.value
+        return generate_hash(self.proof) == self.value
@@ -0,0 +1,90 @@
+import struct
+
+
+class FrameError(Exception):
+    pass
+
+
+class FrameDecoder(object):
+    """Incremental decoder for length-prefixed frames
+
+    Every frame on the wire is a 4 byte big-endian payload length followed by
+    the payload itself. Chunks handed to `feed` may contain any number of
+    frames, or only part of one; incomplete data is kept in a per-connection
+    buffer until the rest of the frame arrives.
+    """
+
+    HEADER = struct.Struct('!I')
+    MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, max_frame_size=None):
+        if max_frame_size is None:
+            max_frame_size = FrameDecoder.MAX_FRAME_SIZE
+        self.max_frame_size = max_frame_size
+        self._buf = bytearray()
+        # offset of the first unconsumed byte in _buf
+        self._pos = 0
+
+    def __len__(self):
+        """Number of buffered bytes not yet returned as a frame"""
+        return len(self._buf) - self._pos
+
+    def feed(self, data):
+        """Buffer `data` and return the payloads of all completed frames
+
+        Args:
+            data (bytes): A chunk of bytes as read from the transport
+
+        Raises:
+            FrameError: If a frame header announces a payload larger than
+                `max_frame_size`
+
+        Returns:
+            list: The payload (bytes) of every frame completed by `data`
+        """
+
+        self._buf += data
+        frames = list()
+        header_size = FrameDecoder.HEADER.size
+
+        with memoryview(self._buf) as view:
+            while len(self._buf) - self._pos >= header_size:
+                length, = FrameDecoder.HEADER.unpack_from(self._buf, self._pos)
+                if length > self.max_frame_size:
+                    raise FrameError(f'Frame of {length} bytes exceeds '
+                                     f'limit of {self.max_frame_size}')
+
+                start = self._pos + header_size
+                end = start + length
+                if end > len(self._buf):
+                    # wait for the rest of the frame
+                    break
+
+                frames.append(bytes(view[start:end]))
+                self._pos = end
+
+        self._compact()
+        return frames
+
+    def _compact(self):
+        # drop consumed bytes only once they make up most of the buffer, so
+        # large frames arriving in many chunks are not re-copied every time
+        if self._pos == len(self._buf):
+            self._buf.clear()
+            self._pos = 0
+        elif self._pos > len(self._buf) // 2:
+            del self._buf[:self._pos]
+            self._pos = 0
+
+
+def frame(payload):
+    """Prefix `payload` with its length
+
+    Args:
+        payload (bytes): The message to send
+
+    Returns:
+        bytes: The framed message, ready to be written to a transport
+    """
+
+    return FrameDecoder.HEADER.pack(len(payload)) + bytes(payload)
@@ -0,0 +1,201 @@
+import logging
+import math
+import random
+import time
+
+from collections import OrderedDict
+
+from objects import GossipIHave, GossipIWant, GossipSubscribe
+
+
+class TTLCache(object):
+    """Insertion-ordered map whose entries expire `ttl` seconds after insert
+
+    Expired entries are dropped from the front of the map whenever it is
+    accessed, so the cost of expiry is amortized over the inserts.
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (expiry, value), oldest first
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        self._expire()
+        return len(self._entries)
+
+    def __contains__(self, key):
+        self._expire()
+        return key in self._entries
+
+    def _expire(self):
+        now = self.clock()
+        while self._entries:
+            key, (expiry, _) = next(iter(self._entries.items()))
+            if expiry > now:
+                break
+            del self._entries[key]
+
+    def add(self, key, value=None):
+        """Insert `key` unless present
+
+        Returns:
+            bool: False if `key` was already in the cache
+        """
+
+        self._expire()
+        if key in self._entries:
+            return False
+        self._entries[key] = (self.clock() + self.ttl, value)
+        return True
+
+    def get(self, key, default=None):
+        self._expire()
+        entry = self._entries.get(key)
+        return default if entry is None else entry[1]
+
+
+class Gossip(object):
+    """Topic based gossip between participants
+
+    Every shard is a topic, and peers tell each other which topics they
+    subscribe to. A new message is pushed in full to `fanout` random
+    subscribers of its topic only. The ids of the messages sent since the
+    last heartbeat are announced to as many other subscribers in a single
+    IHAVE, and a peer missing one of them asks for it with an IWANT. Unless
+    set, the fanout grows with the logarithm of the number of subscribers,
+    so the copies of a message sent per node grow logarithmically with the
+    size of the cluster instead of linearly.
+
+    Message ids are remembered for `seen_ttl` seconds so a message is only
+    handled and relayed once per node, and the messages themselves are kept
+    for `history_ttl` seconds to answer IWANTs.
+    """
+
+    MIN_FANOUT = 2
+    HEARTBEAT_INTERVAL = 1.
+    SEEN_TTL = 120.
+    HISTORY_TTL = 5.
+
+    def __init__(self, network, evloop, fanout=None, heartbeat_interval=None,
+                 seen_ttl=None, history_ttl=None):
+        """
+        Args:
+            network (p2p.Network): Used to reach the peers
+            evloop (asyncio.AbstractEventLoop): Runs the heartbeat
+            fanout (int, optional): Defaults to log(subscribers), at least
+                MIN_FANOUT. Number of subscribers pushed each message.
+            heartbeat_interval (float, optional): Defaults to
+                HEARTBEAT_INTERVAL. Seconds between IHAVE announcements.
+            seen_ttl (float, optional): Defaults to SEEN_TTL
+            history_ttl (float, optional): Defaults to HISTORY_TTL
+        """
+
+        self.logger = logging.getLogger(Gossip.__name__)
+        self.network = network
+        self.evloop = evloop
+        self.fanout = fanout
+        self.heartbeat_interval = heartbeat_interval or \
+            Gossip.HEARTBEAT_INTERVAL
+
+        # our own topics, and peer -> topics of the peer
+        self.topics = set()
+        self.peer_topics = dict()
+        self.seen = TTLCache(seen_ttl or Gossip.SEEN_TTL)
+        # msg_id -> (topic, message), for answering IWANTs
+        self.history = TTLCache(history_ttl or Gossip.HISTORY_TTL)
+        # topic -> ids of messages sent since the last heartbeat
+        self._announce = dict()
+        self.sent = 0
+
+        self._heartbeat_handle = self.evloop.call_later(
+            self.heartbeat_interval, self.heartbeat)
+
+    def subscribers(self, topic):
+        return [peer for peer, topics in self.peer_topics.items()
+                if topic in topics]
+
+    def _fanout(self, count):
+        if self.fanout is not None:
+            return self.fanout
+        return max(Gossip.MIN_FANOUT, math.ceil(math.log(count + 1)))
+
+    def subscribe(self, topics):
+        """Replace our topics and tell every peer"""
+        self.topics = set(topics)
+        self.network.send_obj(list(self.peer_topics),
+                              GossipSubscribe(sorted(self.topics)))
+
+    def peer_connected(self, peer):
+        self.peer_topics.setdefault(peer, frozenset())
+        self.network.send_obj([peer], GossipSubscribe(sorted(self.topics)))
+
+    def peer_lost(self, peer):
+        self.peer_topics.pop(peer, None)
+
+    def receive(self, msg_id):
+        """Record a message arriving from the network
+
+        Returns:
+            bool: False if the message was seen before and must be dropped
+        """
+
+        return self.seen.add(msg_id)
+
+    def publish(self, topic, message, msg_id, source=None):
+        """Push a new or relayed message to a few subscribers of `topic`
+
+        Args:
+            topic (int): The shard the message belongs to
+            message (BlockchainObject): The message
+            msg_id (bytes): The id of the message, such as its txn_id
+            source (str, optional): The peer the message came from, which is
+                not sent it back
+        """
+
+        self.seen.add(msg_id)
+        self.history.add(msg_id, (topic, message))
+
+        peers = [peer for peer in self.subscribers(topic) if peer != source]
+        if not peers:
+            # nobody announced the topic yet, hand the message to any peers
+            # and let them route it
+            peers = [peer for peer in self.peer_topics if peer != source]
+
+        fanout = self._fanout(len(peers))
+        targets = random.sample(peers, min(fanout, len(peers)))
+        self.network.send_obj(targets, message)
+        self.sent += len(targets)
+        self._announce.setdefault(topic, list()).append(msg_id)
+
+    def heartbeat(self):
+        for topic, msg_ids in self._announce.items():
+            peers = self.subscribers(topic)
+            fanout = self._fanout(len(peers))
+            targets = random.sample(peers, min(fanout, len(peers)))
+            self.network.send_obj(targets, GossipIHave(topic, msg_ids))
+        self._announce = dict()
+
+        self._heartbeat_handle = self.evloop.call_later(
+            self.heartbeat_interval, self.heartbeat)
+
+    def handle_message(self, message, peer):
+        if isinstance(message, GossipSubscribe):
+            self.peer_topics[peer] = frozenset(message.topics)
+
+        elif isinstance(message, GossipIHave):
+            wanted = [msg_id for msg_id in message.msg_ids
+                      if msg_id not in self.seen]
+            if wanted:
+                self.network.send_obj([peer], GossipIWant(wanted))
+
+        elif isinstance(message, GossipIWant):
+            for msg_id in message.msg_ids:
+                entry = self.history.get(msg_id)
+                if entry is not None:
+                    self.network.send_obj([peer], entry[1])
+                    self.sent += 1
+
+    def close(self):
+        self._heartbeat_handle.cancel()
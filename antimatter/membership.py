@@ -0,0 +1,242 @@
+import logging
+import time
+
+from collections import OrderedDict, deque
+
+from objects import MembershipHeartbeat, MembershipUpdate, PeerHello
+
+
+class MembershipView(object):
+    """Versioned set of live nodes, as kept by the bootstrapper
+
+    Every join and every leave bumps the version and is appended to a change
+    log, so a node that saw version N is brought up to date with the
+    changes since N instead of the whole view. Nodes are dropped once they
+    have not sent a heartbeat for `expiry` seconds. Members are kept in
+    heartbeat order, so expiring them only looks at the stalest ones.
+    """
+
+    EXPIRY = 15.
+    MAX_LOG = 4096
+
+    def __init__(self, expiry=None, max_log=None, clock=time.monotonic):
+        self.expiry = expiry or MembershipView.EXPIRY
+        self.clock = clock
+        self.version = 0
+        # name -> (port, time of the last heartbeat), stalest first
+        self.members = OrderedDict()
+        # (version, name, port or None if the node left), oldest first
+        self._log = deque(maxlen=max_log or MembershipView.MAX_LOG)
+
+    def __len__(self):
+        return len(self.members)
+
+    def _change(self, name, port):
+        self.version += 1
+        self._log.append((self.version, name, port))
+
+    def heartbeat(self, name, port):
+        previous = self.members.pop(name, None)
+        self.members[name] = (port, self.clock())
+        if previous is None or previous[0] != port:
+            self._change(name, port)
+
+    def expire(self):
+        """Drop the nodes whose heartbeats stopped
+
+        Returns:
+            list: The names of the dropped nodes
+        """
+
+        deadline = self.clock() - self.expiry
+        expired = list()
+        while self.members:
+            name, (_, last_seen) = next(iter(self.members.items()))
+            if last_seen > deadline:
+                break
+            del self.members[name]
+            self._change(name, None)
+            expired.append(name)
+        return expired
+
+    def snapshot(self):
+        return MembershipUpdate(
+            self.version, full=True,
+            joined=[PeerHello(name, port)
+                    for name, (port, _) in self.members.items()])
+
+    def delta(self, since):
+        """The changes after version `since`
+
+        Returns:
+            MembershipUpdate: Only the changes, or the full view if the
+                change log no longer reaches back to `since`
+        """
+
+        first = self._log[0][0] if self._log else self.version + 1
+        if since > self.version or since + 1 < first:
+            return self.snapshot()
+
+        # the log holds consecutive versions, so `since` maps to an index
+        changes = dict()
+        for i in range(since + 1 - first, len(self._log)):
+            _, name, port = self._log[i]
+            changes[name] = port
+        return MembershipUpdate(
+            self.version,
+            joined=[PeerHello(name, port)
+                    for name, port in changes.items() if port is not None],
+            left=[name for name, port in changes.items() if port is None])
+
+
+class BootstrapServer(object):
+    """Serves a MembershipView to long-lived subscriber connections
+
+    A heartbeat is answered straight away only if the sender is behind.
+    Otherwise changes are pushed every `push_interval` seconds, one delta
+    per distinct version the subscribers are at, so the work per change
+    stays proportional to the number of subscribers that need it.
+    """
+
+    PUSH_INTERVAL = 1.
+
+    def __init__(self, evloop, view=None, push_interval=None):
+        self.logger = logging.getLogger(BootstrapServer.__name__)
+        self.evloop = evloop
+        self.view = view or MembershipView()
+        self.push_interval = push_interval or BootstrapServer.PUSH_INTERVAL
+        # subscriber -> membership version it was last sent
+        self.subscribers = dict()
+        self._handle = self.evloop.call_later(self.push_interval, self.tick)
+
+    def heartbeat(self, subscriber, message):
+        """Handle a MembershipHeartbeat; `subscriber` has a `send` method"""
+        self.view.heartbeat(message.name, message.port)
+        if message.version != self.view.version:
+            subscriber.send(self.view.delta(message.version))
+        self.subscribers[subscriber] = self.view.version
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.pop(subscriber, None)
+
+    def tick(self):
+        for name in self.view.expire():
+            self.logger.info(f'{name} expired')
+
+        deltas = dict()
+        for subscriber, version in self.subscribers.items():
+            if version == self.view.version:
+                continue
+            if version not in deltas:
+                deltas[version] = self.view.delta(version)
+            subscriber.send(deltas[version])
+            self.subscribers[subscriber] = self.view.version
+
+        self._handle = self.evloop.call_later(self.push_interval, self.tick)
+
+    def close(self):
+        self._handle.cancel()
+
+
+class MembershipClient(object):
+    """A node's subscription to the bootstrapper
+
+    The connection to the bootstrapper is kept open: heartbeats carrying
+    the last version seen go out every `heartbeat_interval` seconds, and
+    membership changes come back as deltas. `on_join(name, port)` and
+    `on_leave(name)` are called for every change to the local view. A lost
+    connection is redialed with backoff by `manager`.
+    """
+
+    HEARTBEAT_INTERVAL = 5.
+
+    def __init__(self, evloop, name, port, manager, on_join, on_leave,
+                 heartbeat_interval=None):
+        """
+        Args:
+            evloop (asyncio.AbstractEventLoop): Runs the heartbeats
+            name (str): This node's name
+            port (int): This node's peer port
+            manager (connections.ConnectionManager): Dials the bootstrapper;
+                its protocols call `attach` and `detach`
+            on_join (callable): Called with (name, port) of new members
+            on_leave (callable): Called with the name of departed members
+            heartbeat_interval (float, optional): Defaults to
+                HEARTBEAT_INTERVAL
+        """
+
+        self.logger = logging.getLogger(MembershipClient.__name__)
+        self.evloop = evloop
+        self.name = name
+        self.port = port
+        self.manager = manager
+        self.on_join = on_join
+        self.on_leave = on_leave
+        self.heartbeat_interval = heartbeat_interval or \
+            MembershipClient.HEARTBEAT_INTERVAL
+
+        # name -> port of every other member
+        self.members = dict()
+        self.version = 0
+        self.protocol = None
+        self.address = None
+        self._handle = None
+
+    async def connect(self, host, port):
+        self.address = (host, port)
+        if await self.manager.dial(host, port) is None:
+            self.manager.redial(host, port)
+
+    def attach(self, protocol):
+        """Called once the connection to the bootstrapper is up"""
+        self.protocol = protocol
+        self.manager.connected(self.address[0])
+        self.heartbeat()
+
+    def detach(self, protocol):
+        """Called when the connection to the bootstrapper is lost"""
+        if self.protocol is not protocol:
+            return
+        self.protocol = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self.logger.warning('Lost connection to the bootstrapper')
+        self.manager.redial(*self.address)
+
+    def heartbeat(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        if self.protocol is not None:
+            self.protocol.send(
+                MembershipHeartbeat(self.name, self.port, self.version))
+        self._handle = self.evloop.call_later(
+            self.heartbeat_interval, self.heartbeat)
+
+    def apply(self, update):
+        """Bring the local view up to `update.version`"""
+        if update.full:
+            current = {member.name: member.port for member in update.joined}
+            left = [name for name in self.members if name not in current]
+            joined = [(name, port) for name, port in current.items()
+                      if self.members.get(name) != port]
+        else:
+            left = list(update.left)
+            joined = [(member.name, member.port) for member in update.joined]
+        self.version = update.version
+
+        for name in left:
+            if self.members.pop(name, None) is not None:
+                self.on_leave(name)
+        for name, port in joined:
+            if name == self.name:
+                continue
+            self.members[name] = port
+            self.on_join(name, port)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        self.manager.close()
+        if self.protocol is not None:
+            self.protocol.transport.close()
@@ -0,0 +1,173 @@
+import logging
+
+from collections import OrderedDict
+
+from blockchain import Shard
+
+
+class Mempool(object):
+    """Pool of verified transactions waiting to be put in a collation
+
+    Transactions are queued per shard in arrival order. A transaction that
+    spends a coin already spent by a pooled transaction is rejected, so the
+    pool never holds conflicting transactions. Once the pool grows past
+    `max_bytes`, the oldest transactions of the largest shard queue are
+    evicted. Lookups and removals by txn_id are O(1).
+
+    The receipts of transfers from other shards wait in a separate queue,
+    keyed by their digest, of at most MAX_RECEIPTS receipts.
+    """
+
+    MAX_BYTES = 64 * 1024 * 1024
+    MAX_RECEIPTS = 4096
+
+    def __init__(self, max_bytes=None, shard_of=None):
+        """
+        Args:
+            max_bytes (int, optional): Defaults to MAX_BYTES. Approximate
+                memory cap, counted as serialized transaction bytes.
+            shard_of (callable, optional): Defaults to Shard.shard_of_key.
+                Maps a sender public key to its shard.
+        """
+
+        self.logger = logging.getLogger(Mempool.__name__)
+        self.max_bytes = max_bytes or Mempool.MAX_BYTES
+        self.shard_of = shard_of or Shard.shard_of_key
+
+        # shard -> OrderedDict(txn_id -> txn), oldest first
+        self._queues = dict()
+        # shard -> bytes held in that shard's queue
+        self._queue_bytes = dict()
+        # txn_id -> shard
+        self._shards = dict()
+        # input coin_id -> txn_id of the pooled txn spending it
+        self._spent_by = dict()
+        # receipt digest -> CrossShardReceipt, oldest first
+        self._receipts = OrderedDict()
+        self.size_bytes = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._shards)
+
+    def __contains__(self, txn_id):
+        return txn_id in self._shards
+
+    @staticmethod
+    def _txn_size(txn):
+        return len(txn.serialize()) + len(txn.src_sig or b'')
+
+    def get(self, txn_id):
+        shard = self._shards.get(txn_id)
+        if shard is None:
+            return None
+        return self._queues[shard][txn_id]
+
+    def shard_size(self, shard):
+        """Number of transactions queued for `shard`"""
+        return len(self._queues.get(shard, ()))
+
+    def conflicts(self, txn):
+        """txn_ids of pooled transactions spending an input of `txn`"""
+        return {self._spent_by[coin_id] for coin_id in txn.inputs
+                if coin_id in self._spent_by} - {txn.txn_id}
+
+    def add(self, txn):
+        """Queue a transaction
+
+        Returns:
+            bool: False if the transaction is already pooled or spends a coin
+                spent by a pooled transaction
+        """
+
+        if txn.txn_id in self._shards:
+            return False
+        if self.conflicts(txn):
+            self.logger.warning(f'Rejecting conflicting transaction: {txn}')
+            return False
+
+        shard = self.shard_of(txn.src_pk)
+        self._queues.setdefault(shard, OrderedDict())[txn.txn_id] = txn
+        self._shards[txn.txn_id] = shard
+        for coin_id in txn.inputs:
+            self._spent_by[coin_id] = txn.txn_id
+
+        size = Mempool._txn_size(txn)
+        self._queue_bytes[shard] = self._queue_bytes.get(shard, 0) + size
+        self.size_bytes += size
+
+        self._evict()
+        return txn.txn_id in self._shards
+
+    def remove(self, txn_id):
+        """Drop a transaction, returning it or None if it was not pooled"""
+        shard = self._shards.pop(txn_id, None)
+        if shard is None:
+            return None
+
+        txn = self._queues[shard].pop(txn_id)
+        for coin_id in txn.inputs:
+            if self._spent_by.get(coin_id) == txn_id:
+                del self._spent_by[coin_id]
+
+        size = Mempool._txn_size(txn)
+        self._queue_bytes[shard] -= size
+        self.size_bytes -= size
+        return txn
+
+    def add_receipt(self, receipt):
+        """Queue a receipt, returning False if it is already pooled"""
+        digest = receipt.digest()
+        if digest in self._receipts:
+            return False
+        self._receipts[digest] = receipt
+        while len(self._receipts) > Mempool.MAX_RECEIPTS:
+            self._receipts.popitem(last=False)
+            self.evicted += 1
+        return True
+
+    def remove_receipt(self, digest):
+        return self._receipts.pop(digest, None)
+
+    def has_receipt(self, digest):
+        return digest in self._receipts
+
+    def receipt_count(self):
+        return len(self._receipts)
+
+    def remove_collation(self, collation):
+        """Drop the transactions and receipts of an accepted collation
+
+        Pooled transactions spending the same coins can never be valid any
+        more, so they are dropped as well.
+        """
+
+        for txn in collation.txns:
+            self.remove(txn.txn_id)
+            for txn_id in self.conflicts(txn):
+                self.remove(txn_id)
+        for receipt in collation.receipts:
+            self.remove_receipt(receipt.digest())
+
+    def peek(self, shard):
+        """Iterate over the transactions of `shard`, oldest first
+
+        The pool must not be modified while iterating.
+        """
+
+        return iter(self._queues.get(shard, {}).values())
+
+    def peek_receipts(self):
+        """Iterate over the pooled receipts, oldest first
+
+        The pool must not be modified while iterating.
+        """
+
+        return iter(self._receipts.values())
+
+    def _evict(self):
+        while self.size_bytes > self.max_bytes and self._shards:
+            shard = max(self._queue_bytes, key=self._queue_bytes.get)
+            txn_id = next(iter(self._queues[shard]))
+            self.remove(txn_id)
+            self.evicted += 1
@@ -0,0 +1,144 @@
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+
+
+# leaves and internal nodes are hashed with different prefixes so an internal
+# node can never be passed off as a leaf
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def _primed_hash(prefix):
+    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+    digest.update(prefix)
+    return digest
+
+
+_LEAF_HASH = _primed_hash(LEAF_PREFIX)
+_NODE_HASH = _primed_hash(NODE_PREFIX)
+
+EMPTY_ROOT = _primed_hash(b'').finalize()
+
+
+def hash_leaves(leaves):
+    """Hash a batch of leaves
+
+    The leaf prefix is absorbed once and the resulting hash state is copied
+    for every leaf, instead of setting up a new hash per leaf.
+
+    Args:
+        leaves (iterable): The leaf data (bytes)
+
+    Returns:
+        list: The leaf hashes
+    """
+
+    hashed = list()
+    for leaf in leaves:
+        digest = _LEAF_HASH.copy()
+        digest.update(bytes(leaf))
+        hashed.append(digest.finalize())
+    return hashed
+
+
+def hash_node(left, right):
+    digest = _NODE_HASH.copy()
+    digest.update(left)
+    digest.update(right)
+    return digest.finalize()
+
+
+class MerkleProof(object):
+    """Inclusion proof of a single leaf
+
+    Only the sibling hashes along the path to the root are stored. Whether
+    each sibling sits left or right, and which levels have no sibling at all,
+    follows from the leaf index and the number of leaves.
+    """
+
+    def __init__(self, index, size, siblings):
+        self.index = index
+        self.size = size
+        self.siblings = siblings
+
+    def compute_root(self, leaf):
+        """Fold `leaf` up the tree using the sibling hashes
+
+        Returns:
+            bytes: The root implied by the proof, or None if the proof is
+                malformed
+        """
+
+        if not 0 <= self.index < self.size:
+            return None
+
+        node = hash_leaves([leaf])[0]
+        index, size = self.index, self.size
+        siblings = iter(self.siblings)
+        try:
+            while size > 1:
+                if index % 2 == 1:
+                    node = hash_node(next(siblings), node)
+                elif index + 1 < size:
+                    node = hash_node(node, next(siblings))
+                # else: the last node of an odd level is promoted as is
+                index //= 2
+                size = (size + 1) // 2
+        except StopIteration:
+            return None
+
+        if next(siblings, None) is not None:
+            return None
+        return node
+
+    def verify(self, leaf, root):
+        """Check that `leaf` is included in the tree with the given root"""
+        return self.compute_root(leaf) == root
+
+
+class MerkleTree(object):
+    """Merkle tree over a list of leaves, such as transaction ids
+
+    All levels are kept after construction, so the root and inclusion
+    proofs are served without rehashing. Odd nodes at the end of a level are
+    promoted to the next level unchanged.
+    """
+
+    def __init__(self, leaves):
+        level = hash_leaves(leaves)
+        self.levels = [level]
+        while len(level) > 1:
+            parents = [hash_node(level[i], level[i + 1])
+                       for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2 == 1:
+                parents.append(level[-1])
+            level = parents
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0]
+
+    def proof(self, index):
+        """Build the inclusion proof of the leaf at `index`
+
+        Returns:
+            MerkleProof: The proof, O(log n) hashes long
+        """
+
+        if not 0 <= index < len(self):
+            raise IndexError(f'No leaf at index {index}')
+
+        siblings = list()
+        position = index
+        for level in self.levels[:-1]:
+            sibling = position ^ 1
+            if sibling < len(level):
+                siblings.append(level[sibling])
+            position //= 2
+        return MerkleProof(index, len(self), siblings)
@@ -1,31 +1,171 @@
 import abc
 import pickle
+import struct
 
-from crypto import generate_hash, RSA
+from collections import namedtuple
+
+from crypto import generate_hash, generate_signature
+from merkle import MerkleProof, MerkleTree
+
+
+# transaction and coin values are integers, in units of 1 / VALUE_SCALE coins
+VALUE_SCALE = 10 ** 8
+# integers are serialized as signed 64 bit values, see `serialize_items`
+MAX_INT = 2 ** 63 - 1
+# every owner of the genesis allocation starts out with one coin of this value
+GENESIS_VALUE = 1000 * VALUE_SCALE
+# parent of the genesis coins, which no transaction created
+GENESIS_TXN = b'\x00' * 32
+
+# tags of the canonical serialization, see `serialize_items`
+_NONE, _BOOL, _INT, _FLOAT, _BYTES, _STR, _SEQ = range(7)
+
+_ITEM_HEADER = struct.Struct('!BI')
+_F64 = struct.Struct('!d')
+
+
+def _flatten(value, parts):
+    if value is None:
+        parts += (_ITEM_HEADER.pack(_NONE, 0),)
+    elif isinstance(value, bool):
+        parts += (_ITEM_HEADER.pack(_BOOL, 1), b'\x01' if value else b'\x00')
+    elif isinstance(value, int):
+        data = value.to_bytes(8, 'big', signed=True)
+        parts += (_ITEM_HEADER.pack(_INT, 8), data)
+    elif isinstance(value, float):
+        parts += (_ITEM_HEADER.pack(_FLOAT, 8), _F64.pack(value))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        parts += (_ITEM_HEADER.pack(_BYTES, len(value)), value)
+    elif isinstance(value, str):
+        data = value.encode('UTF-8')
+        parts += (_ITEM_HEADER.pack(_STR, len(data)), data)
+    elif isinstance(value, (list, tuple)):
+        parts += (_ITEM_HEADER.pack(_SEQ, len(value)),)
+        for item in value:
+            _flatten(item, parts)
+    else:
+        raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def serialize_items(items):
+    """Lay out `items` in the canonical byte format
+
+    Every item is written as a one byte type tag and a four byte length
+    (element count for sequences) followed by its data, so the output is
+    deterministic and unambiguous. All parts are joined in a single pass,
+    which allocates the output buffer exactly once.
+
+    Args:
+        items (list): None, bool, int, float, bytes-like, str, or
+            sequences of these
+
+    Returns:
+        bytes: The serialized items
+    """
+
+    parts = list()
+    for item in items:
+        _flatten(item, parts)
+    return b''.join(parts)
 
 
 class BlockchainObject(abc.ABC):
 
+    __slots__ = ('_serialized', '_digest', '_nested', '_encoded', '_version')
+
+    # attributes that serialize() depends on; assigning any of them drops the
+    # cached serialization and hash
+    SERIALIZED_FIELDS = ()
+
+    def __setattr__(self, name, value):
+        if name in self.SERIALIZED_FIELDS:
+            object.__setattr__(self, '_serialized', None)
+            object.__setattr__(self, '_digest', None)
+        if not name.startswith('_'):
+            # the wire encoding (see codec.EncodedMessage) covers every field;
+            # encodings of objects this one is nested in check the version
+            object.__setattr__(self, '_encoded', None)
+            object.__setattr__(
+                self, '_version', getattr(self, '_version', 0) + 1)
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        # the caches are cheap to rebuild, so they are not pickled
+        state = {name: value
+                 for name, value in getattr(self, '__dict__', {}).items()
+                 if not name.startswith('_')}
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if not name.startswith('_') and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
     @abc.abstractmethod
     def to_pickle(self):
         pass
 
-    @abc.abstractmethod
+    def serialize_items(self):
+        """The values serialize() is built from, in order"""
+        raise NotImplementedError
+
+    def nested_objects(self):
+        """Objects whose serialized form is part of this object's"""
+        return ()
+
     def serialize(self):
-        pass
+        # nested objects keep their own caches, so this object's cache is
+        # only valid while it was built from the very same nested buffers
+        nested = tuple(obj.serialize() for obj in self.nested_objects())
+        cached = getattr(self, '_serialized', None)
+        if cached is not None:
+            cached_nested = self._nested
+            if len(nested) == len(cached_nested) and \
+                    all(a is b for a, b in zip(nested, cached_nested)):
+                return cached
+
+        object.__setattr__(self, '_nested', nested)
+        object.__setattr__(self, '_digest', None)
+        object.__setattr__(
+            self, '_serialized', serialize_items(self.serialize_items()))
+        return self._serialized
+
+    def digest(self):
+        """SHA-256 of serialize(), cached alongside it"""
+        serialized = self.serialize()
+        if getattr(self, '_digest', None) is None:
+            object.__setattr__(self, '_digest', generate_hash(serialized))
+        return self._digest
 
 
 @BlockchainObject.register
 class Transaction(BlockchainObject):
 
-    def __init__(self, src_pk=None, dst_pk=None, inputs=list(),
+    SERIALIZED_FIELDS = ('src_pk', 'dst_pk', 'inputs', 'value')
+
+    def __init__(self, src_pk=None, dst_pk=None, inputs=(),
                  value=None, src_sig=None):
         self.src_pk = src_pk
         self.dst_pk = dst_pk
-        self.inputs = inputs
+        self.inputs = tuple(inputs)
         self.value = value
         self.src_sig = src_sig
-        self.txn_id = generate_hash(self.serialize())
+
+    @property
+    def txn_id(self):
+        return self.digest()
+
+    @property
+    def message_id(self):
+        """Gossip id of this copy of the txn
+
+        Unlike txn_id it covers the signature, so a copy with a forged
+        signature is not mistaken for the txn itself.
+        """
+        return generate_hash(self.txn_id + bytes(self.src_sig or b''))
 
     def __str__(self):
         return (f'inputs={self.inputs},value={self.value},'
@@ -34,24 +174,27 @@ class Transaction(BlockchainObject):
     def to_pickle(self):
         return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def serialize(self):
-        items = [self.src_pk, self.dst_pk, self.inputs, self.value]
-        return bytearray(''.join(map(str, items)), encoding='UTF-8')
+    def serialize_items(self):
+        return [self.src_pk, self.dst_pk, self.inputs, self.value]
 
     def sign(self, priv_key):
-        self.src_sig = RSA.generate_signature(priv_key, self.serialize())
+        self.src_sig = generate_signature(priv_key, self.serialize())
 
 
 @BlockchainObject.register
 class CollationHeader(BlockchainObject):
 
+    SERIALIZED_FIELDS = ('shard_id', 'parent_hash', 'txns_merkle_root',
+                         'creation_timestamp', 'proposer_pk', 'proposer_sig')
+
     def __init__(self, shard_id=None, parent_hash=None,
                  txns_merkle_root=None, creation_timestamp=None,
-                 proposer_sig=None):
+                 proposer_pk=None, proposer_sig=None):
         self.shard_id = shard_id
         self.parent_hash = parent_hash
         self.txns_merkle_root = txns_merkle_root
         self.creation_timestamp = creation_timestamp
+        self.proposer_pk = proposer_pk
 
         self.proposer_sig = proposer_sig
         self.collation_id = None
@@ -59,67 +202,256 @@ class CollationHeader(BlockchainObject):
     def to_pickle(self):
         return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def serialize(self):
-        items = [self.shard_id, self.parent_hash, self.txns_merkle_root,
-                 self.creation_timestamp]
+    def unsigned_items(self):
+        """The items covered by the proposer signature"""
+        return [self.shard_id, self.parent_hash, self.txns_merkle_root,
+                self.creation_timestamp, self.proposer_pk]
+
+    def signing_data(self):
+        """The bytes signed by the proposer"""
+        return serialize_items([serialize_items(self.unsigned_items())])
+
+    def compute_collation_id(self):
+        """The id of the collation with this header, see Collation.digest"""
+        return generate_hash(serialize_items([self.serialize()]))
+
+    def serialize_items(self):
+        items = self.unsigned_items()
         if self.proposer_sig is not None:
             items.append(self.proposer_sig)
-        return bytearray(''.join(map(str, items)), encoding='UTF-8')
+        return items
 
 
 @BlockchainObject.register
 class Collation(BlockchainObject):
 
-    MAX_TXN_COUNT = 5
+    SERIALIZED_FIELDS = ('header', 'txns', 'receipts')
 
     def __init__(self, shard_id=None, parent_hash=None,
                  txns_merkle_root=None, creation_timestamp=None,
-                 sign_callable=None, proposer_sig=None,
-                 txns=list()):
+                 sign_callable=None, proposer_pk=None, proposer_sig=None,
+                 txns=(), receipts=()):
 
-        self.txns = txns
+        self.txns = tuple(txns)
+        self.receipts = tuple(receipts)
         if txns_merkle_root is None:
             # generate the merkle root
-            # txns_merkle_root = merkle_root(txns)
-            pass
+            txns_merkle_root = self.merkle_tree.root
 
         self.header = CollationHeader(
             shard_id=shard_id, parent_hash=parent_hash,
             txns_merkle_root=txns_merkle_root,
             creation_timestamp=creation_timestamp,
-            proposer_sig=proposer_sig)
+            proposer_pk=proposer_pk, proposer_sig=proposer_sig)
 
         # if no signature was provided, create it
         if proposer_sig is None:
-            self.header.proposer_sig = sign_callable(self.serialize())
+            self.header.proposer_sig = sign_callable(self.signing_data())
 
         # generate the collation hash (id)
-        self.header.collation_id = generate_hash(self.serialize())
+        self.header.collation_id = self.digest()
+
+    def merkle_leaves(self):
+        """The txn_ids of `txns` followed by the digests of `receipts`"""
+        return [txn.txn_id for txn in self.txns] + \
+            [receipt.digest() for receipt in self.receipts]
+
+    @property
+    def merkle_tree(self):
+        """Merkle tree over `merkle_leaves()`, built once per contents"""
+        cached = getattr(self, '_merkle_tree', None)
+        if cached is None or cached[0] is not self.txns or \
+                cached[1] is not self.receipts:
+            tree = MerkleTree(self.merkle_leaves())
+            cached = self._merkle_tree = (self.txns, self.receipts, tree)
+        return cached[2]
+
+    def signing_data(self):
+        """The bytes signed by the proposer, `serialize()` minus the sig"""
+        return self.header.signing_data()
 
     def to_pickle(self):
         return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def serialize(self):
-        items = list()
-        items.append(self.header.serialize())
-        items.extend(map(lambda txn: txn.serialize(), self.txns))
-        return bytearray(''.join(map(str, items)), encoding='UTF-8')
+    # the header commits to the transactions and receipts through
+    # txns_merkle_root, so the signature and the collation id only cover the
+    # header
+    def nested_objects(self):
+        return (self.header,)
+
+    def serialize_items(self):
+        return [self.header.serialize()]
+
+
+class UTXOSet(object):
+    """Compact store of unspent coins, indexed by owner
+
+    Coins are kept as fixed-size packed records of (owner number, value,
+    parent txn) keyed by coin id. Owner keys are stored once and referred to
+    by a small integer, and a secondary index maps each owner to its coin
+    ids in the order they were added. Coin objects are only built when a
+    coin is read.
+    """
+
+    RECORD = struct.Struct('!IQ32s')
+
+    def __init__(self):
+        # coin_id -> packed record
+        self._records = dict()
+        # owner number -> owner key, and back
+        self._owners = list()
+        self._owner_numbers = dict()
+        # owner number -> {coin_id: None}, an ordered set
+        self._by_owner = list()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, coin_id):
+        return coin_id in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def _owner_number(self, owner, create=False):
+        number = self._owner_numbers.get(owner)
+        if number is None and create:
+            number = len(self._owners)
+            self._owners.append(owner)
+            self._owner_numbers[owner] = number
+            self._by_owner.append(dict())
+        return number
+
+    def _unpack(self, record):
+        owner, value, parent_txn = UTXOSet.RECORD.unpack(record)
+        return Coin(owner=self._owners[owner], value=value,
+                    parent_txn=parent_txn)
+
+    def add_coin(self, coin):
+        owner = self._owner_number(bytes(coin.owner), create=True)
+        coin_id = coin.coin_id
+        self._records[coin_id] = UTXOSet.RECORD.pack(
+            owner, coin.value, coin.parent_txn)
+        self._by_owner[owner][coin_id] = None
+
+    def get_coin(self, coin_id):
+        record = self._records.get(coin_id)
+        if record is None:
+            return None
+        return self._unpack(record)
+
+    def remove_coin(self, coin_id):
+        record = self._records.pop(coin_id)
+        owner, _, _ = UTXOSet.RECORD.unpack(record)
+        del self._by_owner[owner][coin_id]
+        return self._unpack(record)
+
+    def coins_of(self, owner):
+        """Ids of the coins owned by `owner`, oldest first"""
+        number = self._owner_number(bytes(owner))
+        if number is None:
+            return list()
+        return list(self._by_owner[number])
+
+    def balance(self, owner):
+        return sum(UTXOSet.RECORD.unpack(self._records[coin_id])[1]
+                   for coin_id in self.coins_of(owner))
+
+    def select_coins(self, owner, amount):
+        """Pick coins of `owner` worth at least `amount`, oldest first
+
+        Args:
+            owner (bytes): The owner's public key
+            amount (int): The value to cover
+
+        Returns:
+            CoinSelection: The chosen coin ids and their total value, or
+                None if `owner` cannot cover `amount`
+        """
+
+        number = self._owner_number(bytes(owner))
+        if number is None:
+            return None
+
+        selected, total = list(), 0
+        for coin_id in self._by_owner[number]:
+            if total >= amount:
+                break
+            selected.append(coin_id)
+            total += UTXOSet.RECORD.unpack(self._records[coin_id])[1]
+
+        if total < amount:
+            return None
+        return CoinSelection(selected, total)
+
+
+CoinSelection = namedtuple('CoinSelection', ['coin_ids', 'total'])
 
 
 @BlockchainObject.register
 class State(BlockchainObject):
 
-    def __init__(self, utxo=dict()):
-        self.utxo = utxo
+    def __init__(self, utxo=None, credited=None):
+        self.utxo = utxo if utxo is not None else UTXOSet()
+        # txn_ids of the cross-shard transactions credited to this shard
+        self.credited = credited if credited is not None else set()
+        # ids of the coins changed and of the transfers credited or
+        # uncredited since the last `take_changes`, only kept once
+        # `track_changes` is called
+        self._changed_coins = None
+        self._changed_credits = None
+
+    def track_changes(self):
+        """Start recording what changes, see `take_changes`"""
+        self._changed_coins = set()
+        self._changed_credits = set()
+
+    def take_changes(self):
+        """What changed since the previous call or `track_changes`
+
+        Returns:
+            tuple: (ids of the coins added or removed, txn_ids credited or
+                uncredited)
+        """
+
+        changes = (self._changed_coins or set(),
+                   self._changed_credits or set())
+        self.track_changes()
+        return changes
 
     def add_coin(self, coin):
-        self.utxo[coin.coin_id] = coin
+        self.utxo.add_coin(coin)
+        if self._changed_coins is not None:
+            self._changed_coins.add(coin.coin_id)
 
     def get_coin(self, coin_id):
-        return self.utxo.get(coin_id, None)
+        return self.utxo.get_coin(coin_id)
 
     def remove_coin(self, coin_id):
-        return self.utxo.pop(coin_id)
+        coin = self.utxo.remove_coin(coin_id)
+        if self._changed_coins is not None:
+            self._changed_coins.add(coin_id)
+        return coin
+
+    def select_coins(self, owner, amount):
+        return self.utxo.select_coins(owner, amount)
+
+    def is_credited(self, txn_id):
+        return txn_id in self.credited
+
+    def credit(self, txn_id):
+        self.credited.add(txn_id)
+        if self._changed_credits is not None:
+            self._changed_credits.add(txn_id)
+
+    def uncredit(self, txn_id):
+        self.credited.discard(txn_id)
+        if self._changed_credits is not None:
+            self._changed_credits.add(txn_id)
+
+    def overlay(self):
+        """Start a StateOverlay on top of this state"""
+        return StateOverlay(self)
 
     def to_pickle(self):
         return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
@@ -128,56 +460,606 @@ class State(BlockchainObject):
         pass
 
 
+class StateOverlay(object):
+    """Copy-on-write view of a State
+
+    Reads fall through to the base state, while added and removed coins are
+    only recorded in the overlay, as are the cross-shard transactions
+    credited or uncredited. The changes can then be applied to the base
+    with `commit` or dropped with `discard`, both in O(changes), and
+    reverted after a commit with the StateUndo taken by `undo`. Overlays
+    can be stacked, since an overlay has the same interface as a State.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.added = dict()
+        self.removed = set()
+        self.credited = set()
+        self.uncredited = set()
+
+    def __len__(self):
+        """Number of pending changes"""
+        return len(self.added) + len(self.removed) + len(self.credited) + \
+            len(self.uncredited)
+
+    def add_coin(self, coin):
+        self.added[coin.coin_id] = coin
+
+    def get_coin(self, coin_id):
+        coin = self.added.get(coin_id)
+        if coin is not None:
+            return coin
+        if coin_id in self.removed:
+            return None
+        return self.base.get_coin(coin_id)
+
+    def remove_coin(self, coin_id):
+        coin = self.added.pop(coin_id, None)
+        if coin is not None:
+            return coin
+
+        coin = self.get_coin(coin_id)
+        if coin is None:
+            raise KeyError(coin_id)
+        self.removed.add(coin_id)
+        return coin
+
+    def is_credited(self, txn_id):
+        if txn_id in self.credited:
+            return True
+        return txn_id not in self.uncredited and \
+            self.base.is_credited(txn_id)
+
+    def credit(self, txn_id):
+        self.uncredited.discard(txn_id)
+        self.credited.add(txn_id)
+
+    def uncredit(self, txn_id):
+        self.credited.discard(txn_id)
+        self.uncredited.add(txn_id)
+
+    def overlay(self):
+        return StateOverlay(self)
+
+    def undo(self):
+        """What reverts the pending changes once they are committed"""
+        return StateUndo(self)
+
+    def commit(self):
+        """Apply the changes to the base and start over empty"""
+        for coin_id in self.removed:
+            self.base.remove_coin(coin_id)
+        for coin in self.added.values():
+            self.base.add_coin(coin)
+        for txn_id in self.credited:
+            self.base.credit(txn_id)
+        for txn_id in self.uncredited:
+            self.base.uncredit(txn_id)
+        self.discard()
+
+    def discard(self):
+        self.added = dict()
+        self.removed = set()
+        self.credited = set()
+        self.uncredited = set()
+
+
+class StateUndo(object):
+    """The changes of a StateOverlay, the other way around
+
+    Taken before the overlay is committed, it keeps the coins the overlay
+    spends, so they can be restored, and the ids of what it adds and
+    credits, so that can be dropped again.
+    """
+
+    __slots__ = ('added', 'spent', 'credited', 'uncredited')
+
+    def __init__(self, overlay):
+        base = overlay.base
+        self.added = [coin_id for coin_id in overlay.added
+                      if base.get_coin(coin_id) is None]
+        self.spent = [base.get_coin(coin_id) for coin_id in overlay.removed]
+        self.credited = [txn_id for txn_id in overlay.credited
+                         if not base.is_credited(txn_id)]
+        self.uncredited = [txn_id for txn_id in overlay.uncredited
+                           if base.is_credited(txn_id)]
+
+    def apply(self, state):
+        """Revert the changes in `state`, a State or StateOverlay"""
+        for coin_id in self.added:
+            state.remove_coin(coin_id)
+        for coin in self.spent:
+            state.add_coin(coin)
+        for txn_id in self.credited:
+            state.uncredit(txn_id)
+        for txn_id in self.uncredited:
+            state.credit(txn_id)
+
+
 @BlockchainObject.register
 class Coin(BlockchainObject):
 
+    __slots__ = ('owner', 'value', 'parent_txn')
+
+    SERIALIZED_FIELDS = ('owner', 'value', 'parent_txn')
+
     def __init__(self, owner=None, value=None, parent_txn=None):
         self.owner = owner
         self.value = value
         self.parent_txn = parent_txn
-        self.coin_id = generate_hash(self.serialize())
+
+    @property
+    def coin_id(self):
+        return self.digest()
 
     def to_pickle(self):
-        pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def serialize(self):
-        items = [self.owner, self.value, self.parent_txn]
-        return bytearray(''.join(map(str, items)), encoding='UTF-8')
+    def serialize_items(self):
+        return [self.owner, self.value, self.parent_txn]
+
+
+def genesis_coins(owners, value=None):
+    """The coins of the initial allocation, one per owner
+
+    Every node and client derives the same coins from the same owners.
+
+    Args:
+        owners (list): Public key bytes
+        value (int, optional): Defaults to GENESIS_VALUE
+
+    Returns:
+        list: Coin per distinct owner
+    """
+
+    value = value or GENESIS_VALUE
+    coins = dict()
+    for owner in owners:
+        coin = Coin(owner=bytes(owner), value=value, parent_txn=GENESIS_TXN)
+        coins[coin.coin_id] = coin
+    return list(coins.values())
 
 
 @BlockchainObject.register
 class CollationVote(BlockchainObject):
+    """A committee member's vote for a collation of `shard_number`
+
+    The collation is referred to by its id, its header is not repeated.
+    `proof` is the VRF proof of the collator's seat on the committee of
+    the shard in `epoch`, see sampling.CommitteeSampler.
+    """
 
-    def __init__(self, collation_header, collator_pk, shard_number, proof,
-                 sign_callable=None, collator_sig=None):
-        self.header = collation_header
+    SERIALIZED_FIELDS = ('collation_id', 'collator_pk', 'shard_number',
+                         'proof', 'epoch')
+
+    def __init__(self, collation_id, collator_pk, shard_number, proof,
+                 sign_callable=None, collator_sig=None, epoch=0):
+        self.collation_id = collation_id
         self.collator_pk = collator_pk
         self.shard_number = shard_number
         self.proof = proof
+        self.epoch = epoch
 
         # if no signature was provided, create it
+        self.collator_sig = collator_sig
         if collator_sig is None:
             self.collator_sig = sign_callable(self.serialize())
 
     def to_pickle(self):
         return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def serialize(self):
-        items = [self.header.serialize(), self.collator_pk,
-                 self.shard_number, self.proof]
-        return bytearray(''.join(map(str, items)), encoding='UTF-8')
+    def serialize_items(self):
+        return [self.collation_id, self.collator_pk, self.shard_number,
+                self.proof, self.epoch]
+
+
+@BlockchainObject.register
+class VoteCertificate(BlockchainObject):
+    """Proof that a quorum of a shard's committee voted for a collation
+
+    `committee` lists the public keys of the committee members known to
+    the certifier and `proofs` their seats. Bit i of the `signers` bitmap,
+    counting from the most significant bit of the first byte, is set if
+    `committee[i]` voted, and `signatures` holds the signatures of their
+    CollationVotes in committee order.
+    """
+
+    SERIALIZED_FIELDS = ('collation_id', 'shard_number', 'epoch',
+                         'committee', 'proofs', 'signers', 'signatures')
+
+    def __init__(self, collation_id=None, shard_number=0, epoch=0,
+                 committee=(), proofs=(), signers=b'', signatures=()):
+        self.collation_id = collation_id
+        self.shard_number = shard_number
+        self.epoch = epoch
+        self.committee = tuple(committee)
+        self.proofs = tuple(proofs)
+        self.signers = signers
+        self.signatures = tuple(signatures)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def signer_indices(self):
+        """Positions in `committee` of the members that voted"""
+        return [i for i in range(len(self.committee))
+                if i // 8 < len(self.signers) and
+                self.signers[i // 8] & (0x80 >> (i % 8))]
+
+    def votes(self):
+        """The CollationVotes the certificate was built from"""
+        return [CollationVote(self.collation_id, self.committee[i],
+                              self.shard_number, self.proofs[i],
+                              collator_sig=sig, epoch=self.epoch)
+                for i, sig in zip(self.signer_indices(), self.signatures)]
+
+    def serialize_items(self):
+        return [self.collation_id, self.shard_number, self.epoch,
+                list(self.committee), list(self.proofs), self.signers,
+                list(self.signatures)]
+
+
+@BlockchainObject.register
+class CrossShardReceipt(BlockchainObject):
+    """Credits the transfers of a certified collation to another shard
+
+    A transaction whose `dst_pk` belongs to another shard only spends its
+    inputs in the source shard. The receipt carries what the destination
+    shard `shard_id` needs to mint the received coins without the source
+    chain: the header of the source collation, its VoteCertificate, the
+    transactions paying to `shard_id` and their inclusion proofs against
+    the header's merkle root, given as the leaf `indices` and the sibling
+    hashes (`branches`) in a tree of `leaf_count` leaves.
+
+    The destination shard records every transaction it credits, so each
+    transfer is credited once however many receipts list it.
+    """
+
+    SERIALIZED_FIELDS = ('header', 'certificate', 'shard_id', 'txns',
+                         'leaf_count', 'indices', 'branches')
+
+    def __init__(self, header=None, certificate=None, shard_id=0, txns=(),
+                 leaf_count=0, indices=(), branches=()):
+        self.header = header
+        self.certificate = certificate
+        self.shard_id = shard_id
+        self.txns = tuple(txns)
+        self.leaf_count = leaf_count
+        self.indices = tuple(indices)
+        self.branches = tuple(tuple(branch) for branch in branches)
+
+    @staticmethod
+    def from_collation(collation, certificate, shard_id, indices):
+        """Build the receipt of the txns of `collation` at `indices`"""
+        tree = collation.merkle_tree
+        proofs = [tree.proof(index) for index in indices]
+        return CrossShardReceipt(
+            header=collation.header, certificate=certificate,
+            shard_id=shard_id,
+            txns=[collation.txns[index] for index in indices],
+            leaf_count=len(tree), indices=indices,
+            branches=[proof.siblings for proof in proofs])
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def verify(self, shard_of):
+        """Check the receipt against its own header and certificate
+
+        The signatures of the certificate are not checked here.
+
+        Args:
+            shard_of (callable): Maps a public key to its shard
+
+        Returns:
+            str: Why the receipt is invalid, or None if it is valid
+        """
+
+        header = self.header
+        if header.compute_collation_id() != self.certificate.collation_id or \
+                header.shard_id != self.certificate.shard_number:
+            return 'certificate is not for the source collation'
+        if header.shard_id == self.shard_id:
+            return 'receipt does not leave its shard'
+        if not self.txns or len(self.indices) != len(self.txns) or \
+                len(self.branches) != len(self.txns) or \
+                len(set(self.indices)) != len(self.indices):
+            return 'malformed inclusion proofs'
+
+        for txn, index, branch in zip(self.txns, self.indices,
+                                      self.branches):
+            if shard_of(txn.src_pk) != header.shard_id or \
+                    shard_of(txn.dst_pk) != self.shard_id:
+                return f'txn {txn.txn_id.hex()} is not a transfer to ' \
+                    f'shard {self.shard_id}'
+            proof = MerkleProof(index, self.leaf_count, branch)
+            if not proof.verify(txn.txn_id, header.txns_merkle_root):
+                return f'txn {txn.txn_id.hex()} is not in the collation'
+        return None
+
+    def nested_objects(self):
+        return (self.header, self.certificate) + self.txns
+
+    def serialize_items(self):
+        return [self.header.serialize(), self.certificate.serialize(),
+                self.shard_id, [txn.serialize() for txn in self.txns],
+                self.leaf_count, list(self.indices),
+                [list(branch) for branch in self.branches]]
 
 
 @BlockchainObject.register
 class CollationRequest(BlockchainObject):
+    """Asks a peer for part of its chain of shard `shard_id`
+
+    Exactly one kind of request is made at a time: the head of the chain
+    (`latest`), the headers of `count` collations from `start_height` on,
+    or the collations listed in `collation_ids` (or the single
+    `collation_id`). The answer is a CollationResponse with the same
+    `request_id`.
+    """
+
+    SERIALIZED_FIELDS = ('collation_id', 'latest', 'request_id', 'shard_id',
+                         'start_height', 'count', 'collation_ids')
 
-    def __init__(self, collation_id=None, latest=False):
+    def __init__(self, collation_id=None, latest=False, request_id=0,
+                 shard_id=None, start_height=0, count=0, collation_ids=()):
         self.collation_id = collation_id
         self.latest = latest
+        self.request_id = request_id
+        self.shard_id = shard_id
+        self.start_height = start_height
+        self.count = count
+        self.collation_ids = tuple(collation_ids)
 
     def to_pickle(self):
         return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def serialize(self):
-        items = [self.collation_id, self.latest]
-        return bytearray(''.join(map(str, items)), encoding='UTF-8')
+    def serialize_items(self):
+        return [self.collation_id, self.latest, self.request_id,
+                self.shard_id, self.start_height, self.count,
+                list(self.collation_ids)]
+
+
+@BlockchainObject.register
+class CollationResponse(BlockchainObject):
+    """The answer to the CollationRequest with the same `request_id`
+
+    `tip_height` is the height of the responder's chain, or 0 if it does not
+    serve the requested shard.
+    """
+
+    SERIALIZED_FIELDS = ('request_id', 'tip_height', 'headers', 'collations')
+
+    def __init__(self, request_id=0, tip_height=0, headers=(),
+                 collations=()):
+        self.request_id = request_id
+        self.tip_height = tip_height
+        self.headers = tuple(headers)
+        self.collations = tuple(collations)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def nested_objects(self):
+        return self.headers + self.collations
+
+    def serialize_items(self):
+        return [self.request_id, self.tip_height,
+                [header.serialize() for header in self.headers],
+                [collation.serialize() for collation in self.collations]]
+
+
+@BlockchainObject.register
+class SnapshotManifest(BlockchainObject):
+    """Content-addressed snapshot of a shard's state after a collation
+
+    The coins and credited transfers are split into 2 ** k chunks by the
+    leading bits of their ids, and the chunks are listed by their hashes.
+    `root` commits to the whole state; see snapshot.Snapshotter.
+    """
+
+    SERIALIZED_FIELDS = ('shard_id', 'height', 'collation_id',
+                         'chunk_hashes')
+
+    def __init__(self, shard_id=0, height=0, collation_id=None,
+                 chunk_hashes=()):
+        self.shard_id = shard_id
+        self.height = height
+        self.collation_id = collation_id
+        self.chunk_hashes = tuple(chunk_hashes)
+
+    @property
+    def root(self):
+        return MerkleTree(self.chunk_hashes).root
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.shard_id, self.height, self.collation_id,
+                list(self.chunk_hashes)]
+
+
+@BlockchainObject.register
+class SnapshotRequest(BlockchainObject):
+    """Asks a peer for the chunks of its snapshots of shard `shard_id`
+
+    Without `chunk_hashes`, the latest SnapshotManifest is asked for. The
+    answer is a SnapshotResponse with the same `request_id`.
+    """
+
+    SERIALIZED_FIELDS = ('request_id', 'shard_id', 'chunk_hashes')
+
+    def __init__(self, request_id=0, shard_id=0, chunk_hashes=()):
+        self.request_id = request_id
+        self.shard_id = shard_id
+        self.chunk_hashes = tuple(chunk_hashes)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.request_id, self.shard_id, list(self.chunk_hashes)]
+
+
+@BlockchainObject.register
+class SnapshotResponse(BlockchainObject):
+    """The answer to a SnapshotRequest
+
+    `chunks` holds the requested chunks the peer has, in request order.
+    """
+
+    SERIALIZED_FIELDS = ('request_id', 'manifest', 'chunks')
+
+    def __init__(self, request_id=0, manifest=None, chunks=()):
+        self.request_id = request_id
+        self.manifest = manifest
+        self.chunks = tuple(chunks)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def nested_objects(self):
+        return (self.manifest,) if self.manifest is not None else ()
+
+    def serialize_items(self):
+        manifest = self.manifest.serialize() \
+            if self.manifest is not None else None
+        return [self.request_id, manifest, list(self.chunks)]
+
+
+@BlockchainObject.register
+class ShardAnnouncement(BlockchainObject):
+    """Tells a client which shard the sending participant serves"""
+
+    SERIALIZED_FIELDS = ('shard_number', 'total_shards')
+
+    def __init__(self, shard_number=None, total_shards=None):
+        self.shard_number = shard_number
+        self.total_shards = total_shards
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.shard_number, self.total_shards]
+
+
+@BlockchainObject.register
+class GossipSubscribe(BlockchainObject):
+    """Lists the gossip topics (shard numbers) the sender subscribes to"""
+
+    SERIALIZED_FIELDS = ('topics',)
+
+    def __init__(self, topics=()):
+        self.topics = tuple(topics)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.topics]
+
+
+@BlockchainObject.register
+class GossipIHave(BlockchainObject):
+    """Ids of messages of a topic recently seen by the sender"""
+
+    SERIALIZED_FIELDS = ('topic', 'msg_ids')
+
+    def __init__(self, topic=None, msg_ids=()):
+        self.topic = topic
+        self.msg_ids = tuple(msg_ids)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.topic, self.msg_ids]
+
+
+@BlockchainObject.register
+class GossipIWant(BlockchainObject):
+    """Asks for the messages with the given ids, in reply to an IHAVE"""
+
+    SERIALIZED_FIELDS = ('msg_ids',)
+
+    def __init__(self, msg_ids=()):
+        self.msg_ids = tuple(msg_ids)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.msg_ids]
+
+
+@BlockchainObject.register
+class PeerHello(BlockchainObject):
+    """First message on a peer connection, naming the sender"""
+
+    SERIALIZED_FIELDS = ('name', 'port')
+
+    def __init__(self, name=None, port=None):
+        self.name = name
+        self.port = port
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.name, self.port]
+
+
+@BlockchainObject.register
+class MembershipHeartbeat(BlockchainObject):
+    """Keeps the sender in the bootstrapper's membership view
+
+    `version` is the last membership version the sender has seen, so the
+    bootstrapper can answer with the changes since then.
+    """
+
+    SERIALIZED_FIELDS = ('name', 'port', 'version')
+
+    def __init__(self, name=None, port=None, version=0):
+        self.name = name
+        self.port = port
+        self.version = version
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_items(self):
+        return [self.name, self.port, self.version]
+
+
+@BlockchainObject.register
+class MembershipUpdate(BlockchainObject):
+    """Membership changes up to `version`
+
+    Unless `full` is set, `joined` and `left` are relative to the version
+    named in the heartbeat being answered; a full update lists every
+    member in `joined` and replaces the receiver's view.
+    """
+
+    SERIALIZED_FIELDS = ('version', 'full', 'joined', 'left')
+
+    def __init__(self, version=0, full=False, joined=(), left=()):
+        self.version = version
+        self.full = full
+        # PeerHellos of the nodes that joined
+        self.joined = tuple(joined)
+        # names of the nodes that left
+        self.left = tuple(left)
+
+    def to_pickle(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def nested_objects(self):
+        return self.joined
+
+    def serialize_items(self):
+        return [self.version, self.full,
+                [member.serialize() for member in self.joined],
+                list(self.left)]
@@ -0,0 +1,159 @@
+import logging
+import time
+
+from collections import deque
+
+
+class OutboundQueue(object):
+    """Batched, flow controlled queue of frames going to one peer
+
+    Frames written during one iteration of the event loop are handed to
+    the transport together on the next one, so a burst of small messages
+    costs a single send. The transport's write buffer is capped by
+    `high_water`/`low_water`; once it fills up the transport pauses the
+    protocol, which stops the queue, and frames wait here until it resumes.
+    A peer that keeps the queue above `max_bytes`, or stays paused for
+    longer than `max_stall` seconds, is disconnected instead of letting
+    the backlog grow without bound. Such a peer is not reading, so its
+    connection is aborted rather than closed, which would wait for the
+    write buffer to drain.
+    """
+
+    HIGH_WATER = 256 * 1024
+    LOW_WATER = 64 * 1024
+    MAX_BYTES = 16 * 1024 * 1024
+    MAX_STALL = 30.
+
+    def __init__(self, transport, evloop, name=None, high_water=None,
+                 low_water=None, max_bytes=None, max_stall=None):
+        """
+        Args:
+            transport (asyncio.Transport): The connection to the peer
+            evloop (asyncio.AbstractEventLoop): Schedules the flushes
+            name (str, optional): The peer, for logging
+            high_water (int, optional): Defaults to HIGH_WATER. Transport
+                buffer size that pauses writing.
+            low_water (int, optional): Defaults to LOW_WATER. Transport
+                buffer size that resumes writing.
+            max_bytes (int, optional): Defaults to MAX_BYTES. Queued bytes
+                that get the peer disconnected.
+            max_stall (float, optional): Defaults to MAX_STALL. Seconds the
+                peer may keep writing paused.
+        """
+
+        self.logger = logging.getLogger(OutboundQueue.__name__)
+        self.transport = transport
+        self.evloop = evloop
+        self.name = name
+        self.max_bytes = max_bytes or OutboundQueue.MAX_BYTES
+        self.max_stall = max_stall or OutboundQueue.MAX_STALL
+        transport.set_write_buffer_limits(
+            high=high_water or OutboundQueue.HIGH_WATER,
+            low=low_water or OutboundQueue.LOW_WATER)
+
+        self.frames = deque()
+        self.queued_bytes = 0
+        self.paused_at = None
+        self.closed = False
+        self._flush_handle = None
+        self._stall_handle = None
+
+        # metrics
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.batches = 0
+        self.peak_bytes = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def paused(self):
+        return self.paused_at is not None
+
+    def write(self, data):
+        """Queue a framed message for the peer"""
+        if self.closed:
+            return
+
+        self.frames.append(data)
+        self.queued_bytes += len(data)
+        self.peak_bytes = max(self.peak_bytes, self.queued_bytes)
+
+        if self.queued_bytes > self.max_bytes:
+            self.logger.warning(
+                f'Disconnecting {self.name}: {self.queued_bytes} bytes '
+                f'backlogged')
+            self.abort()
+        elif not self.paused and self._flush_handle is None:
+            self._flush_handle = self.evloop.call_soon(self.flush)
+
+    def flush(self):
+        self._flush_handle = None
+        if self.paused or self.closed or not self.frames:
+            return
+
+        batch = list(self.frames)
+        self.frames.clear()
+        self.transport.writelines(batch)
+
+        self.batches += 1
+        self.sent_frames += len(batch)
+        self.sent_bytes += self.queued_bytes
+        self.queued_bytes = 0
+
+    def pause(self):
+        """Called by the protocol's `pause_writing`"""
+        if self.paused:
+            return
+        self.paused_at = time.monotonic()
+        self._stall_handle = self.evloop.call_later(
+            self.max_stall, self._stalled)
+
+    def resume(self):
+        """Called by the protocol's `resume_writing`"""
+        self.paused_at = None
+        if self._stall_handle is not None:
+            self._stall_handle.cancel()
+            self._stall_handle = None
+        self.flush()
+
+    def _stalled(self):
+        self._stall_handle = None
+        self.logger.warning(
+            f'Disconnecting {self.name}: writes paused for '
+            f'{self.max_stall}s')
+        self.abort()
+
+    def stats(self):
+        return {
+            'queued_frames': len(self.frames),
+            'queued_bytes': self.queued_bytes,
+            'peak_bytes': self.peak_bytes,
+            'buffered_bytes': self.transport.get_write_buffer_size(),
+            'paused': self.paused,
+            'sent_frames': self.sent_frames,
+            'sent_bytes': self.sent_bytes,
+            'batches': self.batches,
+        }
+
+    def _stop(self):
+        if self.closed:
+            return False
+        self.closed = True
+        for handle in (self._flush_handle, self._stall_handle):
+            if handle is not None:
+                handle.cancel()
+        self.frames.clear()
+        self.queued_bytes = 0
+        return True
+
+    def close(self):
+        """Close the connection once the transport sent what it buffered"""
+        if self._stop():
+            self.transport.close()
+
+    def abort(self):
+        """Drop the connection along with whatever is still buffered"""
+        if self._stop():
+            self.transport.abort()
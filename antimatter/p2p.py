@@ -1,53 +1,211 @@
 import asyncio
-import pickle
+import itertools
 import logging
 import socket
 
+from codec import CodecError, EncodedMessage
+from connections import ConnectionManager, Resolver
+from framing import FrameDecoder, FrameError
+from membership import MembershipClient
+from objects import MembershipHeartbeat, MembershipUpdate, PeerHello
+from outbound import OutboundQueue
+
 
 class BootstrapServerProtocol(asyncio.Protocol):
+    """A node's long-lived membership subscription, bootstrapper side"""
 
     BOOTSTRAP_PORT = 8888
 
-    def __init__(self, nodes):
+    def __init__(self, server):
+        """
+        Args:
+            server (membership.BootstrapServer): The membership service
+        """
+
         self.logger = logging.getLogger(BootstrapServerProtocol.__name__)
-        self.nodes = nodes
+        self.server = server
+        self.decoder = FrameDecoder()
 
     def connection_made(self, transport):
-        ip = transport.get_extra_info('peername')[0]
-        self.logger.info(f'Got connection from {ip}')
-        transport.write(pickle.dumps(self.nodes))
-        self.nodes.add(ip)
-        transport.close()
+        self.ip = transport.get_extra_info('peername')[0]
+        self.transport = transport
+        self.queue = OutboundQueue(transport, self.server.evloop, self.ip)
+        self.logger.info(f'Got connection from {self.ip}')
+
+    def connection_lost(self, exc):
+        self.queue.close()
+        self.server.unsubscribe(self)
+
+    def pause_writing(self):
+        self.queue.pause()
+
+    def resume_writing(self):
+        self.queue.resume()
+
+    def send(self, obj):
+        self.queue.write(Network._framed(obj))
+
+    def data_received(self, data):
+        try:
+            payloads = self.decoder.feed(data)
+        except FrameError as e:
+            self.logger.error(f'Bad frame from {self.ip}: {e}')
+            self.transport.close()
+            return
+
+        for payload in payloads:
+            try:
+                message = EncodedMessage.received(payload)
+            except CodecError as e:
+                self.logger.error(f'Message parsing error: {e}')
+                continue
+
+            if isinstance(message, MembershipHeartbeat):
+                self.server.heartbeat(self, message)
+            else:
+                self.logger.error(f'Unexpected message from {self.ip}')
+
+
+class BootstrapClientProtocol(asyncio.Protocol):
+    """A node's long-lived membership subscription, node side"""
+
+    def __init__(self, client, evloop):
+        """
+        Args:
+            client (membership.MembershipClient): The subscription
+            evloop (asyncio.AbstractEventLoop): The loop to run on
+        """
+
+        self.logger = logging.getLogger(BootstrapClientProtocol.__name__)
+        self.client = client
+        self.evloop = evloop
+        self.decoder = FrameDecoder()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.queue = OutboundQueue(transport, self.evloop, 'bootstrapper')
+        self.client.attach(self)
+
+    def connection_lost(self, exc):
+        self.queue.close()
+        self.client.detach(self)
+
+    def pause_writing(self):
+        self.queue.pause()
+
+    def resume_writing(self):
+        self.queue.resume()
+
+    def send(self, obj):
+        self.queue.write(Network._framed(obj))
+
+    def data_received(self, data):
+        try:
+            payloads = self.decoder.feed(data)
+        except FrameError as e:
+            self.logger.error(f'Bad frame from the bootstrapper: {e}')
+            self.transport.close()
+            return
+
+        for payload in payloads:
+            try:
+                message = EncodedMessage.received(payload)
+            except CodecError as e:
+                self.logger.error(f'Message parsing error: {e}')
+                continue
+
+            if isinstance(message, MembershipUpdate):
+                self.client.apply(message)
 
 
 class NetworkProtocol(asyncio.Protocol):
+    """Connection to another participant
+
+    With a handshake, both ends open with a PeerHello naming themselves;
+    the connection is only registered with the Network, and other messages
+    are only accepted, once the peer's hello arrived.
+    """
 
     DEFAULT_PORT = 9991
 
-    def __init__(self, node_ref):
+    def __init__(self, node_ref, dialed=None):
+        """
+        Args:
+            node_ref: The node owning the Network
+            dialed (str, optional): The host name dialed, None for inbound
+                connections
+        """
+
         self.logger = logging.getLogger(NetworkProtocol.__name__)
         self.node_ref = node_ref
+        self.decoder = FrameDecoder()
+        self.outbound = dialed is not None
+        self.peerhostname = dialed
+        self.peer_port = None
+        self.registered = False
+        # set on the losing connection of two between the same nodes
+        self.duplicate = False
 
     def connection_made(self, transport):
+        network = self.node_ref.network
         self.ip = transport.get_extra_info('peername')[0]
-        self.peerhostname = socket.gethostbyaddr(self.ip)[0]
+        if self.peerhostname is None:
+            self.peerhostname = self.ip
+            future = asyncio.ensure_future(
+                network.resolver.reverse(self.ip), loop=network.evloop)
+            future.add_done_callback(lambda f: self.logger.info(
+                f'Got connection from: {f.result()}'))
         self.transport = transport
-        self.node_ref.network.connections[self.peerhostname] = transport
-        self.logger.info(f'Got connection from: {self.peerhostname}')
+        self.queue = OutboundQueue(
+            transport, network.evloop, self.peerhostname)
+
+        if network.handshake:
+            self.queue.write(network.hello())
+        else:
+            network.register(self, self.peerhostname)
 
     def connection_lost(self, exc):
-        self.node_ref.network.connections[self.peerhostname].close()
-        del self.node_ref.network.connections[self.peerhostname]
-        self.logger.info(f'LOST connection from: {self.peerhostname}')
+        self.queue.close()
+        self.node_ref.network.unregister(self)
+
+    def pause_writing(self):
+        self.queue.pause()
+
+    def resume_writing(self):
+        self.queue.resume()
+
+    def close_duplicate(self):
+        self.duplicate = True
+        self.transport.close()
 
     def data_received(self, data):
-        self.logger.info(f'Received msg from {self.peerhostname}')
         try:
-            message = pickle.loads(data)
-        except pickle.UnpicklingError:
-            self.logger.error('Message parsing error')
+            payloads = self.decoder.feed(data)
+        except FrameError as e:
+            self.logger.error(f'Bad frame from {self.peerhostname}: {e}')
+            self.transport.close()
+            return
+
+        for payload in payloads:
+            self.logger.info(f'Received msg from {self.peerhostname}')
+            try:
+                message = EncodedMessage.received(payload)
+            except CodecError as e:
+                self.logger.error(f'Message parsing error: {e}')
+                continue
 
-        self.node_ref.handle_message(message)
+            if not self.registered:
+                if not isinstance(message, PeerHello):
+                    self.logger.error(
+                        f'Expected a hello from {self.peerhostname}')
+                    self.transport.close()
+                    return
+                self.peer_port = message.port
+                if not self.node_ref.network.register(self, message.name):
+                    return
+                continue
+
+            self.node_ref.handle_message(message, self.peerhostname)
 
     def error_received(self, exc):
         pass
@@ -60,26 +218,45 @@ class NetworkClientProtocol(asyncio.Protocol):
     def __init__(self, node_ref):
         self.logger = logging.getLogger(NetworkClientProtocol.__name__)
         self.node_ref = node_ref
+        self.decoder = FrameDecoder()
 
     def connection_made(self, transport):
         self.ip = transport.get_extra_info('peername')[0]
         self.transport = transport
-        self.node_ref.network.clients[self.ip] = transport
+        self.queue = OutboundQueue(
+            transport, self.node_ref.network.evloop, self.ip)
+        self.node_ref.network.clients[self.ip] = self.queue
         self.logger.info(f'Got client connection from: {self.ip}')
+        self.node_ref.handle_client_connected(self.ip)
 
     def connection_lost(self, exc):
         self.node_ref.network.clients[self.ip].close()
         del self.node_ref.network.clients[self.ip]
         self.logger.info(f'Client closed connection: {self.ip}')
 
+    def pause_writing(self):
+        self.queue.pause()
+
+    def resume_writing(self):
+        self.queue.resume()
+
     def data_received(self, data):
-        self.logger.info(f'Received client msg from {self.ip}')
         try:
-            message = pickle.loads(data)
-        except pickle.UnpicklingError:
-            self.logger.error('Message parsing error')
+            payloads = self.decoder.feed(data)
+        except FrameError as e:
+            self.logger.error(f'Bad frame from client {self.ip}: {e}')
+            self.transport.close()
+            return
+
+        for payload in payloads:
+            self.logger.info(f'Received client msg from {self.ip}')
+            try:
+                message = EncodedMessage.received(payload)
+            except CodecError as e:
+                self.logger.error(f'Message parsing error: {e}')
+                continue
 
-        self.node_ref.handle_message(message)
+            self.node_ref.handle_message(message, self.ip)
 
     def error_received(self, exc):
         pass
@@ -89,49 +266,135 @@ class Network:
     FQDN = 'antimatter-{}.anti-svc.antimatter-ns.svc.cluster.local'
     MAX_TRY_FAIL = 5
 
-    def __init__(self, node_ref, evloop):
+    def __init__(self, node_ref, evloop, handshake=True):
+        """
+        Args:
+            node_ref: The node messages are handed to
+            evloop (asyncio.AbstractEventLoop): The loop to run on
+            handshake (bool): Exchange PeerHellos on peer connections.
+                Clients connect to the participants' client port, which
+                does not take part in the handshake.
+        """
+
         self.logger = logging.getLogger(Network.__name__)
-        # map peerhostname -> transport obj
+        # map peerhostname -> OutboundQueue of the connection
         self.connections = dict()
+        # map peerhostname -> NetworkProtocol of the connection
+        self.protocols = dict()
         self.clients = dict()
         self.node_ref = node_ref
         self.evloop = evloop
+        self.handshake = handshake
         self.fqdn = socket.getfqdn()
+        self.port = NetworkProtocol.DEFAULT_PORT
+        self.dial_port = None
 
-    # async def get_membership_list(self):
-    #     coro = asyncio.open_connection(
-    #         Network.BOOTSTRAP_NODE_IP,
-    #         Network.BOOTSTRAP_NODE_PORT, loop=self.evloop)
-    #     reader, writer = await coro
+        self.resolver = Resolver(evloop)
+        self.membership = None
+        self.manager = ConnectionManager(
+            evloop, lambda host: NetworkProtocol(self.node_ref, dialed=host),
+            self.resolver)
 
-    #     data = await reader.read()
-    #     self.connections = dict.fromkeys(pickle.loads(data))
-    #     self.logger.info(f'Received connections: {self.connections}')
-    #     writer.close()
+    async def join_membership(self, host, port=None):
+        """Subscribe to the bootstrapper and connect to the members
 
-    async def create_connections(self, dst_port):
-        node_id = 0
-        failed = 0
-        while failed < Network.MAX_TRY_FAIL:
+        Of every pair of members, the one with the smaller name dials the
+        other, as that is the connection both would keep anyway.
+        """
+
+        if port is None:
+            port = BootstrapServerProtocol.BOOTSTRAP_PORT
+        # the bootstrapper is redialed for as long as it takes
+        manager = ConnectionManager(
+            self.evloop,
+            lambda host: BootstrapClientProtocol(self.membership, self.evloop),
+            self.resolver, max_attempts=float('inf'))
+        self.membership = MembershipClient(
+            self.evloop, self.fqdn, int(self.port), manager,
+            self._member_joined, self._member_left)
+        await self.membership.connect(host, port)
+
+    def _member_joined(self, name, port):
+        if name == self.fqdn or name in self.protocols or self.fqdn > name:
+            return
+        self.manager.connect(name, port)
+
+    def _member_left(self, name):
+        self.logger.info(f'{name} left')
+        self.manager.forget(name)
+
+    def hello(self):
+        return Network._framed(PeerHello(self.fqdn, int(self.port)))
+
+    def register(self, protocol, name):
+        """Make `protocol` the connection to peer `name`
+
+        When two nodes dial each other at the same time, both ends keep the
+        connection dialed by the node with the smaller name and close the
+        other, so they always agree on which one survives.
+
+        Returns:
+            bool: False if `protocol` was closed as a duplicate
+        """
+
+        if name == self.fqdn:
+            self.logger.info('Closing connection to self')
+            protocol.close_duplicate()
+            return False
+
+        current = self.protocols.get(name)
+        if current is not None:
+            keep_outbound = self.fqdn < name
+            if current.outbound == keep_outbound or \
+                    protocol.outbound != keep_outbound:
+                self.logger.info(f'Closing duplicate connection to {name}')
+                protocol.close_duplicate()
+                return False
+            self.logger.info(f'Replacing duplicate connection to {name}')
+            current.close_duplicate()
+
+        protocol.peerhostname = protocol.queue.name = name
+        protocol.registered = True
+        self.protocols[name] = protocol
+        self.connections[name] = protocol.queue
+        self.manager.connected(name)
+        if current is None:
+            self.logger.info(f'Connected to: {name}')
+            self.node_ref.handle_peer_connected(name)
+        return True
+
+    def unregister(self, protocol):
+        name = protocol.peerhostname
+        if protocol.duplicate or self.protocols.get(name) is not protocol:
+            return
+
+        del self.protocols[name]
+        del self.connections[name]
+        self.logger.info(f'LOST connection from: {name}')
+        self.node_ref.handle_peer_lost(name)
+
+        # only one end redials, the one whose connection would win a tie
+        if not self.handshake or self.fqdn < name:
+            self.manager.redial(name, protocol.peer_port or self.dial_port)
+
+    def _candidates(self):
+        for node_id in itertools.count():
             node = Network.FQDN.format(node_id)
-            # increment node_id before loop logic kicks in
-            node_id += 1
+            if node == self.fqdn or node in self.protocols:
+                yield None
+            else:
+                yield node
 
-            if node == self.fqdn or node in self.connections:
-                continue
-            try:
-                self.logger.info(f'Trying connect to {node}')
-                transport, _ = await self.evloop.create_connection(
-                    lambda: NetworkProtocol(self.node_ref),
-                    host=node, port=dst_port)
-                self.connections[node] = transport
-            except OSError:
-                self.logger.warn(f'Exception while connecting to {node}:')
-                failed += 1
+    async def create_connections(self, dst_port):
+        """Dial the StatefulSet pods concurrently, see ConnectionManager"""
+        self.dial_port = dst_port
+        await self.manager.dial_all(
+            self._candidates(), dst_port, Network.MAX_TRY_FAIL)
 
     async def create_endpoint(self, port):
         if port is None:
             port = NetworkProtocol.DEFAULT_PORT
+        self.port = port
         await self.evloop.create_server(
             lambda: NetworkProtocol(self.node_ref),
             host='0.0.0.0', port=port)
@@ -143,20 +406,47 @@ class Network:
             lambda: NetworkClientProtocol(self.node_ref),
             host='0.0.0.0', port=client_port)
 
+    @staticmethod
+    def _framed(obj):
+        # already encoded payloads are only framed, objects are encoded once
+        # and the same buffer is shared by all connections
+        if isinstance(obj, EncodedMessage):
+            return obj.framed
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            return EncodedMessage(obj).framed
+        return EncodedMessage.of(obj).framed
+
+    def send_obj(self, peers, obj):
+        """Send `obj` to the given peers only, skipping unknown ones"""
+        payload = Network._framed(obj)
+        for peerhostname in peers:
+            queue = self.connections.get(peerhostname)
+            if queue is None:
+                continue
+            self.logger.info(f'Sending to {peerhostname}')
+            queue.write(payload)
+
+    def send_obj_to_client(self, ip, obj):
+        queue = self.clients.get(ip)
+        if queue is not None:
+            queue.write(Network._framed(obj))
+
+    def queue_stats(self):
+        """Outbound queue metrics of every peer and client connection"""
+        stats = {peer: queue.stats()
+                 for peer, queue in self.connections.items()}
+        stats.update((ip, queue.stats())
+                     for ip, queue in self.clients.items())
+        return stats
+
     def broadcast_obj(self, obj):
-        if not isinstance(obj, bytes) or not isinstance(obj, bytearray):
-            pickled = obj.to_pickle()
-        else:
-            pickled = obj
-        for peerhostname, transport in self.connections.items():
+        payload = Network._framed(obj)
+        for peerhostname, queue in self.connections.items():
             self.logger.info(f'Sending to {peerhostname}')
-            transport.write(pickled)
+            queue.write(payload)
 
     def broadcast_obj_to_clients(self, obj):
-        if not isinstance(obj, bytes) or not isinstance(obj, bytearray):
-            pickled = obj.to_pickle()
-        else:
-            pickled = obj
-        for peerhostname, transport in self.clients.items():
+        payload = Network._framed(obj)
+        for peerhostname, queue in self.clients.items():
             self.logger.info(f'Sending to {peerhostname}')
-            transport.write(pickled)
+            queue.write(payload)
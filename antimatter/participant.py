@@ -1,193 +1,805 @@
 import argparse
 import asyncio
+import functools
+import glob
 import logging
+import os
 import sys
+import time
 
-from copy import deepcopy
-from datetime import datetime
+from collections import OrderedDict
 
 from blockchain import Blockchain, Shard
-from crypto import RSA
+from crypto import (
+    SIGNATURE_SCHEMES, VRF, generate_key, generate_signature,
+    get_pub_key_bytes, key_cache, load_private_key, save_private_key,
+    verify_signature)
+from gossip import Gossip
+from mempool import Mempool
 from objects import (
-    State, Transaction, Collation, CollationVote, Coin)
+    Coin, Collation, CollationRequest, CollationResponse, CollationVote,
+    CrossShardReceipt, GossipIHave, GossipIWant, GossipSubscribe,
+    ShardAnnouncement, SnapshotRequest, SnapshotResponse, State,
+    Transaction, VoteCertificate, genesis_coins)
 from p2p import Network, NetworkProtocol, NetworkClientProtocol
+from proposer import CollationProposer
+from sampling import CommitteeSampler
+from snapshot import Snapshotter
+from storage import CollationLog
+from sync import CollationSync
+from validation import CollationValidator, StateUnavailable
+from verifier import SignatureVerifier
+from votes import VoteAggregator
 
 
 class Participant(object):
 
     RSA_KEY_FILE = 'rsakey.pem'
-
-    def __init__(self, port=None, client_port=None, rsa_key_file=None):
+    DATA_DIR = '/var/lib/antimatter'
+    # seconds between flushes of the collation log
+    STORAGE_FLUSH_INTERVAL = 0.5
+    # seconds to wait for the peers' subscriptions before the first sync
+    SYNC_DELAY = 2.
+    # collations below the head that can be rolled back without a snapshot
+    UNDO_DEPTH = 256
+    # collations held back until their parent arrives
+    MAX_HELD = 256
+
+    def __init__(self, port=None, client_port=None, rsa_key_file=None,
+                 verify_workers=None, key_cache_size=None, key_type='rsa',
+                 data_dir=None, collation_size=None, collation_interval=None,
+                 total_shards=None, bootstrap=None, committee_size=None,
+                 committee_sizes=None, epoch_length=None,
+                 snapshot_interval=None, genesis_keys=()):
         self.logger = logging.getLogger(Participant.__name__)
         self.evloop = asyncio.get_event_loop()
 
+        if total_shards is not None:
+            Shard.configure(total_shards)
+
         if rsa_key_file is None:
             rsa_key_file = Participant.RSA_KEY_FILE
+        if data_dir is None:
+            data_dir = Participant.DATA_DIR
 
         self.state = State()
-        self.txn_pool = dict()
+        self.mempool = Mempool()
         self.blockchain = Blockchain()
-        self.rsa_key = RSA.get_rsa_key(rsa_key_file)
-
-        if self.rsa_key is None:
-            self.rsa_key = RSA.generate_rsa_key()
-            RSA.save_rsa_key(self.rsa_key, rsa_key_file)
+        # parent hash -> {collation id: (collation, peer)} of the collations
+        # of our shard waiting for their parent
+        self._held = dict()
+        self._held_count = 0
+        # coins the chain starts out with
+        self.genesis = genesis_coins(genesis_keys)
+
+        if key_cache_size is not None:
+            key_cache.maxsize = key_cache_size
+
+        # verify_workers == 0 keeps signature checks inline on the event loop
+        self.verifier = None
+        if verify_workers != 0:
+            self.verifier = SignatureVerifier(self.evloop, verify_workers)
+            # collations are validated on the same pool of workers
+            self.validator = CollationValidator(
+                self.evloop, executor=self.verifier.executor)
+        else:
+            self.validator = CollationValidator(
+                self.evloop, workers=1, use_threads=True)
+
+        # restore the chain and state persisted by a previous run, the state
+        # from the latest snapshot if there is one
+        self.snapshots = Snapshotter(
+            self, self.evloop, os.path.join(data_dir, 'snapshots'),
+            executor=self.validator.executor, interval=snapshot_interval)
+        self.collation_log = CollationLog(os.path.join(data_dir, 'collations'))
+        self._restore()
+        self.evloop.call_later(
+            Participant.STORAGE_FLUSH_INTERVAL, self._flush_storage)
+
+        self.priv_key = load_private_key(rsa_key_file)
+
+        if self.priv_key is None:
+            self.priv_key = generate_key(key_type)
+            save_private_key(self.priv_key, rsa_key_file)
 
         # initialize epoch number and shard object
         self.epoch_number = 0
         self.shard = Shard()
+        self.public_key = get_pub_key_bytes(self.priv_key)
+        self.sampler = CommitteeSampler(
+            self.priv_key, committee_size, committee_sizes, epoch_length)
+        if not VRF.supports(self.priv_key):
+            self.logger.warning(
+                'Committee seats need an RSA key, this node will not vote')
+        self._epoch_handle = None
 
         self.network = Network(self, self.evloop)
+        self.gossip = Gossip(self.network, self.evloop)
+        self.proposer = CollationProposer(
+            self, collation_size, collation_interval)
+        self.sync = CollationSync(
+            self, self.evloop, os.path.join(data_dir, 'sync-headers.log'),
+            executor=self.validator.executor)
+        self.votes = VoteAggregator(
+            self.evloop, self.sampler, self.population,
+            executor=self.validator.executor, on_vote=self._relay_vote,
+            on_certificate=self._certified)
 
         # create TCP endpoint for incoming connections
         self.evloop.run_until_complete(self.network.create_endpoint(port))
         self.evloop.run_until_complete(
             self.network.create_client_endpoint(client_port))
 
-        # start connecting to other nodes
-        # self.evloop.run_until_complete(self.network.get_membership_list())
-        self.evloop.run_until_complete(self.network.create_connections(port))
-
-        # TODO: change to number of nodes participating in epoch
-        self.shard.generate_new(len(self.network.connections))
+        # start connecting to other nodes, as listed by the bootstrapper if
+        # there is one, otherwise by probing the StatefulSet pod names
+        if bootstrap is not None:
+            host, _, bootstrap_port = bootstrap.partition(':')
+            self.evloop.run_until_complete(self.network.join_membership(
+                host, int(bootstrap_port) if bootstrap_port else None))
+        else:
+            self.evloop.run_until_complete(
+                self.network.create_connections(port))
+
+        self.shard.generate_new(len(self.network.connections),
+                                self.public_key)
+        self.logger.info(f'Serving shard {self.shard.shard_number} of '
+                         f'{Shard.TOTAL_SHARDS}')
+        self._start_epoch()
+        # clients that connected meanwhile were told about the old shard
+        self.network.broadcast_obj_to_clients(self._shard_announcement())
+
+    def population(self):
+        """The number of nodes, ourselves included"""
+        return len(self.network.connections) + 1
+
+    def _start_epoch(self):
+        self.epoch_number = self.sampler.epoch()
+        self.shard.assign(self.sampler.assign(
+            self.epoch_number, range(Shard.TOTAL_SHARDS), self.population()))
+        # votes of the previous epoch may still complete a certificate
+        self.votes.prune(self.epoch_number - 1)
+        self.logger.info(
+            f'Epoch {self.epoch_number}: {self.shard.role.name}, on the '
+            f'committees of shards {sorted(self.shard.committees)}')
+
+        # collations of the committees' shards are needed to vote on them,
+        # and the certificates of every shard for the seeds
+        self.gossip.subscribe(
+            {self.shard.shard_number, CommitteeSampler.BEACON_TOPIC} |
+            set(self.shard.committees))
+        self._epoch_handle = self.evloop.call_later(
+            self.sampler.next_epoch_in(), self._start_epoch)
+
+    def _restore(self):
+        start = time.perf_counter()
+        for collation in self.collation_log:
+            self.blockchain.add_collation(collation)
+        self._rebuild_state()
+        self._follow_head()
+        self.logger.info(
+            f'Restored {len(self.blockchain)} collations, height '
+            f'{self.blockchain.height}, in '
+            f'{time.perf_counter() - start:.2f}s')
+
+    def _rebuild_state(self):
+        # start over from the latest snapshot on our chain, or genesis
+        state, _ = self.snapshots.restore(self.blockchain, self.genesis)
+        self._set_state(state)
+
+    def _set_state(self, state):
+        # a state just loaded, as of the snapshot it was loaded from
+        base = self.snapshots.base
+        self.state = state
+        if base is not None:
+            self._state_head = base.collation_id
+            self._state_height = base.height
+        else:
+            self._state_head = Blockchain.GENESIS_COLLATION_HASH
+            self._state_height = 0
+        # collation id -> (parent hash, StateUndo), for the latest
+        # collations applied to the state, in chain order
+        self._undo = OrderedDict()
+
+    def _state_on_chain(self):
+        # whether the state is as of a collation of the canonical chain,
+        # or of a snapshot the chain has not caught up with yet
+        if self._state_height == 0:
+            return True
+        collation = self.blockchain.get_by_height(self._state_height)
+        if collation is not None:
+            return collation.header.collation_id == self._state_head
+        return self._state_head not in self.blockchain and \
+            self._state_head not in self._undo
+
+    def _follow_head(self):
+        """Move the state to the head of the canonical chain
+
+        The collations that left the chain are rolled back with their undo
+        data, so a reorg takes time in the depth of the fork rather than in
+        the length of the chain. Only reorgs deeper than UNDO_DEPTH start
+        over from a snapshot.
+        """
 
-    def handle_message(self, message):
+        while True:
+            while not self._state_on_chain():
+                if self._state_head not in self._undo:
+                    self.logger.warning(
+                        f'Reorg below the last {len(self._undo)} '
+                        f'collations applied, rebuilding the state')
+                    self._rebuild_state()
+                    break
+                _, (parent_hash, undo) = self._undo.popitem()
+                undo.apply(self.state)
+                self._state_head = parent_hash
+                self._state_height -= 1
+
+            for height in range(self._state_height + 1,
+                                self.blockchain.height + 1):
+                collation = self.blockchain.get_by_height(height)
+                undo = self._apply_collation(self.state, collation)
+                if undo is None:
+                    # the head moves to another branch, roll back to it
+                    self._drop_collation(collation)
+                    break
+
+                collation_id = collation.header.collation_id
+                self._undo[collation_id] = (
+                    collation.header.parent_hash, undo)
+                if len(self._undo) > Participant.UNDO_DEPTH:
+                    self._undo.popitem(last=False)
+                self._state_head = collation_id
+                self._state_height = height
+                self.snapshots.maybe_take(self.state, height, collation_id)
+            else:
+                return
+
+    def _apply_collation(self, state, collation):
+        """Check the txns and receipts of `collation` and apply them
+
+        Returns:
+            StateUndo: What reverts the collation, or None if it is invalid,
+                in which case `state` is left as it was
+        """
+
+        overlay = state.overlay()
+        valid = all(self._validate_txn(overlay, txn)
+                    for txn in collation.txns) and \
+            all(self._validate_receipt(overlay, receipt)
+                for receipt in collation.receipts)
+        if not valid:
+            overlay.discard()
+            self.logger.error(f'Invalid collation '
+                              f'{collation.header.collation_id.hex()}')
+            return None
+        undo = overlay.undo()
+        overlay.commit()
+        return undo
+
+    def _drop_collation(self, collation):
+        # it stays in the collation log and is dropped again on restart
+        collation_id = collation.header.collation_id
+        self.logger.warning(
+            f'Dropping collation {collation_id.hex()} and its descendants')
+        self._update_mempool(self.blockchain.remove_collation(collation_id))
+
+    def _state_at(self, collation_id):
+        """The state as of `collation_id`, to check its children against
+
+        Off our head this is an overlay: the collations above the fork point
+        are rolled back in it with their undo data and those of the fork
+        applied, both in the depth of the fork.
+
+        Raises:
+            StateUnavailable: If the fork is deeper than the undo data kept
+                or builds on an invalid collation
+        """
+
+        if collation_id == self._state_head:
+            return self.state
+        genesis = Blockchain.GENESIS_COLLATION_HASH
+        if collation_id != genesis and collation_id not in self.blockchain:
+            raise StateUnavailable('unknown parent')
+        if self._state_head != genesis and \
+                self._state_head not in self.blockchain:
+            raise StateUnavailable('the state is ahead of the chain')
+
+        fork = genesis
+        if genesis not in (collation_id, self._state_head):
+            fork = self.blockchain.common_ancestor(
+                self._state_head, collation_id) or genesis
+
+        overlay = self.state.overlay()
+        head = self._state_head
+        while head != fork:
+            if head not in self._undo:
+                raise StateUnavailable('the fork is too deep')
+            head, undo = self._undo[head]
+            undo.apply(overlay)
+
+        branch = list()
+        while collation_id != fork:
+            branch.append(self.blockchain.get(collation_id))
+            collation_id = branch[-1].header.parent_hash
+        for collation in reversed(branch):
+            if self._apply_collation(overlay, collation) is None:
+                raise StateUnavailable('the parent is invalid')
+        return overlay
+
+    def start_sync(self):
+        """Catch up with our shard, from a snapshot if we have no chain"""
+        if self.blockchain.height > 0:
+            return self.sync.start()
+        return asyncio.ensure_future(self._fast_sync(), loop=self.evloop)
+
+    async def _fast_sync(self):
+        state = await self.snapshots.fast_sync()
+        if state is not None:
+            self._set_state(state)
+        await self.sync.start()
+
+    def _flush_storage(self):
+        self.collation_log.flush()
+        self.evloop.call_later(
+            Participant.STORAGE_FLUSH_INTERVAL, self._flush_storage)
+
+    def accept_collation(self, collation):
+        """Store a collation and move the state to the new canonical head"""
+        update = self.blockchain.add_collation(collation)
+        self.collation_log.append(collation)
+        self._update_mempool(update)
+        self._follow_head()
+
+        # let clients learn about the coins they received
+        for added in update.added:
+            if added.header.collation_id in self.blockchain:
+                self.network.broadcast_obj_to_clients(added)
+
+        # collations held back for this one can be checked now
+        self._release_held(collation.header.collation_id)
+        for added in update.added:
+            self._release_held(added.header.collation_id)
+
+    def _update_mempool(self, update):
+        # txns of collations that left the canonical chain are pending again
+        for removed in update.removed:
+            for txn in removed.txns:
+                self.mempool.add(txn)
+            for receipt in removed.receipts:
+                self.mempool.add_receipt(receipt)
+        for added in update.added:
+            self.mempool.remove_collation(added)
+
+    def _shard_announcement(self):
+        return ShardAnnouncement(self.shard.shard_number, Shard.TOTAL_SHARDS)
+
+    def handle_client_connected(self, ip):
+        # let the client route transactions of our shard to us
+        self.network.send_obj_to_client(ip, self._shard_announcement())
+
+    def handle_peer_connected(self, peer):
+        self.gossip.peer_connected(peer)
+
+    def handle_peer_lost(self, peer):
+        self.gossip.peer_lost(peer)
+
+    def handle_message(self, message, peer=None):
         if isinstance(message, Transaction):
-            return self.handle_transaction(message)
+            return self.handle_transaction(message, peer)
 
         elif isinstance(message, Collation):
-            return self.handle_collation(message)
+            return self.handle_collation(message, peer)
 
         elif isinstance(message, CollationVote):
-            return self.handle_collation_vote(message)
+            return self.handle_collation_vote(message, peer)
+
+        elif isinstance(message, VoteCertificate):
+            return self.handle_vote_certificate(message, peer)
+
+        elif isinstance(message, CrossShardReceipt):
+            return self.handle_receipt(message, peer)
+
+        elif isinstance(message, (GossipSubscribe, GossipIHave, GossipIWant)):
+            return self.gossip.handle_message(message, peer)
+
+        elif isinstance(message, CollationRequest):
+            return self.sync.serve(message, peer)
+
+        elif isinstance(message, (CollationResponse, SnapshotResponse)):
+            return self.sync.handle_response(message, peer)
+
+        elif isinstance(message, SnapshotRequest):
+            return self.snapshots.serve(message, peer)
 
         self.logger.error('Received message cannot be handled by Participant')
 
-    def handle_transaction(self, txn):
-        if txn.txn_id in self.txn_pool:
+    def handle_transaction(self, txn, peer=None):
+        if not self.gossip.receive(txn.message_id):
             self.logger.info(f'Received duplicate transaction: {txn}')
             return
 
         self.logger.info(f'Received transaction: {txn}')
-        # verify signature
-        if not RSA.verify_signature(
-                txn.src_pk, txn.serialize(), txn.src_sig):
-            self.logger.warn('Invalid signature')
+        if self.verifier is None:
+            # verify signature inline
+            valid = txn.src_sig is not None and verify_signature(
+                txn.src_pk, txn.serialize(), txn.src_sig)
+            return self._admit_transaction(txn, valid, peer)
+
+        future = self.verifier.submit(
+            txn.src_pk, txn.serialize(), txn.src_sig)
+        future.add_done_callback(
+            lambda f: self._admit_transaction(txn, f.result(), peer))
+
+    def _admit_transaction(self, txn, valid, peer=None):
+        if not valid:
+            self.logger.warning('Invalid signature')
             return
 
-        # transaction successfully added
-        self.txn_pool[txn.txn_id] = txn
-        self.network.broadcast_obj(txn)
+        # only txns of our own shard are pooled, others are just relayed
+        shard = Shard.shard_of_key(txn.src_pk)
+        if shard == self.shard.shard_number:
+            if not self.mempool.add(txn):
+                return
+            self.proposer.notify()
+        self.gossip.publish(shard, txn, txn.message_id, source=peer)
 
     def _verify_txn_in_shard(self, src_pk):
-        return int(bytes(src_pk)) % Shard.TOTAL_SHARDS == \
-               self.shard.shard_number
+        return Shard.shard_of_key(src_pk) == self.shard.shard_number
 
     def _validate_txn(self, transient_state, txn):
-        total_input_value = 0.
+        """Check `txn` against `transient_state` and apply it there
+
+        `transient_state` is expected to be a StateOverlay, so a caller can
+        try out transactions and later commit or discard the result.
+        """
+
+        total_input_value = 0
         coins_to_remove = list()
+        if len(set(txn.inputs)) != len(txn.inputs):
+            self.logger.warning('Coin spent twice in one transaction')
+            return False
+
         # verify src_pk owns inputs
         for coin_id in txn.inputs:
             coin = transient_state.get_coin(coin_id)
             coins_to_remove.append(coin_id)
+            if coin is None:
+                self.logger.warning('Coin does not exist or is already spent')
+                return False
             if coin.owner != txn.src_pk:
-                self.logger.warn('Coin not owned by sender')
+                self.logger.warning('Coin not owned by sender')
                 return False
             total_input_value += coin.value
 
         if total_input_value < txn.value:
-            self.logger.warn('Not enough coins')
+            self.logger.warning('Not enough coins')
             return False
 
         # transaction verification complete, remove the coins
         self.logger.debug(f'Consuming coins: {coins_to_remove}')
-        map(transient_state.remove_coin, coins_to_remove)
+        for coin_id in coins_to_remove:
+            transient_state.remove_coin(coin_id)
 
         leftover = total_input_value - txn.value
-        if leftover > 0.:
+        if leftover > 0:
             # mint a new coin (src_pk, leftover)
             coin = Coin(owner=txn.src_pk, value=leftover,
                         parent_txn=txn.txn_id)
             transient_state.add_coin(coin)
 
-        # mint a new coin (dest_pk, total_input_value)
-        coin = Coin(owner=txn.dest_pk, value=txn.value, parent_txn=txn.txn_id)
-        transient_state.add_coin(coin)
+        # mint a new coin (dest_pk, total_input_value), unless it belongs
+        # to another shard, which mints it once it gets the receipt
+        if Shard.shard_of_key(txn.dst_pk) == Shard.shard_of_key(txn.src_pk):
+            coin = Coin(owner=txn.dst_pk, value=txn.value,
+                        parent_txn=txn.txn_id)
+            transient_state.add_coin(coin)
 
         return True
 
-    def _verify_collation(self, new_collation):
-        # verify block hash
+    def _validate_receipt(self, transient_state, receipt):
+        """Credit the transfers of a checked receipt to `transient_state`
 
-        # verify signature
+        Transfers credited before, by this or another receipt, are skipped,
+        so every coin sent to our shard is minted exactly once.
 
-        # verify txns merkle root
+        Returns:
+            bool: False if the receipt credits nothing
+        """
 
-        # verify txns
-        pass
+        credited = False
+        for txn in receipt.txns:
+            if transient_state.is_credited(txn.txn_id):
+                continue
+            # the same coin the source shard would have minted locally
+            transient_state.credit(txn.txn_id)
+            transient_state.add_coin(Coin(
+                owner=txn.dst_pk, value=txn.value, parent_txn=txn.txn_id))
+            credited = True
+
+        if not credited:
+            self.logger.warning('Receipt was already credited')
+        return credited
+
+    def _collation_base_state(self, collation):
+        # the state of other shards is not kept, their collations are only
+        # checked statelessly before voting on them
+        if collation.header.shard_id != self.shard.shard_number:
+            return None
+        parent_hash = collation.header.parent_hash
+        parent = self.blockchain.get_node(parent_hash)
+        height = parent.height + 1 if parent is not None else 1
+        if self._state_head not in self.blockchain and \
+                height <= self._state_height:
+            # below the snapshot the state was loaded from, which already
+            # includes its txns
+            return None
+        return self._state_at(parent_hash)
+
+    def verify_collation(self, new_collation):
+        """Validate a collation on the validator pool
+
+        Collations of our shard are checked against the state as of their
+        parent, which has to be known by the time the signatures are.
+
+        Returns:
+            asyncio.Future: Resolves to a ValidationResult
+        """
+
+        return self.validator.validate(
+            new_collation, state_of=self._collation_base_state,
+            validate_txn=self._validate_txn,
+            validate_receipt=self._validate_receipt,
+            certified=self._receipts_certified)
+
+    def handle_collation(self, collation, peer=None):
+        collation_id = collation.header.collation_id
+        if not self.gossip.receive(collation_id) or \
+                collation_id in self.blockchain:
+            self.logger.debug(
+                f'Received duplicate collation {collation_id.hex()}')
+            return
 
-    def handle_collation(self, collation):
-        pass
+        # collations of shards we neither track nor vote on are not
+        # relayed either, so they are not worth validating
+        shard = collation.header.shard_id
+        if shard != self.shard.shard_number and \
+                shard not in self.shard.committees:
+            self.logger.debug(
+                f'Ignoring collation {collation_id.hex()} of shard {shard}')
+            return
 
-    def handle_collation_vote(self, collation):
-        pass
+        self.logger.info(f'Received collation {collation_id.hex()}')
+        self.votes.observe(collation_id)
+        parent_hash = collation.header.parent_hash
+        if shard == self.shard.shard_number and \
+                parent_hash not in self.blockchain and \
+                parent_hash != Blockchain.GENESIS_COLLATION_HASH:
+            # it is checked once its parent arrives; we fell behind
+            self._hold(collation, peer)
+            self.sync.start()
+            return
+        self._check_collation(collation, peer)
 
-    async def create_collation(self):
-        while True:
-            # check if the node is a proposer
-            if not self.shard.is_proposer():
-                yield
-                continue
+    def _check_collation(self, collation, peer):
+        future = self.verify_collation(collation)
+        future.add_done_callback(
+            lambda f: self._collation_validated(f.result(), peer))
 
-            if len(self.txn_pool) < Collation.MAX_TXN_COUNT:
-                yield
-                continue
+    def _hold(self, collation, peer):
+        held = self._held.setdefault(collation.header.parent_hash, dict())
+        if collation.header.collation_id in held:
+            return
+        held[collation.header.collation_id] = (collation, peer)
+        self._held_count += 1
+        # drop the collations waiting the longest, oldest parent first
+        while self._held_count > Participant.MAX_HELD:
+            oldest_parent = next(iter(self._held))
+            oldest = self._held[oldest_parent]
+            del oldest[next(iter(oldest))]
+            self._held_count -= 1
+            if not oldest:
+                del self._held[oldest_parent]
+
+    def _release_held(self, parent_hash):
+        held = self._held.pop(parent_hash, {})
+        self._held_count -= len(held)
+        for collation, peer in held.values():
+            self._check_collation(collation, peer)
+
+    def _collation_validated(self, result, peer):
+        collation_id = result.collation.header.collation_id
+        if not result.valid:
+            return
+
+        shard = result.collation.header.shard_id
+        if shard in self.shard.committees:
+            self._vote(result.collation)
+
+        # only the chain of our own shard is tracked, collations of the
+        # committees' shards are just relayed to the other members
+        if shard != self.shard.shard_number:
+            if shard in self.gossip.topics:
+                self.gossip.publish(shard, result.collation, collation_id,
+                                    source=peer)
+            return
+        if collation_id in self.blockchain:
+            return
+        self.accept_collation(result.collation)
+        self.gossip.publish(result.collation.header.shard_id,
+                            result.collation, collation_id, source=peer)
+
+    def _vote(self, collation):
+        shard = collation.header.shard_id
+        vote = CollationVote(
+            collation.header.collation_id, self.public_key, shard,
+            self.shard.committees[shard],
+            sign_callable=functools.partial(
+                generate_signature, self.priv_key),
+            epoch=self.epoch_number)
+        self.gossip.receive(vote.digest())
+        self.votes.add(vote)
+
+    def handle_collation_vote(self, vote, peer=None):
+        if not self.gossip.receive(vote.digest()):
+            return
+
+        # votes cast just before the epoch changed are still counted
+        if vote.epoch not in (self.epoch_number, self.epoch_number - 1):
+            self.logger.warning(f'Vote of stale epoch {vote.epoch}')
+            return
+        self.votes.add(vote)
+
+    def _relay_vote(self, vote):
+        # only checked votes are passed on, once per node
+        self.gossip.publish(vote.shard_number, vote, vote.digest())
+
+    def _certified(self, certificate):
+        latency = self.votes.finality_latency(certificate.collation_id)
+        if latency is not None:
+            self.logger.info(
+                f'Collation {certificate.collation_id.hex()} final after '
+                f'{latency:.3f}s')
+        # every node mixes the certified collations into the epoch seeds
+        self.sampler.add_certified(certificate.epoch, certificate.collation_id)
+        self.gossip.publish(CommitteeSampler.BEACON_TOPIC, certificate,
+                            certificate.digest())
+        self._send_receipts(certificate)
+
+    def handle_vote_certificate(self, certificate, peer=None):
+        if not self.gossip.receive(certificate.digest()):
+            return
+        self.votes.add_certificate(certificate)
+
+    def _send_receipts(self, certificate):
+        """Send the transfers out of a collation we proposed to their shards
+
+        Transfers are only sent once the collation is certified, so the
+        receiving shards can trust them without the source chain.
+        """
+
+        collation = self.blockchain.get(certificate.collation_id)
+        if collation is None or \
+                collation.header.proposer_pk != self.public_key:
+            return
 
-            def sign_callable(data):
-                return RSA.generate_signature(self.rsa_key, data)
-
-            txns = dict()
-            num_txns = 0
-            transient_state = deepcopy(self.state)
-            while num_txns < Collation.MAX_TXN_COUNT and \
-                    len(self.txn_pool) > 0:
-                new_txn_id, new_txn = self.txn_pool.popitem()
-                # verify new txn is valid and belongs to the proposer's shard
-                if self._verify_txn_in_shard(new_txn.src_pk) and \
-                   self._validate_txn(transient_state, new_txn):
-                    txns[new_txn_id] = new_txn
-                    num_txns += 1
-
-            if num_txns < Collation.MAX_TXN_COUNT:
-                self.txn_pool.update(txns)
-                yield
+        transfers = dict()
+        for index, txn in enumerate(collation.txns):
+            shard = Shard.shard_of_key(txn.dst_pk)
+            if shard != collation.header.shard_id:
+                transfers.setdefault(shard, list()).append(index)
+
+        for shard, indices in transfers.items():
+            receipt = CrossShardReceipt.from_collation(
+                collation, certificate, shard, indices)
+            self.logger.info(f'Sending {len(indices)} transfers to shard '
+                             f'{shard}')
+            self.gossip.publish(shard, receipt, receipt.digest())
+
+    async def _receipts_certified(self, receipts):
+        """Whether the certificates of all `receipts` are valid
+
+        A certificate is checked once, and not at all if the collation was
+        certified before.
+        """
+
+        checks = dict()
+        for receipt in receipts:
+            certificate = receipt.certificate
+            if self.votes.certified(certificate.collation_id,
+                                    certificate.shard_number,
+                                    certificate.epoch):
                 continue
+            digest = certificate.digest()
+            if digest not in checks:
+                checks[digest] = self.votes.add_certificate(certificate)
+        return all(await asyncio.gather(*checks.values()))
 
-            collation = Collation(
-                shard_id=self.shard.shard_number,
-                parent_hash=self.blockchain.get_head(),
-                sign_callable=sign_callable,
-                creation_timestamp=datetime.now().isoformat(),
-                txns=txns.values())
+    def handle_receipt(self, receipt, peer=None):
+        if not self.gossip.receive(receipt.digest()):
+            return
+
+        reason = receipt.verify(Shard.shard_of_key)
+        if reason is not None:
+            self.logger.warning(f'Invalid receipt: {reason}')
+            return
+        if receipt.shard_id != self.shard.shard_number:
+            # only the destination shard checks the certificate
+            self.gossip.publish(receipt.shard_id, receipt, receipt.digest(),
+                                source=peer)
+            return
 
-            self.network.broadcast_obj(collation)
-            yield
+        future = asyncio.ensure_future(
+            self._receipts_certified([receipt]), loop=self.evloop)
+        future.add_done_callback(
+            lambda f: self._admit_receipt(receipt, f.result(), peer))
+
+    def _admit_receipt(self, receipt, valid, peer=None):
+        if not valid:
+            self.logger.warning('Receipt is not certified')
+            return
+        if all(self.state.is_credited(txn.txn_id) for txn in receipt.txns):
+            return
+
+        if self.mempool.add_receipt(receipt):
+            self.proposer.notify()
+        self.gossip.publish(receipt.shard_id, receipt, receipt.digest(),
+                            source=peer)
+
+
+def load_genesis_keys(pattern):
+    """The public keys of the key files matching `pattern`, in name order"""
+    return [get_pub_key_bytes(load_private_key(key_file))
+            for key_file in sorted(glob.glob(pattern))]
 
 
 def main(args):
     loop = asyncio.get_event_loop()
 
-    participant = Participant(args.port, args.client_port, args.key_file)
-    loop.create_task(participant.create_collation())
+    participant = Participant(args.port, args.client_port, args.key_file,
+                              args.verify_workers, args.key_cache_size,
+                              args.key_type, args.data_dir,
+                              args.collation_size, args.collation_interval,
+                              args.shards, args.bootstrap,
+                              args.committee_size,
+                              dict(args.shard_committee_sizes or ()),
+                              args.epoch_length, args.snapshot_interval,
+                              load_genesis_keys(args.genesis_keys))
+    loop.create_task(participant.proposer.run())
+    loop.call_later(Participant.SYNC_DELAY, participant.start_sync)
 
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         print('Quitting...', file=sys.stderr)
 
+    participant.sync.close()
+    participant.votes.close()
+    participant._epoch_handle.cancel()
+    participant.gossip.close()
+    if participant.network.membership is not None:
+        participant.network.membership.close()
+    participant.validator.close()
+    if participant.verifier is not None:
+        participant.verifier.close()
+    participant.proposer.close()
+    participant.logger.info(f'Public key cache: {key_cache.stats()}')
+    participant.logger.info(
+        f'Committee claim cache: {participant.sampler.stats()}')
+    participant.logger.info(f'Votes: {participant.votes.stats()}')
+    participant.logger.info(f'Snapshots: {participant.snapshots.stats()}')
+    participant.logger.info(
+        f'Outbound queues: {participant.network.queue_stats()}')
+    participant.collation_log.close()
     loop.close()
 
 
+def parse_committee_size(value):
+    shard, _, size = value.partition(':')
+    try:
+        return int(shard), int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected SHARD:SIZE, not {value}')
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description='AntiMatter Participant')
 
@@ -201,6 +813,59 @@ def parse_arguments():
     parser.add_argument('--key-file',
                         dest='key_file', default=None,
                         help='The .pem key file for this Participant')
+    parser.add_argument('--key-type',
+                        dest='key_type', default='rsa',
+                        choices=sorted(SIGNATURE_SCHEMES),
+                        help=('Signature scheme of the key generated when '
+                              'the key file does not exist; only RSA keys '
+                              'sit on committees'))
+    parser.add_argument('--collation-size',
+                        dest='collation_size', type=int,
+                        default=CollationProposer.COLLATION_SIZE,
+                        help='Number of transactions per collation')
+    parser.add_argument('--collation-interval',
+                        dest='collation_interval', type=float,
+                        default=CollationProposer.COLLATION_INTERVAL,
+                        help=('Seconds to wait for a full collation before '
+                              'proposing a smaller one'))
+    parser.add_argument('--shards',
+                        dest='shards', type=int, default=Shard.TOTAL_SHARDS,
+                        help='Number of shards in the network')
+    parser.add_argument('--committee-size',
+                        dest='committee_size', type=int,
+                        default=CommitteeSampler.COMMITTEE_SIZE,
+                        help='Expected number of collators per shard')
+    parser.add_argument('--shard-committee-size',
+                        dest='shard_committee_sizes', action='append',
+                        type=parse_committee_size, metavar='SHARD:SIZE',
+                        help=('Committee size of one shard, overriding '
+                              '--committee-size; may be repeated'))
+    parser.add_argument('--epoch-length',
+                        dest='epoch_length', type=float,
+                        default=CommitteeSampler.EPOCH_LENGTH,
+                        help='Seconds between committee samplings')
+    parser.add_argument('--snapshot-interval',
+                        dest='snapshot_interval', type=int,
+                        default=Snapshotter.INTERVAL,
+                        help='Collations between snapshots of the state')
+    parser.add_argument('--genesis-keys',
+                        dest='genesis_keys', default='client_keys/*.pem',
+                        help=('Key files of the owners of the initial coins, '
+                              'the same on every node'))
+    parser.add_argument('--bootstrap',
+                        dest='bootstrap', default=None,
+                        help=('host[:port] of the bootstrapper to get the '
+                              'member list from'))
+    parser.add_argument('--data-dir',
+                        dest='data_dir', default=Participant.DATA_DIR,
+                        help='Directory to persist collations in')
+    parser.add_argument('--verify-workers',
+                        dest='verify_workers', type=int, default=None,
+                        help=('Number of signature verification workers, '
+                              '0 to verify inline (default: one per core)'))
+    parser.add_argument('--key-cache-size',
+                        dest='key_cache_size', type=int, default=None,
+                        help='Number of parsed public keys to keep cached')
     parser.add_argument('--log-file',
                         dest='log_file', default='/tmp/participant.log',
                         help='The file to write output log to')
@@ -0,0 +1,182 @@
+import asyncio
+import functools
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from crypto import generate_signature, get_pub_key_bytes
+from objects import Collation
+
+
+class CollationProposer(object):
+    """Builds collations when there is work to do
+
+    The proposer sleeps until either the mempool holds `collation_size`
+    transactions for its shard, or `collation_interval` seconds have passed
+    since the last attempt, in which case a smaller collation is proposed if
+    any transactions are waiting. Up to `collation_size` pooled receipts
+    of transfers from other shards are consumed by each collation as well,
+    and count as work to do. Signing happens on an executor so the event
+    loop keeps serving the network meanwhile.
+
+    Pooled transactions that can never be valid are dropped. Those with
+    an input missing from the state stay pooled for up to `input_wait`
+    seconds, since the transaction minting it may just not be applied
+    yet: it may have arrived later, or have been rolled back by a reorg.
+    """
+
+    COLLATION_SIZE = 5
+    COLLATION_INTERVAL = 5.
+    INPUT_WAIT = 60.
+
+    def __init__(self, node_ref, collation_size=None, collation_interval=None,
+                 executor=None, input_wait=None):
+        self.logger = logging.getLogger(CollationProposer.__name__)
+        self.node_ref = node_ref
+        self.collation_size = collation_size or \
+            CollationProposer.COLLATION_SIZE
+        self.collation_interval = collation_interval or \
+            CollationProposer.COLLATION_INTERVAL
+        self.input_wait = input_wait or CollationProposer.INPUT_WAIT
+        # txn_id -> when the txn was first found with a missing input
+        self._waiting = dict()
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.public_key = get_pub_key_bytes(node_ref.priv_key)
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        """Wake the proposer if a full collation can be built"""
+        shard_number = self.node_ref.shard.shard_number
+        mempool = self.node_ref.mempool
+        if mempool.shard_size(shard_number) >= self.collation_size or \
+                mempool.receipt_count() >= self.collation_size:
+            self._wakeup.set()
+
+    async def run(self):
+        while True:
+            full = True
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.collation_interval)
+            except asyncio.TimeoutError:
+                full = False
+            self._wakeup.clear()
+
+            # check if the node is a proposer
+            if not self.node_ref.shard.is_proposer():
+                continue
+
+            try:
+                await self.propose(min_txns=self.collation_size if full else 1)
+            except Exception:
+                self.logger.exception('Failed to propose a collation')
+
+    def _select_txns(self, transient_state):
+        node = self.node_ref
+        txns = list()
+        invalid = list()
+        # the mempool queues txns by shard, so all of these belong to the
+        # proposer's shard
+        for txn in node.mempool.peek(node.shard.shard_number):
+            if len(txns) == self.collation_size:
+                break
+            if node._validate_txn(transient_state, txn):
+                txns.append(txn)
+                self._waiting.pop(txn.txn_id, None)
+            elif not self._waits_for_inputs(transient_state, txn):
+                invalid.append(txn.txn_id)
+
+        # invalid txns would fail again on every attempt, drop them
+        for txn_id in invalid:
+            self.logger.info(f'Dropping invalid txn {txn_id.hex()}')
+            node.mempool.remove(txn_id)
+            self._waiting.pop(txn_id, None)
+        for txn_id in [txn_id for txn_id in self._waiting
+                       if txn_id not in node.mempool]:
+            del self._waiting[txn_id]
+        return txns
+
+    def _waits_for_inputs(self, state, txn):
+        # only a missing input may still show up; a coin of someone else or
+        # a coin spent twice by the txn never makes it valid
+        if len(set(txn.inputs)) != len(txn.inputs):
+            return False
+        coins = [state.get_coin(coin_id) for coin_id in txn.inputs]
+        if all(coin is not None for coin in coins) or any(
+                coin is not None and coin.owner != txn.src_pk
+                for coin in coins):
+            return False
+        since = self._waiting.setdefault(txn.txn_id, time.monotonic())
+        return time.monotonic() - since < self.input_wait
+
+    def _select_receipts(self, transient_state):
+        node = self.node_ref
+        receipts = list()
+        invalid = list()
+        for receipt in node.mempool.peek_receipts():
+            if len(receipts) == self.collation_size:
+                break
+            if node._validate_receipt(transient_state, receipt):
+                receipts.append(receipt)
+            else:
+                invalid.append(receipt.digest())
+
+        # receipts crediting nothing were consumed by earlier collations
+        for digest in invalid:
+            node.mempool.remove_receipt(digest)
+        return receipts
+
+    async def propose(self, min_txns):
+        """Build, sign and publish one collation
+
+        Args:
+            min_txns (int): Give up if fewer valid transactions are pooled
+
+        Returns:
+            Collation: The new collation, or None if none was made
+        """
+
+        node = self.node_ref
+        transient_state = node.state.overlay()
+        txns = self._select_txns(transient_state)
+        receipts = self._select_receipts(transient_state)
+        if len(txns) + len(receipts) < max(1, min_txns):
+            # keep the valid ones pooled until more txns arrive
+            return None
+
+        parent_hash = node.blockchain.head_hash()
+        build = functools.partial(
+            Collation,
+            shard_id=node.shard.shard_number,
+            parent_hash=parent_hash,
+            sign_callable=functools.partial(
+                generate_signature, node.priv_key),
+            proposer_pk=self.public_key,
+            creation_timestamp=datetime.now().isoformat(),
+            txns=txns, receipts=receipts)
+        collation = await node.evloop.run_in_executor(self.executor, build)
+
+        # the chain or the pool may have moved on while signing
+        if node.blockchain.head_hash() != parent_hash or \
+                any(txn.txn_id not in node.mempool for txn in txns) or \
+                not all(node.mempool.has_receipt(receipt.digest())
+                        for receipt in receipts):
+            self.logger.info('Discarding stale collation')
+            self._wakeup.set()
+            return None
+
+        self.logger.info(f'Proposing collation '
+                         f'{collation.header.collation_id.hex()} with '
+                         f'{len(txns)} txns and {len(receipts)} receipts')
+        node.accept_collation(collation)
+        node.gossip.publish(collation.header.shard_id, collation,
+                            collation.header.collation_id)
+
+        # more full collations may be waiting
+        self.notify()
+        return collation
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,235 @@
+import struct
+import time
+
+from collections import OrderedDict
+
+from crypto import VRF, generate_hash
+
+
+def claim_ticket(public_key, vrf_input, proof):
+    """The ticket proven by a seat claim, or None if the proof is invalid
+
+    This also runs inside executor workers, so it only takes picklable
+    arguments.
+    """
+
+    vrf = VRF.from_proof(proof)
+    if not vrf.verify(public_key, vrf_input):
+        return None
+    return CommitteeSampler.ticket(vrf.value)
+
+
+class CommitteeSampler(object):
+    """Samples the committee of every shard for every epoch with a VRF
+
+    Time is cut into epochs of `epoch_length` seconds, each with a public
+    seed. A node evaluates the VRF of its key on (seed, shard) for every
+    shard, and sits on the committee of a shard if the output, read as a
+    fraction in [0, 1), falls below committee size / number of nodes. Each
+    committee thus has `committee_size` members on average however many
+    nodes there are, and a node sits on committee_size * shards / nodes
+    committees, so the collations each node validates go down as the
+    cluster grows.
+
+    A claim to a seat is the VRF proof, which anyone checks with the
+    claimant's public key. The outputs of checked claims are cached, so the
+    many votes a collator casts in an epoch cost a single verification.
+    Only RSA keys make VRF proofs, nodes with other keys sit on no
+    committee.
+
+    The seed of an epoch mixes in the ids of the collations certified
+    `BEACON_LAG` epochs before, as reported with `add_certified`, so seats
+    cannot be sought by grinding keys ahead of time, and there is no seed
+    for epochs still to come. The ids of an epoch are fixed once its seed
+    is first used, later certificates do not change it. Certificates are
+    gossiped to every node for all of them to arrive at the same seeds; a
+    node that missed some, such as one started within the last
+    `BEACON_LAG` epochs, sees other seeds until it caught up.
+    """
+
+    EPOCH_LENGTH = 60.
+    COMMITTEE_SIZE = 16
+    CACHE_SIZE = 4096
+    # node counts differ a little between membership views, so claims are
+    # checked against a node count this much lower than our own
+    TOLERANCE = 0.25
+    # epochs between the certificates mixed into a seed and its epoch
+    BEACON_LAG = 2
+    # gossip topic of the certificates, which every node subscribes to
+    BEACON_TOPIC = 2 ** 32 - 1
+    # epochs whose mixed in ids are remembered
+    BEACONS_KEPT = 16
+
+    _EPOCH = struct.Struct('!Q')
+    _SHARD = struct.Struct('!I')
+    _TICKET = struct.Struct('!Q')
+
+    def __init__(self, private_key=None, committee_size=None,
+                 committee_sizes=None, epoch_length=None, cache_size=None,
+                 clock=time.time):
+        """
+        Args:
+            private_key (optional): The key of this node, only needed to
+                claim seats
+            committee_size (int, optional): Defaults to COMMITTEE_SIZE.
+                Expected committee size of a shard.
+            committee_sizes (dict, optional): shard -> committee size, for
+                the shards that differ from `committee_size`
+            epoch_length (float, optional): Defaults to EPOCH_LENGTH
+            cache_size (int, optional): Defaults to CACHE_SIZE. Number of
+                checked claims to remember.
+            clock (callable, optional): Defaults to time.time
+        """
+
+        self.private_key = private_key
+        self.committee_size = committee_size or \
+            CommitteeSampler.COMMITTEE_SIZE
+        self.committee_sizes = dict(committee_sizes or {})
+        self.epoch_length = epoch_length or CommitteeSampler.EPOCH_LENGTH
+        self.cache_size = cache_size or CommitteeSampler.CACHE_SIZE
+        self.clock = clock
+
+        # (public key, epoch, shard, proof) -> ticket, None if invalid
+        self._checked = OrderedDict()
+        # epoch -> ids of the collations certified in it, until its beacon
+        # is fixed in `_beacons`
+        self._certified = dict()
+        self._beacons = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def epoch(self):
+        return int(self.clock() // self.epoch_length)
+
+    def next_epoch_in(self):
+        """Seconds until the next epoch starts"""
+        return (self.epoch() + 1) * self.epoch_length - self.clock()
+
+    def add_certified(self, epoch, collation_id):
+        """Mix a collation certified in `epoch` into a later seed
+
+        Returns:
+            bool: False if the seed using `epoch` was fixed already
+        """
+
+        if epoch in self._beacons:
+            return False
+        self._certified.setdefault(epoch, set()).add(collation_id)
+        return True
+
+    def _beacon(self, epoch):
+        beacon = self._beacons.get(epoch)
+        if beacon is None:
+            certified = sorted(self._certified.pop(epoch, ()))
+            beacon = self._beacons[epoch] = generate_hash(b''.join(certified))
+            while len(self._beacons) > CommitteeSampler.BEACONS_KEPT:
+                self._beacons.popitem(last=False)
+            oldest = epoch - CommitteeSampler.BEACONS_KEPT
+            for old in [old for old in self._certified if old < oldest]:
+                del self._certified[old]
+        return beacon
+
+    def seed(self, epoch):
+        """The seed of `epoch`, or None if it has not started yet"""
+        if epoch > self.epoch():
+            return None
+        return generate_hash(
+            b'antimatter-epoch' + CommitteeSampler._EPOCH.pack(epoch) +
+            self._beacon(epoch - CommitteeSampler.BEACON_LAG))
+
+    def vrf_input(self, epoch, shard):
+        """The VRF input of a seat, or None if `epoch` has not started"""
+        seed = self.seed(epoch)
+        if seed is None:
+            return None
+        return seed + CommitteeSampler._SHARD.pack(shard)
+
+    @staticmethod
+    def ticket(value):
+        """A VRF output as a fraction in [0, 1)"""
+        return CommitteeSampler._TICKET.unpack_from(value)[0] / 2. ** 64
+
+    def size_of(self, shard):
+        return self.committee_sizes.get(shard, self.committee_size)
+
+    def threshold(self, shard, population):
+        return min(1., self.size_of(shard) / max(1, population))
+
+    def assign(self, epoch, shards, population):
+        """The committees this node sits on in `epoch`
+
+        Args:
+            epoch (int): The epoch number
+            shards (iterable): The shards to sample
+            population (int): The number of nodes
+
+        Returns:
+            dict: shard -> VRF proof of the seat, for every seat won
+        """
+
+        seats = dict()
+        if not VRF.supports(self.private_key) or self.seed(epoch) is None:
+            return seats
+        for shard in shards:
+            vrf = VRF.compute_vrf(
+                self.private_key, self.vrf_input(epoch, shard))
+            if CommitteeSampler.ticket(vrf.value) < \
+                    self.threshold(shard, population):
+                seats[shard] = vrf.proof
+        return seats
+
+    def lookup(self, public_key, epoch, shard, proof):
+        """The cached outcome of checking a claim
+
+        Returns:
+            tuple: (found, ticket), the ticket being None for invalid claims
+        """
+
+        key = (bytes(public_key), epoch, shard, bytes(proof))
+        if key not in self._checked:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._checked.move_to_end(key)
+        return True, self._checked[key]
+
+    def remember(self, public_key, epoch, shard, proof, ticket):
+        """Cache the ticket of a claim checked with `claim_ticket`"""
+        key = (bytes(public_key), epoch, shard, bytes(proof))
+        self._checked[key] = ticket
+        while len(self._checked) > self.cache_size:
+            self._checked.popitem(last=False)
+
+    def seated(self, ticket, shard, population):
+        """Whether a checked claim's ticket wins a seat on the committee"""
+        if ticket is None:
+            return False
+        population *= 1 - CommitteeSampler.TOLERANCE
+        return ticket < self.threshold(shard, population)
+
+    def verify(self, public_key, epoch, shard, proof, population):
+        """Check a claim of `public_key` to a seat on a committee
+
+        Args:
+            public_key (bytes): The claimant's PEM public key
+            epoch (int): The epoch of the seat
+            shard (int): The shard of the committee
+            proof (bytes): The VRF proof returned by `assign`
+            population (int): The number of nodes as seen by us
+
+        Returns:
+            bool: True if the claim is valid
+        """
+
+        vrf_input = self.vrf_input(epoch, shard)
+        if proof is None or vrf_input is None:
+            return False
+        found, ticket = self.lookup(public_key, epoch, shard, proof)
+        if not found:
+            ticket = claim_ticket(public_key, vrf_input, proof)
+            self.remember(public_key, epoch, shard, proof, ticket)
+        return self.seated(ticket, shard, population)
+
+    def stats(self):
+        return {'cached': len(self._checked), 'hits': self.hits,
+                'misses': self.misses}
@@ -0,0 +1,68 @@
+import bisect
+import struct
+
+from crypto import generate_hash, key_cache
+
+
+_POINT = struct.Struct('!Q')
+
+
+class ShardMap(object):
+    """Consistent-hash assignment of sender keys to shards
+
+    Every shard owns `virtual_nodes` points on a 64 bit hash ring, and a key
+    belongs to the shard owning the first point at or after the key's
+    position, taken from its fingerprint. The points of a shard do not
+    depend on the shard count, so going from n to n + 1 shards only moves
+    the keys now owned by the new shard's points, about 1 / (n + 1) of
+    them.
+    """
+
+    VIRTUAL_NODES = 64
+
+    def __init__(self, num_shards, virtual_nodes=None):
+        """
+        Args:
+            num_shards (int): The number of shards, at least 1
+            virtual_nodes (int, optional): Defaults to VIRTUAL_NODES. Points
+                per shard; more points spread keys more evenly.
+        """
+
+        if num_shards < 1:
+            raise ValueError(f'Invalid shard count {num_shards}')
+        self.num_shards = num_shards
+        self.virtual_nodes = virtual_nodes or ShardMap.VIRTUAL_NODES
+
+        ring = sorted(
+            (ShardMap.point(f'shard-{shard}-{i}'.encode()), shard)
+            for shard in range(num_shards)
+            for i in range(self.virtual_nodes))
+        self._points = [point for point, _ in ring]
+        self._shards = [shard for _, shard in ring]
+
+    def __len__(self):
+        return self.num_shards
+
+    @staticmethod
+    def point(data):
+        """Position of `data` on the ring"""
+        return _POINT.unpack_from(generate_hash(data))[0]
+
+    def shard_of_fingerprint(self, fingerprint):
+        """The shard owning the key with the given sha256 fingerprint"""
+        position = _POINT.unpack_from(fingerprint)[0]
+        index = bisect.bisect_left(self._points, position)
+        # past the last point the ring wraps around to the first one
+        return self._shards[index % len(self._points)]
+
+    def shard_of_key(self, public_key):
+        """The shard owning transactions sent by `public_key`
+
+        The key is hashed once, through the key cache, and the assignment is
+        stored in its cache entry along with the map it was computed for.
+        """
+
+        entry = key_cache.get(public_key)
+        if entry.shard is None or entry.shard[0] is not self:
+            entry.shard = (self, self.shard_of_fingerprint(entry.fingerprint))
+        return entry.shard[1]
@@ -0,0 +1,614 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+
+from codec import CodecError, decode, encode
+from crypto import generate_hash
+from objects import (
+    Coin, SnapshotManifest, SnapshotRequest, SnapshotResponse, State)
+from sync import SyncError
+
+
+class SnapshotError(Exception):
+    pass
+
+
+_COUNT = struct.Struct('!I')
+# coin_id, value, parent txn and length of the owner key, followed by the key
+_COIN = struct.Struct('!32sQ32sH')
+_ID_SIZE = 32
+
+
+def bucket_of(key, bits):
+    """The chunk holding `key` among 2 ** bits chunks"""
+    return int.from_bytes(key[:2], 'big') >> (16 - bits)
+
+
+def pack_chunk(coins, credited):
+    """Lay out the contents of a chunk, sorted by id
+
+    Args:
+        coins (dict): coin_id -> (owner, value, parent_txn)
+        credited (iterable): txn_ids of credited cross-shard transfers
+
+    Returns:
+        bytes: The chunk
+    """
+
+    parts = [_COUNT.pack(len(coins))]
+    for coin_id in sorted(coins):
+        owner, value, parent_txn = coins[coin_id]
+        parts.append(_COIN.pack(coin_id, value, parent_txn, len(owner)))
+        parts.append(owner)
+    credited = sorted(credited)
+    parts.append(_COUNT.pack(len(credited)))
+    parts.extend(credited)
+    return b''.join(parts)
+
+
+def unpack_chunk(data):
+    """The reverse of `pack_chunk`
+
+    Raises:
+        SnapshotError: If `data` is not a well-formed chunk
+
+    Returns:
+        tuple: (coins, credited), credited being a set
+    """
+
+    try:
+        count, = _COUNT.unpack_from(data, 0)
+        offset = _COUNT.size
+        coins = dict()
+        for _ in range(count):
+            coin_id, value, parent_txn, length = \
+                _COIN.unpack_from(data, offset)
+            offset += _COIN.size + length
+            coins[coin_id] = (bytes(data[offset - length:offset]), value,
+                              parent_txn)
+        count, = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        end = offset + count * _ID_SIZE
+        credited = {bytes(data[i:i + _ID_SIZE])
+                    for i in range(offset, end, _ID_SIZE)}
+    except struct.error as e:
+        raise SnapshotError(f'malformed chunk: {e}')
+    if end != len(data):
+        raise SnapshotError('chunk length does not match its contents')
+    return coins, credited
+
+
+EMPTY_CHUNK = pack_chunk({}, ())
+
+
+class ChunkStore(object):
+    """Chunks of snapshots on disk, each in a file named by its hash
+
+    A chunk is written once, under a temporary name that is then renamed,
+    so the files present always hold complete chunks.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest.hex())
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def read(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def read_many(self, digests):
+        """The chunks found among `digests`, in order"""
+        chunks = list()
+        for digest in digests:
+            try:
+                chunks.append(self.read(digest))
+            except FileNotFoundError:
+                pass
+        return chunks
+
+    def write(self, data):
+        """Store a chunk unless it is stored already
+
+        Returns:
+            bytes: The hash of the chunk
+        """
+
+        digest = generate_hash(data)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        return digest
+
+    def add_many(self, chunks, wanted):
+        """Store the `chunks` whose hash is in `wanted`, dropping the rest
+
+        Returns:
+            set: The hashes of the chunks stored
+        """
+
+        stored = set()
+        for data in chunks:
+            digest = generate_hash(data)
+            if digest in wanted:
+                stored.add(self.write(data))
+        return stored
+
+    def prune(self, keep):
+        """Delete the chunks whose hash is not in `keep`"""
+        for name in os.listdir(self.directory):
+            try:
+                digest = bytes.fromhex(name)
+            except ValueError:
+                digest = None
+            if digest not in keep:
+                os.remove(os.path.join(self.directory, name))
+
+
+def build_chunks(directory, previous, changes, keep):
+    """Write the chunks of a snapshot that differ from the previous one
+
+    Each chunk with changes is read back from the previous snapshot,
+    updated and written under its new hash; the other chunks are shared
+    with the previous snapshot. Chunks that are neither in `keep` nor new
+    are deleted afterwards.
+
+    This runs inside the executor workers, so it only takes picklable
+    arguments.
+
+    Args:
+        directory (str): The directory of the ChunkStore
+        previous (dict): chunk number -> hash of the chunk in the previous
+            snapshot, for the chunks in `changes`
+        changes (dict): chunk number -> (coins, credited). `coins` maps the
+            ids of the coins changed to (owner, value, parent_txn), or to
+            None if the coin was spent, and `credited` maps the txn_ids
+            changed to whether they are credited.
+        keep (set): Hashes of the chunks still in use
+
+    Returns:
+        dict: chunk number -> hash of the new chunk
+    """
+
+    store = ChunkStore(directory)
+    hashes = dict()
+    for number, (coins, credited) in changes.items():
+        current, done = unpack_chunk(store.read(previous[number]))
+        for coin_id, coin in coins.items():
+            if coin is None:
+                current.pop(coin_id, None)
+            else:
+                current[coin_id] = coin
+        for txn_id, is_credited in credited.items():
+            if is_credited:
+                done.add(txn_id)
+            else:
+                done.discard(txn_id)
+        hashes[number] = store.write(pack_chunk(current, done))
+
+    store.prune(set(keep) | set(hashes.values()))
+    return hashes
+
+
+def chunk_bits(manifest):
+    """The k of the 2 ** k chunks of `manifest`
+
+    Raises:
+        SnapshotError: If the number of chunks is not a power of two
+    """
+
+    count = len(manifest.chunk_hashes)
+    bits = count.bit_length() - 1
+    if not 0 < bits <= 16 or count != 1 << bits:
+        raise SnapshotError(f'unexpected number of chunks: {count}')
+    return bits
+
+
+def load_state(directory, manifest):
+    """Build the State of a snapshot from its stored chunks
+
+    Every chunk is checked against its hash, and every coin against its
+    id and chunk.
+
+    Raises:
+        SnapshotError: If a chunk is missing or does not match
+
+    Returns:
+        State: The state, not tracking changes
+    """
+
+    store = ChunkStore(directory)
+    bits = chunk_bits(manifest)
+    state = State()
+    for number, digest in enumerate(manifest.chunk_hashes):
+        try:
+            data = store.read(digest)
+        except FileNotFoundError:
+            raise SnapshotError(f'missing chunk {digest.hex()}')
+        if generate_hash(data) != digest:
+            raise SnapshotError(f'chunk {digest.hex()} does not match')
+
+        coins, credited = unpack_chunk(data)
+        for coin_id, (owner, value, parent_txn) in coins.items():
+            coin = Coin(owner=owner, value=value, parent_txn=parent_txn)
+            if coin.coin_id != coin_id or bucket_of(coin_id, bits) != number:
+                raise SnapshotError(f'misplaced coin {coin_id.hex()}')
+            state.add_coin(coin)
+        for txn_id in credited:
+            if bucket_of(txn_id, bits) != number:
+                raise SnapshotError(f'misplaced transfer {txn_id.hex()}')
+            state.credit(txn_id)
+    return state
+
+
+class Snapshotter(object):
+    """Takes snapshots of the state of our shard and serves them
+
+    After every `interval`-th collation of the chain, the state is written
+    out as a SnapshotManifest and its chunks, 2 ** `bits` of them, each
+    holding the coins and credited transfers whose ids start with its
+    number. Snapshots are incremental: the state records what changes, and
+    only the chunks holding changes are rewritten, from the chunks of the
+    previous snapshot, on the worker pool. The rest are shared with the
+    previous snapshot. Chunks are stored by hash, so the manifest's root
+    commits to the whole state, and all nodes on the same chain produce
+    the same snapshots.
+
+    On restart the state is loaded from the latest snapshot and only the
+    collations above it are replayed. A node without a chain instead asks
+    the peers of its shard for their latest manifest, downloads the chunks
+    of the one most of them agree on from all of them in parallel, checks
+    them against their hashes and then replays only the collations above
+    the snapshot. Nothing on the chain commits to the state, so at least
+    `min_agree` peers have to agree on the manifest.
+
+    The chunks of the latest two snapshots are kept, so a download of the
+    previous one can still finish.
+    """
+
+    INTERVAL = 1000
+    BITS = 10
+    CHUNK_BATCH = 16
+    MIN_AGREE = 2
+    # limit on the chunks served per request
+    MAX_CHUNKS = 64
+
+    def __init__(self, node_ref, evloop, directory, executor=None,
+                 interval=None, bits=None, chunk_batch=None,
+                 min_agree=None):
+        """
+        Args:
+            node_ref (participant.Participant): Owns the state
+            evloop (asyncio.AbstractEventLoop): The loop to run on
+            directory (str): Where the snapshots are kept
+            executor (concurrent.futures.Executor, optional): Writes the
+                chunks. Defaults to the loop's default executor.
+            interval (int, optional): Defaults to INTERVAL. Collations
+                between snapshots.
+            bits (int, optional): Defaults to BITS. Snapshots have
+                2 ** bits chunks.
+            chunk_batch (int, optional): Defaults to CHUNK_BATCH. Chunks
+                asked for per request.
+            min_agree (int, optional): Defaults to MIN_AGREE. Peers that
+                have to serve the same manifest for it to be downloaded.
+        """
+
+        self.logger = logging.getLogger(Snapshotter.__name__)
+        self.node = node_ref
+        self.evloop = evloop
+        self.executor = executor
+        self.interval = interval or Snapshotter.INTERVAL
+        self.bits = bits or Snapshotter.BITS
+        self.chunk_batch = chunk_batch or Snapshotter.CHUNK_BATCH
+        self.min_agree = min_agree or Snapshotter.MIN_AGREE
+
+        self.store = ChunkStore(os.path.join(directory, 'chunks'))
+        self.empty = self.store.write(EMPTY_CHUNK)
+        self.manifest_path = os.path.join(directory, 'MANIFEST')
+        # the latest snapshot, and the one before it
+        self.manifest = self._load_manifest()
+        self._previous = None
+
+        # the snapshot the state was loaded from, if any
+        self.base = None
+        # chunk hashes of the state as of the last snapshot (or base)
+        self._chunks = [self.empty] * (1 << self.bits)
+        self._height = 0
+        # the next snapshot is built from the whole state
+        self._full = False
+        self._building = False
+        # bumped when the state is replaced, to drop snapshots of the old
+        self._generation = 0
+
+        # metrics
+        self.taken = 0
+        self.chunks_written = 0
+        self.chunks_fetched = 0
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'rb') as f:
+                return decode(f.read())
+        except FileNotFoundError:
+            return None
+        except CodecError as e:
+            self.logger.warning(f'Ignoring unreadable snapshot manifest: {e}')
+            return None
+
+    def _save_manifest(self, manifest):
+        with open(self.manifest_path + '.tmp', 'wb') as f:
+            f.write(encode(manifest))
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def _adopt(self, state, manifest):
+        state.track_changes()
+        self._generation += 1
+        self._building = False
+        self.base = manifest
+        self._full = manifest is not None and \
+            len(manifest.chunk_hashes) != 1 << self.bits
+        if manifest is None or self._full:
+            self._chunks = [self.empty] * (1 << self.bits)
+        else:
+            self._chunks = list(manifest.chunk_hashes)
+        self._height = manifest.height if manifest is not None else 0
+
+    def restore(self, blockchain, genesis=()):
+        """A State to replay `blockchain` onto, and the height it is at
+
+        The state is loaded from the latest snapshot, unless the chain has
+        another collation at its height; otherwise it starts out with the
+        `genesis` coins.
+
+        Returns:
+            tuple: (State, height)
+        """
+
+        manifest = self.manifest
+        if manifest is not None:
+            collation = blockchain.get_by_height(manifest.height)
+            if collation is None or \
+                    collation.header.collation_id == manifest.collation_id:
+                start = time.perf_counter()
+                try:
+                    state = load_state(self.store.directory, manifest)
+                except SnapshotError as e:
+                    self.logger.warning(f'Cannot load the snapshot: {e}')
+                else:
+                    self.logger.info(
+                        f'Loaded the snapshot at height {manifest.height}, '
+                        f'{len(state.utxo)} coins, in '
+                        f'{time.perf_counter() - start:.2f}s')
+                    self._adopt(state, manifest)
+                    return state, manifest.height
+
+        state = State()
+        self._adopt(state, None)
+        # added once changes are tracked, so they make the first snapshot
+        for coin in genesis:
+            state.add_coin(coin)
+        return state, 0
+
+    def maybe_take(self, state, height, collation_id):
+        """Snapshot `state` if the collation at `height` is due for one"""
+        if self._building or height % self.interval or \
+                height <= self._height:
+            return None
+        return self.take(state, height, collation_id)
+
+    def _changes(self, state):
+        # what changed since the last snapshot, read on the event loop
+        count = 1 << self.bits
+        if self._full:
+            coin_ids, credited = set(state.utxo), set(state.credited)
+            state.take_changes()
+            changes = {number: (dict(), dict()) for number in range(count)}
+        else:
+            coin_ids, credited = state.take_changes()
+            changes = dict()
+
+        for coin_id in coin_ids:
+            coin = state.get_coin(coin_id)
+            coins = changes.setdefault(
+                bucket_of(coin_id, self.bits), (dict(), dict()))[0]
+            coins[coin_id] = None if coin is None else \
+                (bytes(coin.owner), coin.value, coin.parent_txn)
+        for txn_id in credited:
+            credits = changes.setdefault(
+                bucket_of(txn_id, self.bits), (dict(), dict()))[1]
+            credits[txn_id] = state.is_credited(txn_id)
+        return changes
+
+    def take(self, state, height, collation_id):
+        """Write a snapshot of `state` on the worker pool
+
+        Only the changes since the last snapshot are read from the state,
+        on the event loop.
+
+        Returns:
+            asyncio.Future: Resolves to the SnapshotManifest, or None if
+                the snapshot failed or the state was replaced meanwhile
+        """
+
+        # a full snapshot is built from empty chunks
+        chunks = [self.empty] * len(self._chunks) if self._full \
+            else self._chunks
+        changes = self._changes(state)
+        previous = {number: chunks[number] for number in changes}
+        keep = set(self._chunks) | {self.empty}
+        if self.manifest is not None:
+            keep.update(self.manifest.chunk_hashes)
+
+        self._building = True
+        generation = self._generation
+        result = self.evloop.create_future()
+        future = self.evloop.run_in_executor(
+            self.executor, build_chunks, self.store.directory, previous,
+            changes, keep)
+
+        def done(f):
+            if generation != self._generation:
+                result.set_result(None)
+                return
+            self._building = False
+            if f.cancelled() or f.exception() is not None:
+                error = 'cancelled' if f.cancelled() else f.exception()
+                self.logger.error(
+                    f'Snapshot at height {height} failed: {error}')
+                # the changes taken are lost, start over from the state
+                self._full = True
+                result.set_result(None)
+                return
+
+            for number, digest in f.result().items():
+                self._chunks[number] = digest
+            self._full = False
+            self._height = height
+            manifest = SnapshotManifest(self.node.shard.shard_number, height,
+                                        collation_id, self._chunks)
+            self._previous, self.manifest = self.manifest, manifest
+            self._save_manifest(manifest)
+            self.taken += 1
+            self.chunks_written += len(f.result())
+            self.logger.info(
+                f'Snapshot at height {height}, root {manifest.root.hex()}, '
+                f'{len(f.result())} chunks written')
+            result.set_result(manifest)
+
+        future.add_done_callback(done)
+        return result
+
+    def serve(self, request, peer):
+        """Answer a SnapshotRequest from `peer` out of our snapshots"""
+        response = SnapshotResponse(request.request_id)
+        manifest = self.manifest
+        if manifest is None or \
+                request.shard_id != self.node.shard.shard_number:
+            self.node.network.send_obj([peer], response)
+            return
+        if not request.chunk_hashes:
+            response.manifest = manifest
+            self.node.network.send_obj([peer], response)
+            return
+
+        served = set(manifest.chunk_hashes)
+        if self._previous is not None:
+            served.update(self._previous.chunk_hashes)
+        wanted = [digest for digest
+                  in request.chunk_hashes[:Snapshotter.MAX_CHUNKS]
+                  if digest in served]
+
+        def send(f):
+            if not f.cancelled() and f.exception() is None:
+                response.chunks = f.result()
+            self.node.network.send_obj([peer], response)
+
+        # chunks are read off the event loop
+        self.evloop.run_in_executor(
+            None, self.store.read_many, wanted).add_done_callback(send)
+
+    async def _find_manifest(self, peers):
+        async def manifest_of(peer):
+            try:
+                response = await self.node.sync.request(
+                    peer, SnapshotRequest)
+            except asyncio.TimeoutError:
+                return None
+            return response.manifest
+
+        manifests = await asyncio.gather(
+            *[manifest_of(peer) for peer in peers])
+        # manifest digest -> (manifest, peers serving it)
+        offers = dict()
+        for peer, manifest in zip(peers, manifests):
+            if manifest is not None and \
+                    manifest.shard_id == self.node.shard.shard_number:
+                offers.setdefault(manifest.digest(), (manifest, list()))[1] \
+                    .append(peer)
+        if not offers:
+            return None, list()
+
+        manifest, serving = max(offers.values(),
+                                key=lambda offer: (len(offer[1]),
+                                                   offer[0].height))
+        if len(serving) < min(self.min_agree, len(peers)):
+            return None, list()
+        return manifest, serving
+
+    async def _download(self, peers, manifest):
+        missing = [digest for digest in dict.fromkeys(manifest.chunk_hashes)
+                   if digest not in self.store]
+
+        async def fetch(peer, task):
+            response = await self.node.sync.request(
+                peer, SnapshotRequest, chunk_hashes=task)
+            stored = await self.evloop.run_in_executor(
+                None, self.store.add_many, response.chunks, set(task))
+            self.chunks_fetched += len(stored)
+            left = [digest for digest in task if digest not in stored]
+            if len(left) == len(task):
+                raise SyncError('no chunks')
+            return [left] if left else ()
+
+        await self.node.sync.fetch(
+            peers, [missing[i:i + self.chunk_batch]
+                    for i in range(0, len(missing), self.chunk_batch)],
+            fetch)
+
+    async def fast_sync(self, peers=None):
+        """Load the state of our shard from the peers' latest snapshot
+
+        Args:
+            peers (list, optional): Defaults to the peers of our shard
+
+        Returns:
+            State: The state of the snapshot, or None if there was no
+                snapshot ahead of our chain to load
+        """
+
+        blockchain = self.node.blockchain
+        peers = list(peers if peers is not None else self.node.sync.peers())
+        if not peers:
+            return None
+        manifest, serving = await self._find_manifest(peers)
+        if manifest is None or manifest.height <= blockchain.height:
+            return None
+
+        start = time.perf_counter()
+        self.logger.info(
+            f'Fetching the snapshot at height {manifest.height}, root '
+            f'{manifest.root.hex()}, from {len(serving)} peers')
+        try:
+            chunk_bits(manifest)
+            await self._download(serving, manifest)
+            state = await self.evloop.run_in_executor(
+                None, load_state, self.store.directory, manifest)
+        except (SyncError, SnapshotError) as e:
+            self.logger.warning(f'Snapshot sync failed: {e}')
+            return None
+        if manifest.height <= blockchain.height:
+            # the chain was synced past the snapshot meanwhile
+            return None
+
+        self._previous, self.manifest = self.manifest, manifest
+        self._save_manifest(manifest)
+        self._adopt(state, manifest)
+        self.logger.info(
+            f'Loaded the snapshot at height {manifest.height}, '
+            f'{len(state.utxo)} coins, in '
+            f'{time.perf_counter() - start:.1f}s')
+        return state
+
+    def stats(self):
+        return {'taken': self.taken, 'height': self._height,
+                'chunks_written': self.chunks_written,
+                'chunks_fetched': self.chunks_fetched}
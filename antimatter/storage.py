@@ -0,0 +1,210 @@
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from codec import decode, encode
+
+
+class StorageError(Exception):
+    pass
+
+
+class CollationLog(object):
+    """Append-only, segmented on-disk log of collations
+
+    Each record is laid out as
+
+        u32 payload length | u32 crc32 of payload | payload
+
+    where the payload is the 32 byte collation id followed by the collation
+    encoded with `codec.encode`. Records are appended to numbered segment
+    files, and a new segment is started once the current one grows past
+    `segment_size`. Opening the log scans the segments to rebuild the
+    collation id -> (segment, offset) index; a torn or corrupt record at the
+    end of the last segment, as left behind by a crash, is cut off.
+
+    Appends are buffered and written with a single write and fsync per
+    batch, either once `batch_size` records are queued or when `flush` is
+    called. Reads go through read-only memory maps of the segments.
+    """
+
+    SEGMENT_SIZE = 64 * 1024 * 1024
+    BATCH_SIZE = 64
+    RECORD_HEADER = struct.Struct('!II')
+    ID_SIZE = 32
+
+    def __init__(self, directory, segment_size=None, batch_size=None):
+        self.logger = logging.getLogger(CollationLog.__name__)
+        self.directory = directory
+        self.segment_size = segment_size or CollationLog.SEGMENT_SIZE
+        self.batch_size = batch_size or CollationLog.BATCH_SIZE
+
+        # collation id -> (segment number, record offset), in append order
+        self.index = dict()
+        # (collation id, record bytes) waiting to be flushed
+        self.pending = list()
+        self._pending_ids = dict()
+        # segment number -> mmap of that segment
+        self._maps = dict()
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(
+            int(name[:-len('.log')]) for name in os.listdir(directory)
+            if name.endswith('.log') and name[:-len('.log')].isdigit())
+        for i, segment in enumerate(self.segments):
+            self._scan(segment, last=(i == len(self.segments) - 1))
+
+        if not self.segments:
+            self.segments.append(0)
+        self._file = open(self._segment_path(self.segments[-1]), 'ab')
+
+    def __len__(self):
+        return len(self.index) + len(self.pending)
+
+    def __contains__(self, collation_id):
+        return collation_id in self.index or collation_id in self._pending_ids
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f'{segment:08d}.log')
+
+    def _scan(self, segment, last):
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        offset = 0
+
+        if size > 0:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with memoryview(data) as view:
+                offset = self._scan_records(segment, view)
+            data.close()
+
+        if offset == size:
+            return
+        if not last:
+            raise StorageError(f'Corrupt record in {path} at {offset}')
+
+        # a crash left a partial record behind, drop it
+        self.logger.warning(f'Truncating {path} from {size} to {offset} bytes')
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _scan_records(self, segment, view):
+        # index every intact record, returning the offset where they end
+        header_size = CollationLog.RECORD_HEADER.size
+        offset = 0
+        while offset + header_size <= len(view):
+            length, crc = CollationLog.RECORD_HEADER.unpack_from(view, offset)
+            start = offset + header_size
+            end = start + length
+            if length < CollationLog.ID_SIZE or end > len(view) or \
+                    zlib.crc32(view[start:end]) != crc:
+                break
+            collation_id = view[start:start + CollationLog.ID_SIZE].tobytes()
+            self.index[collation_id] = (segment, offset)
+            offset = end
+        return offset
+
+    def append(self, collation):
+        """Queue a collation to be written; flushes once a batch is full"""
+        collation_id = collation.header.collation_id
+        if collation_id in self:
+            return
+
+        payload = collation_id + encode(collation)
+        record = CollationLog.RECORD_HEADER.pack(
+            len(payload), zlib.crc32(payload)) + payload
+        self._pending_ids[collation_id] = collation
+        self.pending.append((collation_id, record))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write and fsync all queued records"""
+        if not self.pending:
+            return
+
+        batch = list()
+        offset = self._file.tell()
+        segment = self.segments[-1]
+        for collation_id, record in self.pending:
+            if offset > 0 and offset + len(record) > self.segment_size:
+                self._write(batch)
+                batch = list()
+                segment = self._roll()
+                offset = 0
+            self.index[collation_id] = (segment, offset)
+            batch.append(record)
+            offset += len(record)
+        self._write(batch)
+
+        self.pending = list()
+        self._pending_ids = dict()
+
+    def _write(self, records):
+        if not records:
+            return
+        self._file.write(b''.join(records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _roll(self):
+        self._file.close()
+        segment = self.segments[-1] + 1
+        self.segments.append(segment)
+        self._file = open(self._segment_path(segment), 'ab')
+        return segment
+
+    def _map(self, segment, end):
+        data = self._maps.get(segment)
+        if data is None or len(data) < end:
+            # the active segment grew since it was mapped
+            if data is not None:
+                data.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = data
+        return data
+
+    def get(self, collation_id):
+        """Read a collation back, or None if it is not in the log"""
+        pending = self._pending_ids.get(collation_id)
+        if pending is not None:
+            return pending
+
+        location = self.index.get(collation_id)
+        if location is None:
+            return None
+
+        segment, offset = location
+        header_size = CollationLog.RECORD_HEADER.size
+        data = self._map(segment, offset + header_size)
+        length, _ = CollationLog.RECORD_HEADER.unpack_from(data, offset)
+        end = offset + header_size + length
+        data = self._map(segment, end)
+
+        with memoryview(data) as view:
+            payload = view[offset + header_size + CollationLog.ID_SIZE:end]
+            try:
+                return decode(payload)
+            finally:
+                payload.release()
+
+    def __iter__(self):
+        """All collations in the order they were appended"""
+        for collation_id in list(self.index):
+            yield self.get(collation_id)
+        for collation in list(self._pending_ids.values()):
+            yield collation
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        for data in self._maps.values():
+            data.close()
+        self._maps = dict()
@@ -0,0 +1,555 @@
+import asyncio
+import itertools
+import logging
+import os
+import struct
+import time
+
+from collections import deque
+
+from blockchain import Blockchain
+from codec import CodecError, decode, encode
+from framing import FrameDecoder, FrameError, frame
+from objects import CollationRequest, CollationResponse
+from verifier import verify_batch
+
+
+class SyncError(Exception):
+    pass
+
+
+class HeaderStore(object):
+    """Headers downloaded by an unfinished sync, kept across restarts
+
+    Every record is a frame holding the u64 height of a header followed by
+    the encoded header. Headers are only appended once they are verified
+    and linked to the ones below them, so after a restart the stored run
+    of headers is trusted and only the rest has to be downloaded again. A
+    torn record at the end of the file is cut off when it is opened.
+    """
+
+    HEIGHT = struct.Struct('!Q')
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(HeaderStore.__name__)
+        self.path = path
+        # height -> CollationHeader, for a contiguous range of heights
+        self.headers = dict()
+        self._load()
+        self._file = open(path, 'ab')
+
+    def __len__(self):
+        return len(self.headers)
+
+    @property
+    def last(self):
+        return max(self.headers) if self.headers else None
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        try:
+            payloads = FrameDecoder().feed(data)
+        except FrameError:
+            payloads = list()
+
+        end = 0
+        for payload in payloads:
+            height, = HeaderStore.HEIGHT.unpack_from(payload, 0)
+            try:
+                header = decode(payload[HeaderStore.HEIGHT.size:])
+            except CodecError:
+                break
+            if self.headers and height != self.last + 1:
+                break
+            header.collation_id = header.compute_collation_id()
+            self.headers[height] = header
+            end += FrameDecoder.HEADER.size + len(payload)
+
+        if end != len(data):
+            self.logger.warning(
+                f'Truncating {self.path} from {len(data)} to {end} bytes')
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+
+    def add(self, height, header):
+        self.headers[height] = header
+        self._file.write(frame(HeaderStore.HEIGHT.pack(height) +
+                               encode(header)))
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def clear(self):
+        self.headers = dict()
+        self._file.truncate(0)
+        self.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CollationSync(object):
+    """Catches the chain of our shard up with the peers serving it
+
+    A sync round first asks every peer of the shard for its head and picks
+    the highest one as the target. The headers from a little below our
+    own head up to the target are then downloaded in ranges of
+    `header_batch`, spread over all peers with up to `pipeline` requests in
+    flight to each. Their proposer signatures are checked on the worker
+    pool, and each range is linked to the one below it before it is kept,
+    so the chain of headers is known to be intact before any body is
+    fetched. Above the point where it leaves our chain, the collations are
+    then fetched by id in batches of `body_batch`, again from all peers at
+    once, and checked against their headers. They are applied in height
+    order, each once the node validated it like a collation received by
+    gossip, against the state as of its parent. Neither the target nor the
+    headers are trusted beyond their signatures: a chain with an invalid
+    collation ends the round below it.
+
+    A request that times out or is answered with bad data is handed to
+    another peer, and a peer failing `max_failures` times is no longer
+    asked during the round. Verified headers are kept in a HeaderStore and
+    applied collations in the collation log, so a sync interrupted by a
+    restart resumes where it stopped.
+
+    Requests for our own chain are answered by `serve`.
+    """
+
+    HEADER_BATCH = 512
+    BODY_BATCH = 32
+    PIPELINE = 4
+    TIMEOUT = 10.
+    MAX_FAILURES = 3
+    # headers below our head that are fetched again to find a fork point
+    REORG_WINDOW = 64
+    # bodies fetched ahead of the next one to apply
+    MAX_AHEAD = 4096
+    # limits on what is served per request
+    MAX_HEADERS = 2048
+    MAX_BODIES = 256
+
+    def __init__(self, node_ref, evloop, path=None, executor=None,
+                 header_batch=None, body_batch=None, pipeline=None,
+                 timeout=None, max_failures=None):
+        """
+        Args:
+            node_ref (participant.Participant): Owns the chain being synced
+            evloop (asyncio.AbstractEventLoop): The loop to run on
+            path (str, optional): File the HeaderStore is kept in. Headers
+                are only kept in memory if not set.
+            executor (concurrent.futures.Executor, optional): Checks the
+                header signatures. Defaults to the loop's default executor.
+            header_batch (int, optional): Defaults to HEADER_BATCH
+            body_batch (int, optional): Defaults to BODY_BATCH
+            pipeline (int, optional): Defaults to PIPELINE. Requests in
+                flight per peer.
+            timeout (float, optional): Defaults to TIMEOUT. Seconds to wait
+                for a response.
+            max_failures (int, optional): Defaults to MAX_FAILURES
+        """
+
+        self.logger = logging.getLogger(CollationSync.__name__)
+        self.node = node_ref
+        self.evloop = evloop
+        self.executor = executor
+        self.header_batch = header_batch or CollationSync.HEADER_BATCH
+        self.body_batch = body_batch or CollationSync.BODY_BATCH
+        self.pipeline = pipeline or CollationSync.PIPELINE
+        self.timeout = timeout or CollationSync.TIMEOUT
+        self.max_failures = max_failures or CollationSync.MAX_FAILURES
+        self.store = HeaderStore(path) if path is not None else None
+
+        self._request_ids = itertools.count(1)
+        # request_id -> (peer, future of the response)
+        self._pending = dict()
+        self._task = None
+        # resolved whenever a download makes progress
+        self._changed = self.evloop.create_future()
+
+        # metrics
+        self.requests = 0
+        self.failures = 0
+        self.headers_fetched = 0
+        self.bodies_fetched = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def _notify(self):
+        if not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = self.evloop.create_future()
+
+    def serve(self, request, peer):
+        """Answer a CollationRequest from `peer` out of our own chain"""
+        blockchain = self.node.blockchain
+        response = CollationResponse(request.request_id, blockchain.height)
+        if request.shard_id is not None and \
+                request.shard_id != self.node.shard.shard_number:
+            response.tip_height = 0
+
+        elif request.latest:
+            head = blockchain.get_head()
+            if head is not None:
+                response.headers = (head.header,)
+
+        elif request.collation_ids or request.collation_id is not None:
+            ids = request.collation_ids or (request.collation_id,)
+            found = (blockchain.get(collation_id)
+                     for collation_id in ids[:CollationSync.MAX_BODIES])
+            response.collations = tuple(c for c in found if c is not None)
+
+        elif request.count:
+            end = min(blockchain.height + 1, request.start_height +
+                      min(request.count, CollationSync.MAX_HEADERS))
+            response.headers = tuple(
+                blockchain.get_by_height(height).header
+                for height in range(max(1, request.start_height), end))
+
+        self.node.network.send_obj([peer], response)
+
+    def handle_response(self, response, peer):
+        entry = self._pending.get(response.request_id)
+        if entry is None or entry[0] != peer:
+            self.logger.debug(f'Unexpected response from {peer}')
+            return
+        del self._pending[response.request_id]
+        if not entry[1].done():
+            entry[1].set_result(response)
+
+    async def request(self, peer, request_cls=CollationRequest, **fields):
+        """Send a request for our shard and wait for the answer
+
+        Args:
+            peer (str): The peer to ask
+            request_cls (type, optional): Defaults to CollationRequest. The
+                kind of request, answered with a response carrying the same
+                `request_id`.
+            **fields: The fields of the request
+
+        Raises:
+            asyncio.TimeoutError: If `peer` does not answer within `timeout`
+        """
+
+        request_id = next(self._request_ids) & 0xffffffff
+        future = self.evloop.create_future()
+        self._pending[request_id] = (peer, future)
+        self.requests += 1
+        self.node.network.send_obj([peer], request_cls(
+            request_id=request_id, shard_id=self.node.shard.shard_number,
+            **fields))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def peers(self):
+        return self.node.gossip.subscribers(self.node.shard.shard_number)
+
+    def start(self):
+        """Run sync rounds in the background, unless they already run"""
+        if not self.running:
+            self._task = asyncio.ensure_future(self.run(), loop=self.evloop)
+        return self._task
+
+    async def run(self):
+        """Sync until a round brings nothing new"""
+        while True:
+            try:
+                if not await self.sync_once():
+                    return
+            except SyncError as e:
+                self.logger.warning(f'Sync failed: {e}')
+                if self.store is not None:
+                    self.store.clear()
+                return
+
+    async def sync_once(self, peers=None):
+        """One sync round to the best head among `peers`
+
+        Args:
+            peers (list, optional): Defaults to the peers of our shard
+
+        Raises:
+            SyncError: If the peers could not provide the chain
+
+        Returns:
+            bool: True if the chain advanced
+        """
+
+        peers = list(peers if peers is not None else self.peers())
+        if not peers:
+            return False
+        peers, target = await self._find_target(peers)
+        blockchain = self.node.blockchain
+        if target is None or target <= blockchain.height:
+            return False
+
+        start = time.perf_counter()
+        self.logger.info(f'Syncing from height {blockchain.height} to '
+                         f'{target} with {len(peers)} peers')
+        base = max(1, blockchain.height - CollationSync.REORG_WINDOW + 1)
+        headers = await self._download_headers(peers, base, target)
+
+        # skip the headers we already have on our chain
+        fork = base
+        while fork <= target and headers[fork].collation_id in blockchain:
+            fork += 1
+        applied = await self._download_bodies(peers, headers, fork, target)
+
+        if self.store is not None:
+            self.store.clear()
+        elapsed = time.perf_counter() - start
+        self.logger.info(
+            f'Synced {applied} collations to height {blockchain.height} in '
+            f'{elapsed:.1f}s, {self.requests} requests, '
+            f'{self.failures} failures')
+        return applied > 0
+
+    async def _find_target(self, peers):
+        async def head_of(peer):
+            try:
+                return await self.request(peer, latest=True)
+            except asyncio.TimeoutError:
+                return None
+
+        responses = await asyncio.gather(*[head_of(peer) for peer in peers])
+        heights = {peer: response.tip_height
+                   for peer, response in zip(peers, responses)
+                   if response is not None and response.tip_height > 0}
+        if not heights:
+            return list(), None
+        target = max(heights.values())
+        # peers behind the best head still serve the ranges they have
+        serving = [peer for peer, height in heights.items()
+                   if height > self.node.blockchain.height]
+        return serving, target
+
+    async def fetch(self, peers, tasks, fetch, ready=None):
+        """Spread `tasks` over `peers` until all of them are done
+
+        `fetch(peer, task)` performs a task and returns the tasks left to
+        do, such as the rest of a partially answered request. Those and
+        the tasks that failed are retried first, by any peer. If `ready` is
+        given, a task is only started once `ready(task)` holds.
+
+        Raises:
+            SyncError: If every peer failed `max_failures` times
+        """
+
+        queue = deque(tasks)
+        failures = dict.fromkeys(peers, 0)
+
+        async def worker(peer):
+            while queue and failures[peer] < self.max_failures:
+                if ready is not None and not ready(queue[0]):
+                    await self._changed
+                    continue
+                task = queue.popleft()
+                try:
+                    retry = await fetch(peer, task)
+                except (asyncio.TimeoutError, SyncError) as e:
+                    self.logger.info(f'Sync request to {peer} failed: '
+                                     f'{type(e).__name__} {e}')
+                    failures[peer] += 1
+                    self.failures += 1
+                    retry = (task,)
+                queue.extendleft(reversed(retry))
+                self._notify()
+
+        while queue:
+            healthy = [peer for peer in peers
+                       if failures[peer] < self.max_failures]
+            if not healthy:
+                raise SyncError(f'{len(queue)} requests left unanswered')
+            await asyncio.gather(*[worker(peer) for peer in healthy
+                                   for _ in range(self.pipeline)])
+
+    async def _download_headers(self, peers, base, target):
+        """Download and link the headers from `base` to `target`
+
+        Returns:
+            dict: height -> CollationHeader
+        """
+
+        blockchain = self.node.blockchain
+        if base == 1:
+            expected_parent = Blockchain.GENESIS_COLLATION_HASH
+        else:
+            expected_parent = blockchain.get_by_height(base - 1) \
+                .header.collation_id
+
+        headers = dict()
+        if self.store is not None:
+            # resume from the headers kept by an interrupted sync, if they
+            # still continue our chain
+            stored = self.store.headers.get(base)
+            if stored is not None and stored.parent_hash == expected_parent:
+                headers = {height: header for height, header
+                           in self.store.headers.items() if height >= base}
+            else:
+                self.store.clear()
+        # ranges downloaded but not linked to the headers below them yet
+        unlinked = dict()
+        state = {'top': max(headers) if headers else base - 1}
+
+        def link():
+            # move the ranges that continue the linked headers over, and
+            # return the range to fetch again if the next one does not
+            while state['top'] + 1 in unlinked:
+                top = state['top']
+                batch = unlinked.pop(top + 1)
+                parent = headers[top].collation_id if top >= base \
+                    else expected_parent
+                if batch[0].parent_hash != parent:
+                    return top + 1, len(batch)
+                for height, header in enumerate(batch, top + 1):
+                    headers[height] = header
+                    if self.store is not None:
+                        self.store.add(height, header)
+                state['top'] = top + len(batch)
+            return None
+
+        async def fetch(peer, task):
+            first, count = task
+            response = await self.request(
+                peer, start_height=first, count=count)
+            batch = response.headers[:count]
+            if not batch:
+                raise SyncError(f'no headers from {first}')
+            self.headers_fetched += len(batch)
+
+            shard = self.node.shard.shard_number
+            for header in batch:
+                if header.shard_id != shard:
+                    raise SyncError('header of another shard')
+                header.collation_id = header.compute_collation_id()
+            for parent, child in zip(batch, batch[1:]):
+                if child.parent_hash != parent.collation_id:
+                    raise SyncError(f'headers from {first} are not linked')
+            valid = await self.evloop.run_in_executor(
+                self.executor, verify_batch,
+                [(header.proposer_pk, header.signing_data(),
+                  header.proposer_sig) for header in batch])
+            if not all(valid):
+                raise SyncError(f'invalid proposer signature from {first}')
+
+            unlinked[first] = batch
+            retry = list()
+            broken = link()
+            if broken is not None:
+                if broken[0] == first:
+                    raise SyncError(f'headers from {first} do not continue '
+                                    f'the chain')
+                # another peer's range did not link to this one
+                retry.append(broken)
+            if len(batch) < count:
+                retry.append((first + len(batch), count - len(batch)))
+            return retry
+
+        def ranges():
+            for first in range(state['top'] + 1, target + 1,
+                               self.header_batch):
+                yield first, min(self.header_batch, target + 1 - first)
+
+        try:
+            await self.fetch(peers, ranges(), fetch)
+        finally:
+            if self.store is not None:
+                self.store.flush()
+        return headers
+
+    async def _download_bodies(self, peers, headers, first, target):
+        """Fetch, validate and apply the collations from `first` to `target`
+
+        Raises:
+            SyncError: If a collation is invalid, or the peers could not
+                provide the collations
+
+        Returns:
+            int: The number of collations applied
+        """
+
+        bodies = dict()
+        state = {'next': first}
+
+        async def apply():
+            # one at a time, since each is checked against the state its
+            # parent left
+            while state['next'] <= target:
+                height = state['next']
+                if height not in bodies:
+                    await self._changed
+                    continue
+                collation = bodies[height]
+                result = await self.node.verify_collation(collation)
+                if not result.valid:
+                    raise SyncError(f'invalid collation at height {height}: '
+                                    f'{result.reason}')
+                if collation.header.collation_id not in self.node.blockchain:
+                    self.node.accept_collation(collation)
+                del bodies[height]
+                state['next'] += 1
+                self._notify()
+
+        async def fetch(peer, task):
+            height, count = task
+            wanted = {headers[h].collation_id: h
+                      for h in range(height, height + count)}
+            response = await self.request(peer, collation_ids=list(wanted))
+
+            for collation in response.collations:
+                h = wanted.get(collation.header.collation_id)
+                if h is None:
+                    continue
+                if collation.merkle_tree.root != \
+                        headers[h].txns_merkle_root:
+                    raise SyncError('txns do not match the merkle root')
+                bodies[h] = collation
+            self.bodies_fetched += len(response.collations)
+
+            missing = [h for h in range(height, height + count)
+                       if h >= state['next'] and h not in bodies]
+            if len(missing) == count:
+                raise SyncError(f'no collations from {height}')
+            if missing:
+                return [(missing[0], height + count - missing[0])]
+            return ()
+
+        def ranges():
+            for height in range(first, target + 1, self.body_batch):
+                yield height, min(self.body_batch, target + 1 - height)
+
+        def ready(task):
+            return task[0] < state['next'] + CollationSync.MAX_AHEAD
+
+        tasks = [
+            asyncio.ensure_future(self.fetch(peers, ranges(), fetch, ready),
+                                  loop=self.evloop),
+            asyncio.ensure_future(apply(), loop=self.evloop)]
+        try:
+            done, _ = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            await tasks[1]
+        finally:
+            for task in tasks:
+                task.cancel()
+        return state['next'] - first
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        for _, future in self._pending.values():
+            future.cancel()
+        if self.store is not None:
+            self.store.close()
+
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from blockchain import Shard
+from crypto import verify_signature
+from merkle import MerkleTree
+from verifier import verify_batch
+
+
+ValidationResult = namedtuple('ValidationResult',
+                              ['collation', 'valid', 'reason'])
+
+
+class StateUnavailable(Exception):
+    """Raised by `state_of` when a collation cannot be checked yet"""
+
+
+def check_header(proposer_pk, signing_data, proposer_sig, leaves,
+                 merkle_root):
+    """Check the proposer signature and the Merkle root of a collation
+
+    This runs inside the executor workers, so it only takes picklable
+    arguments.
+
+    Returns:
+        str: Why the header is invalid, or None if it is valid
+    """
+
+    if proposer_pk is None or proposer_sig is None:
+        return 'collation is not signed'
+    if not verify_signature(proposer_pk, signing_data, proposer_sig):
+        return 'invalid proposer signature'
+    if MerkleTree(leaves).root != merkle_root:
+        return 'txns do not match the merkle root'
+    return None
+
+
+class CollationValidator(object):
+    """Validates collations of any shard on a pool of workers
+
+    Validating a collation is split in two parts. The stateless checks --
+    the proposer signature, the Merkle root and the transaction signatures --
+    are handed to the pool: the header as one task and the transactions in
+    chunks of `chunk_size`, so collations of independent shards and the
+    transactions of a single collation are all checked in parallel. Since
+    the transactions of a valid collation never spend the same coin, they
+    are checked for conflicting inputs on the event loop first, and a
+    collation with conflicts is rejected without using the pool.
+
+    Once the stateless checks pass, the transactions are applied in order to
+    an overlay of the shard state returned by `state_of`, if any. This part
+    runs on the event loop without yielding, so it always sees the state
+    as of the moment the collation is accepted.
+
+    The receipts a collation consumes from other shards are checked against
+    their own headers on the event loop, and their certificates with the
+    `certified` callback, before the state is touched.
+    """
+
+    CHUNK_SIZE = 32
+
+    def __init__(self, evloop, workers=None, use_threads=False,
+                 chunk_size=None, executor=None, shard_of=None):
+        """
+        Args:
+            evloop (asyncio.AbstractEventLoop): The loop results are
+                reported on
+            workers (int, optional): Defaults to one per core. Ignored if
+                `executor` is given.
+            use_threads (bool): Use a thread pool instead of a process pool
+            chunk_size (int, optional): Defaults to CHUNK_SIZE. Number of
+                transaction signatures checked per task.
+            executor (concurrent.futures.Executor, optional): A pool shared
+                with other components, not shut down by `close`
+            shard_of (callable, optional): Defaults to Shard.shard_of_key.
+                Maps a sender public key to its shard.
+        """
+
+        self.logger = logging.getLogger(CollationValidator.__name__)
+        self.evloop = evloop
+        self.chunk_size = chunk_size or CollationValidator.CHUNK_SIZE
+        self.shard_of = shard_of or Shard.shard_of_key
+
+        self._owns_executor = executor is None
+        if executor is None:
+            if workers is None:
+                workers = os.cpu_count() or 1
+            if use_threads:
+                executor = ThreadPoolExecutor(max_workers=workers)
+            else:
+                executor = ProcessPoolExecutor(max_workers=workers)
+        self.executor = executor
+
+        self.in_flight = 0
+        self.validated = 0
+        self.rejected = 0
+
+    def validate(self, collation, state_of=None, validate_txn=None,
+                 expected_id=None, validate_receipt=None, certified=None):
+        """Start validating a collation
+
+        Args:
+            collation (Collation): The collation to check
+            state_of (callable, optional): Called with the collation once the
+                stateless checks pass. Returns the state to check the
+                transactions against, or None to skip that check, and
+                raises StateUnavailable to reject the collation.
+            validate_txn (callable, optional): Checks and applies one
+                transaction to a StateOverlay, like
+                `Participant._validate_txn`. Required with `state_of`.
+            expected_id (bytes, optional): The id the collation was
+                requested by
+            validate_receipt (callable, optional): Checks and applies one
+                CrossShardReceipt to a StateOverlay, like
+                `Participant._validate_receipt`. Required with `state_of`
+                for collations with receipts.
+            certified (callable, optional): Called with the receipts of the
+                collation, returns an awaitable resolving to True if their
+                certificates are valid. Collations with receipts are
+                rejected without it.
+
+        Returns:
+            asyncio.Future: Resolves to a ValidationResult
+        """
+
+        self.in_flight += 1
+        future = asyncio.ensure_future(
+            self._validate(collation, state_of, validate_txn, expected_id,
+                           validate_receipt, certified),
+            loop=self.evloop)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self.in_flight -= 1
+        if future.cancelled() or future.exception() is not None:
+            return
+        if future.result().valid:
+            self.validated += 1
+        else:
+            self.rejected += 1
+
+    def _reject(self, collation, reason):
+        self.logger.warning(
+            f'Rejecting collation {collation.header.collation_id.hex()}: '
+            f'{reason}')
+        return ValidationResult(collation, False, reason)
+
+    def _stateless_checks(self, collation, expected_id):
+        # cheap checks done on the event loop before using the pool
+        header = collation.header
+        if header.collation_id != collation.digest():
+            return 'collation id does not match the header'
+        if expected_id is not None and header.collation_id != expected_id:
+            return 'unexpected collation id'
+        if not collation.txns and not collation.receipts:
+            return 'collation has no txns'
+
+        spent = set()
+        for txn in collation.txns:
+            if self.shard_of(txn.src_pk) != header.shard_id:
+                return f'txn {txn.txn_id.hex()} is from another shard'
+            for coin_id in txn.inputs:
+                if coin_id in spent:
+                    return f'coin {coin_id.hex()} is spent twice'
+                spent.add(coin_id)
+
+        for receipt in collation.receipts:
+            if receipt.shard_id != header.shard_id:
+                return 'receipt is for another shard'
+            # a few hashes per txn, cheap enough for the event loop
+            reason = receipt.verify(self.shard_of)
+            if reason is not None:
+                return f'invalid receipt: {reason}'
+        return None
+
+    async def _validate(self, collation, state_of, validate_txn, expected_id,
+                        validate_receipt, certified):
+        reason = self._stateless_checks(collation, expected_id)
+        if reason is not None:
+            return self._reject(collation, reason)
+
+        header = collation.header
+        tasks = [self.evloop.run_in_executor(
+            self.executor, check_header, header.proposer_pk,
+            collation.signing_data(), header.proposer_sig,
+            collation.merkle_leaves(), header.txns_merkle_root)]
+
+        # no two txns spend the same coin, so their signatures are checked
+        # in independent chunks
+        sigs = [(txn.src_pk, txn.serialize(), txn.src_sig)
+                for txn in collation.txns]
+        for start in range(0, len(sigs), self.chunk_size):
+            tasks.append(self.evloop.run_in_executor(
+                self.executor, verify_batch,
+                sigs[start:start + self.chunk_size]))
+
+        try:
+            reason, *verdicts = await asyncio.gather(*tasks)
+        except Exception as e:
+            return self._reject(collation, f'validation failed: {e}')
+        if reason is not None:
+            return self._reject(collation, reason)
+        if not all(all(chunk) for chunk in verdicts):
+            return self._reject(collation, 'invalid txn signature')
+
+        if collation.receipts and (
+                certified is None or
+                not await certified(collation.receipts)):
+            return self._reject(collation, 'receipt is not certified')
+
+        try:
+            state = state_of(collation) if state_of is not None else None
+        except StateUnavailable as e:
+            return self._reject(collation, f'cannot check the txns: {e}')
+        if state is not None:
+            overlay = state.overlay()
+            try:
+                for txn in collation.txns:
+                    if not validate_txn(overlay, txn):
+                        return self._reject(
+                            collation, f'invalid txn {txn.txn_id.hex()}')
+                for receipt in collation.receipts:
+                    if not validate_receipt(overlay, receipt):
+                        return self._reject(
+                            collation,
+                            f'receipt {receipt.digest().hex()} credits '
+                            f'nothing')
+            finally:
+                overlay.discard()
+
+        return ValidationResult(collation, True, None)
+
+    def close(self, wait=False):
+        if self._owns_executor:
+            self.executor.shutdown(wait=wait)
@@ -0,0 +1,127 @@
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from crypto import verify_signature
+
+
+def verify_batch(batch):
+    """Verify a batch of signatures
+
+    This runs inside the executor workers, so it only takes picklable
+    arguments.
+
+    Args:
+        batch (list): (public key bytes, data, signature) tuples
+
+    Returns:
+        list: One bool per entry of `batch`
+    """
+
+    results = list()
+    for public_key, data, sig in batch:
+        try:
+            results.append(verify_signature(public_key, data, sig))
+        except Exception:
+            # a malformed key or signature fails alone, not its whole batch
+            results.append(False)
+    return results
+
+
+class SignatureVerifier(object):
+    """Checks signatures in batches on a pool of workers
+
+    Signatures submitted from the event loop are queued and handed to the
+    pool once `batch_size` of them are waiting, or `max_delay` seconds after
+    the first one arrived. Each submission gets an asyncio future that is
+    resolved on the event loop with the verification result.
+    """
+
+    BATCH_SIZE = 64
+    MAX_DELAY = 0.005
+
+    def __init__(self, evloop, workers=None, use_threads=False,
+                 batch_size=None, max_delay=None):
+        self.logger = logging.getLogger(SignatureVerifier.__name__)
+        self.evloop = evloop
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        if use_threads:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+
+        self.batch_size = batch_size or SignatureVerifier.BATCH_SIZE
+        self.max_delay = max_delay or SignatureVerifier.MAX_DELAY
+
+        # keep every worker busy with one batch and one more queued behind it
+        self.max_in_flight = 2 * workers
+        self.in_flight = 0
+        self.pending = list()
+        self._flush_handle = None
+
+    def submit(self, public_key, data, sig):
+        """Queue a signature for verification
+
+        Args:
+            public_key (bytes): The PEM encoded public key
+            data (bytes): The signed data
+            sig (bytes): The signature
+
+        Returns:
+            asyncio.Future: Resolves to True if the signature is valid
+        """
+
+        future = self.evloop.create_future()
+        if sig is None:
+            future.set_result(False)
+            return future
+        self.pending.append(((bytes(public_key), bytes(data), sig), future))
+
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.evloop.call_later(
+                self.max_delay, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        while self.pending and self.in_flight < self.max_in_flight:
+            batch = self.pending[:self.batch_size]
+            del self.pending[:self.batch_size]
+
+            self.in_flight += 1
+            result = self.evloop.run_in_executor(
+                self.executor, verify_batch, [item for item, _ in batch])
+            result.add_done_callback(
+                lambda result, batch=batch: self._batch_done(batch, result))
+
+    def _batch_done(self, batch, result):
+        self.in_flight -= 1
+
+        if result.cancelled() or result.exception() is not None:
+            exc = None if result.cancelled() else result.exception()
+            self.logger.error(f'Signature batch failed: {exc}')
+            verdicts = [False] * len(batch)
+        else:
+            verdicts = result.result()
+
+        for (_, future), valid in zip(batch, verdicts):
+            if not future.done():
+                future.set_result(valid)
+
+        # the pool has room again, hand it whatever queued up meanwhile
+        if self.pending:
+            self._flush()
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,341 @@
+import logging
+import math
+import time
+
+from collections import OrderedDict, deque
+
+from crypto import generate_hash, verify_signature
+from gossip import TTLCache
+from objects import VoteCertificate
+from sampling import claim_ticket
+
+
+def check_votes(batch):
+    """Check the signatures and seat claims of a batch of votes
+
+    This runs inside the executor workers, so it only takes picklable
+    arguments.
+
+    Args:
+        batch (list): (public key, signed data, signature, VRF input,
+            proof) tuples. The VRF input is None for seats checked before.
+
+    Returns:
+        list: (signature valid, seat ticket or None) per entry of `batch`
+    """
+
+    results = list()
+    for public_key, data, sig, vrf_input, proof in batch:
+        try:
+            ticket = None
+            if vrf_input is not None:
+                ticket = claim_ticket(public_key, vrf_input, proof)
+            results.append((verify_signature(public_key, data, sig), ticket))
+        except Exception:
+            # a malformed vote fails alone, not its whole batch
+            results.append((False, None))
+    return results
+
+
+class Tally(object):
+    """The votes collected for one collation"""
+
+    __slots__ = ('collation_id', 'shard', 'epoch', 'votes', 'certificate')
+
+    def __init__(self, collation_id, shard, epoch):
+        self.collation_id = collation_id
+        self.shard = shard
+        self.epoch = epoch
+        # collator fingerprint -> CollationVote
+        self.votes = OrderedDict()
+        self.certificate = None
+
+
+class VoteAggregator(object):
+    """Collects the committee votes on collations into certificates
+
+    A vote is counted once per (collation, collator); repeated votes are
+    dropped before any work is done on them. New votes are queued and
+    their signatures and seat claims checked in batches on a pool of
+    workers, once `batch_size` of them are waiting or `max_delay` seconds
+    after the first one arrived. Seat claims already checked, as found in
+    the sampler's cache, are not checked again.
+
+    Once the votes for a collation reach `quorum` of the shard's expected
+    committee size, a VoteCertificate is built: the seated collators seen
+    for the shard and epoch, a bitmap of those that voted and their
+    signatures. Certificates from other nodes are checked the same way.
+    The time from when a collation was first seen to its certificate is
+    kept as its finality latency.
+    """
+
+    QUORUM = 2 / 3
+    BATCH_SIZE = 64
+    MAX_DELAY = 0.005
+    # seconds a collation is remembered while it waits for a certificate
+    PENDING_TTL = 600.
+    LATENCY_SAMPLES = 1024
+
+    def __init__(self, evloop, sampler, population, executor=None,
+                 quorum=None, batch_size=None, max_delay=None,
+                 on_vote=None, on_certificate=None, clock=time.monotonic):
+        """
+        Args:
+            evloop (asyncio.AbstractEventLoop): The loop to run on
+            sampler (sampling.CommitteeSampler): Checks and caches seats
+            population (callable): Returns the number of nodes
+            executor (concurrent.futures.Executor, optional): Checks the
+                batches. Defaults to the loop's default executor.
+            quorum (float, optional): Defaults to QUORUM. Fraction of the
+                expected committee size needed for a certificate.
+            batch_size (int, optional): Defaults to BATCH_SIZE
+            max_delay (float, optional): Defaults to MAX_DELAY
+            on_vote (callable, optional): Called with every valid vote
+            on_certificate (callable, optional): Called with every new
+                certificate, built here or received
+            clock (callable, optional): Defaults to time.monotonic
+        """
+
+        self.logger = logging.getLogger(VoteAggregator.__name__)
+        self.evloop = evloop
+        self.sampler = sampler
+        self.population = population
+        self.executor = executor
+        self.quorum = quorum or VoteAggregator.QUORUM
+        self.batch_size = batch_size or VoteAggregator.BATCH_SIZE
+        self.max_delay = max_delay or VoteAggregator.MAX_DELAY
+        self.on_vote = on_vote
+        self.on_certificate = on_certificate
+        self.clock = clock
+
+        # (shard, epoch) -> {collation_id: Tally}
+        self.tallies = dict()
+        # (shard, epoch) -> {fingerprint: (public key, proof)} of the
+        # collators with a checked seat
+        self.rosters = dict()
+        # (collation_id, fingerprint) of the votes queued or in flight
+        self._queued = set()
+        self._batch = list()
+        self._flush_handle = None
+
+        # collation_id -> when it was first seen
+        self._first_seen = TTLCache(VoteAggregator.PENDING_TTL, clock)
+        # collation_id -> finality latency in seconds
+        self.latencies = TTLCache(VoteAggregator.PENDING_TTL, clock)
+        self._recent = deque(maxlen=VoteAggregator.LATENCY_SAMPLES)
+
+        # metrics
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.batches = 0
+
+    def quorum_size(self, shard):
+        expected = min(self.sampler.size_of(shard), self.population())
+        return max(1, math.ceil(self.quorum * expected))
+
+    def observe(self, collation_id):
+        """Start the finality clock of a collation"""
+        self._first_seen.add(collation_id, self.clock())
+
+    def finality_latency(self, collation_id):
+        """Seconds from first seeing a collation to its certificate"""
+        return self.latencies.get(collation_id)
+
+    def tally(self, shard, epoch, collation_id):
+        tallies = self.tallies.setdefault((shard, epoch), dict())
+        if collation_id not in tallies:
+            tallies[collation_id] = Tally(collation_id, shard, epoch)
+            self._first_seen.add(collation_id, self.clock())
+        return tallies[collation_id]
+
+    def _check_item(self, vote):
+        # the seat claim is only checked if the sampler has not seen it;
+        # claims for epochs not started yet have no input and are rejected
+        found, _ = self.sampler.lookup(
+            vote.collator_pk, vote.epoch, vote.shard_number, vote.proof)
+        vrf_input = None if found else \
+            self.sampler.vrf_input(vote.epoch, vote.shard_number)
+        return (vote.collator_pk, vote.serialize(), vote.collator_sig,
+                vrf_input, vote.proof)
+
+    def add(self, vote):
+        """Queue a vote to be checked and counted
+
+        Returns:
+            bool: False if the vote was a duplicate and dropped
+        """
+
+        self.received += 1
+        if vote.proof is None:
+            self.rejected += 1
+            return False
+        fingerprint = generate_hash(bytes(vote.collator_pk))
+        key = (vote.collation_id, fingerprint)
+        tally = self.tally(vote.shard_number, vote.epoch, vote.collation_id)
+        if fingerprint in tally.votes or key in self._queued:
+            self.duplicates += 1
+            return False
+
+        self._queued.add(key)
+        self._batch.append((vote, fingerprint, self._check_item(vote)))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self.evloop.call_later(
+                self.max_delay, self.flush)
+        return True
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batch:
+            return
+
+        batch, self._batch = self._batch, list()
+        self.batches += 1
+        future = self.evloop.run_in_executor(
+            self.executor, check_votes, [item for _, _, item in batch])
+        future.add_done_callback(
+            lambda f, batch=batch: self._batch_done(batch, f))
+
+    def _batch_done(self, batch, future):
+        if future.cancelled():
+            self.logger.error('Vote batch cancelled')
+            results = [(False, None)] * len(batch)
+        elif future.exception() is not None:
+            self.logger.error(f'Vote batch failed: {future.exception()}')
+            results = [(False, None)] * len(batch)
+        else:
+            results = future.result()
+
+        population = self.population()
+        for (vote, fingerprint, item), (valid, ticket) in zip(batch, results):
+            self._queued.discard((vote.collation_id, fingerprint))
+            ticket = self._ticket(vote, item, ticket)
+            if not valid or not self.sampler.seated(
+                    ticket, vote.shard_number, population):
+                self.rejected += 1
+                continue
+            self._count(vote, fingerprint)
+
+    def _ticket(self, vote, item, ticket):
+        # the seat was either checked in the batch, or found in the
+        # sampler's cache when the vote was queued
+        if item[3] is not None:
+            self.sampler.remember(vote.collator_pk, vote.epoch,
+                                  vote.shard_number, vote.proof, ticket)
+            return ticket
+        return self.sampler.lookup(vote.collator_pk, vote.epoch,
+                                   vote.shard_number, vote.proof)[1]
+
+    def _count(self, vote, fingerprint):
+        roster = self.rosters.setdefault(
+            (vote.shard_number, vote.epoch), dict())
+        roster[fingerprint] = (vote.collator_pk, vote.proof)
+        tally = self.tally(vote.shard_number, vote.epoch, vote.collation_id)
+        tally.votes[fingerprint] = vote
+        if self.on_vote is not None:
+            self.on_vote(vote)
+
+        if tally.certificate is None and \
+                len(tally.votes) >= self.quorum_size(vote.shard_number):
+            self._certified(tally, self._certificate(tally))
+
+    def _certificate(self, tally):
+        roster = self.rosters[(tally.shard, tally.epoch)]
+        members = sorted(roster)
+        signers = bytearray((len(members) + 7) // 8)
+        signatures = list()
+        for i, fingerprint in enumerate(members):
+            vote = tally.votes.get(fingerprint)
+            if vote is not None:
+                signers[i // 8] |= 0x80 >> (i % 8)
+                signatures.append(vote.collator_sig)
+        return VoteCertificate(
+            tally.collation_id, tally.shard, tally.epoch,
+            committee=[roster[f][0] for f in members],
+            proofs=[roster[f][1] for f in members],
+            signers=bytes(signers), signatures=signatures)
+
+    def _certified(self, tally, certificate):
+        tally.certificate = certificate
+        first_seen = self._first_seen.get(tally.collation_id)
+        if first_seen is not None:
+            latency = self.clock() - first_seen
+            self.latencies.add(tally.collation_id, latency)
+            self._recent.append(latency)
+        self.logger.info(
+            f'Collation {tally.collation_id.hex()} of shard {tally.shard} '
+            f'certified by {len(certificate.signatures)} collators')
+        if self.on_certificate is not None:
+            self.on_certificate(certificate)
+
+    def certified(self, collation_id, shard, epoch):
+        tally = self.tallies.get((shard, epoch), {}).get(collation_id)
+        return tally is not None and tally.certificate is not None
+
+    def add_certificate(self, certificate):
+        """Check a certificate received from a peer
+
+        Returns:
+            asyncio.Future: Resolves to True if the certificate is valid
+        """
+
+        result = self.evloop.create_future()
+        tally = self.tally(certificate.shard_number, certificate.epoch,
+                           certificate.collation_id)
+        votes = certificate.votes()
+        # every collator is counted once, as when its votes are tallied
+        members = {generate_hash(bytes(public_key))
+                   for public_key in certificate.committee}
+        if tally.certificate is not None or \
+                len(members) != len(certificate.committee) or \
+                len(certificate.proofs) != len(certificate.committee) or \
+                len(votes) != len(certificate.signatures) or \
+                len(votes) < self.quorum_size(certificate.shard_number):
+            result.set_result(False)
+            return result
+
+        items = [self._check_item(vote) for vote in votes]
+        future = self.evloop.run_in_executor(
+            self.executor, check_votes, items)
+
+        def done(f):
+            valid = not f.cancelled() and f.exception() is None
+            if valid:
+                population = self.population()
+                for vote, item, (signed, ticket) in zip(
+                        votes, items, f.result()):
+                    ticket = self._ticket(vote, item, ticket)
+                    valid = valid and signed and self.sampler.seated(
+                        ticket, vote.shard_number, population)
+            if valid and tally.certificate is None:
+                self._certified(tally, certificate)
+            result.set_result(valid)
+        future.add_done_callback(done)
+        return result
+
+    def prune(self, epoch):
+        """Forget the votes of the epochs before `epoch`"""
+        for key in [key for key in self.tallies if key[1] < epoch]:
+            del self.tallies[key]
+            self.rosters.pop(key, None)
+
+    def stats(self):
+        recent = sorted(self._recent)
+        return {
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'certified': len(recent),
+            'latency_p50': recent[len(recent) // 2] if recent else None,
+            'latency_max': recent[-1] if recent else None,
+        }
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
@@ -0,0 +1,84 @@
+"""Compare the binary wire codec against pickle
+
+Reports the encoded size of a transaction and a full collation, and the
+encode/decode throughput of both paths.
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import time
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'antimatter'))
+
+from codec import decode, encode  # noqa: E402
+from crypto import RSA  # noqa: E402
+from objects import Collation, Transaction  # noqa: E402
+
+
+def make_txn(src_key, dst_key):
+    txn = Transaction(src_pk=RSA.get_pub_key_bytes(src_key),
+                      dst_pk=RSA.get_pub_key_bytes(dst_key),
+                      inputs=[os.urandom(32) for _ in range(2)],
+                      value=350000000)
+    txn.sign(src_key)
+    return txn
+
+
+def rate(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return iterations / (time.perf_counter() - start)
+
+
+def report(name, obj, iterations):
+    pickled = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    encoded = encode(obj)
+
+    def dumps():
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    print(f'{name}:')
+    print(f'  {"":8} {"bytes":>8} {"encode/s":>12} {"decode/s":>12}')
+    print(f'  {"pickle":8} {len(pickled):>8} '
+          f'{rate(dumps, iterations):>12.0f} '
+          f'{rate(lambda: pickle.loads(pickled), iterations):>12.0f}')
+    print(f'  {"codec":8} {len(encoded):>8} '
+          f'{rate(lambda: encode(obj), iterations):>12.0f} '
+          f'{rate(lambda: decode(encoded), iterations):>12.0f}')
+
+
+def main(args):
+    src_key, dst_key = RSA.generate_rsa_key(), RSA.generate_rsa_key()
+
+    txn = make_txn(src_key, dst_key)
+    report('Transaction', txn, args.iterations)
+
+    collation = Collation(
+        shard_id=0, parent_hash=os.urandom(32),
+        creation_timestamp=datetime.now().isoformat(),
+        sign_callable=lambda data: RSA.generate_signature(src_key, data),
+        txns=[make_txn(src_key, dst_key) for _ in range(args.txns)])
+    report(f'Collation ({args.txns} txns)', collation,
+           max(1, args.iterations // args.txns))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Wire codec benchmark')
+
+    parser.add_argument('-n', '--iterations',
+                        dest='iterations', type=int, default=20000,
+                        help='Number of encode/decode operations to time')
+    parser.add_argument('--txns',
+                        dest='txns', type=int, default=100,
+                        help='Number of transactions per collation')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
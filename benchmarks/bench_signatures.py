@@ -0,0 +1,59 @@
+"""Sign/verify throughput and wire size of the signature schemes"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'antimatter'))
+
+from codec import encode, pem_to_der  # noqa: E402
+from crypto import (  # noqa: E402
+    SIGNATURE_SCHEMES, generate_key, generate_signature, get_pub_key_bytes,
+    verify_signature)
+from objects import Transaction  # noqa: E402
+
+
+def rate(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return iterations / (time.perf_counter() - start)
+
+
+def main(args):
+    print(f'{"scheme":>8} {"sign/s":>10} {"verify/s":>10} {"pk bytes":>9} '
+          f'{"sig bytes":>10} {"txn bytes":>10}')
+
+    for name in sorted(SIGNATURE_SCHEMES):
+        src_key, dst_key = generate_key(name), generate_key(name)
+        pub_key = get_pub_key_bytes(src_key)
+
+        txn = Transaction(src_pk=pub_key, dst_pk=get_pub_key_bytes(dst_key),
+                          inputs=[os.urandom(32)], value=100000000)
+        data = txn.serialize()
+        txn.sign(src_key)
+
+        sign_rate = rate(lambda: generate_signature(src_key, data),
+                         args.iterations)
+        verify_rate = rate(
+            lambda: verify_signature(pub_key, data, txn.src_sig),
+            args.iterations)
+
+        print(f'{name:>8} {sign_rate:>10.0f} {verify_rate:>10.0f} '
+              f'{len(pem_to_der(pub_key)):>9} {len(txn.src_sig):>10} '
+              f'{len(encode(txn)):>10}')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Signature scheme benchmark')
+
+    parser.add_argument('-n', '--iterations',
+                        dest='iterations', type=int, default=2000,
+                        help='Number of sign/verify operations to time')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,129 @@
+"""Time for a fresh node to sync a chain from a number of peers
+
+Peers are simulated in process; every message goes through the wire codec
+and is delivered with a fixed one-way latency, so the pipelining of the
+requests is measured together with the encoding and verification costs.
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'antimatter'))
+
+from blockchain import Blockchain, Shard  # noqa: E402
+from codec import decode, encode  # noqa: E402
+from crypto import (  # noqa: E402
+    generate_key, generate_signature, get_pub_key_bytes)
+from objects import Collation, CollationRequest, Transaction  # noqa: E402
+from sync import CollationSync  # noqa: E402
+
+
+class Node(object):
+    def __init__(self, name, loop, nodes, latency, peers=(), **kwargs):
+        self.name = name
+        self.loop = loop
+        self.nodes = nodes
+        self.latency = latency
+        self.peers = list(peers)
+        self.blockchain = Blockchain()
+        self.shard = Shard(0)
+        self.network = self
+        self.gossip = self
+        self.sync = CollationSync(self, loop, **kwargs)
+        nodes[name] = self
+
+    def subscribers(self, topic):
+        return self.peers
+
+    def send_obj(self, peers, obj):
+        data = encode(obj)
+        for peer in peers:
+            self.loop.call_later(
+                self.latency, self.nodes[peer].receive, data, self.name)
+
+    def receive(self, data, peer):
+        message = decode(data)
+        if isinstance(message, CollationRequest):
+            self.sync.serve(message, peer)
+        else:
+            self.sync.handle_response(message, peer)
+
+    def accept_collation(self, collation):
+        self.blockchain.add_collation(collation)
+
+
+def make_chain(length, txns_per_collation):
+    key = generate_key('ed25519')
+    public_key = get_pub_key_bytes(key)
+    sign = functools.partial(generate_signature, key)
+    chain = list()
+    parent = Blockchain.GENESIS_COLLATION_HASH
+    for _ in range(length):
+        txns = [Transaction(src_pk=public_key, dst_pk=public_key,
+                            inputs=[os.urandom(32)], value=1, src_sig=b'')
+                for _ in range(txns_per_collation)]
+        collation = Collation(shard_id=0, parent_hash=parent,
+                              sign_callable=sign, proposer_pk=public_key,
+                              txns=txns)
+        chain.append(collation)
+        parent = collation.header.collation_id
+    return chain
+
+
+def main(args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print(f'building a chain of {args.collations} collations')
+    chain = make_chain(args.collations, args.txns)
+
+    print(f'{"peers":>6} {"seconds":>9} {"collations/s":>14} '
+          f'{"requests":>9}')
+    for peers in args.peers:
+        nodes = dict()
+        for name in range(1, peers + 1):
+            server = Node(name, loop, nodes, args.latency)
+            for collation in chain:
+                server.blockchain.add_collation(collation)
+        fresh = Node(0, loop, nodes, args.latency,
+                     peers=range(1, peers + 1), pipeline=args.pipeline)
+
+        start = time.perf_counter()
+        loop.run_until_complete(fresh.sync.sync_once())
+        elapsed = time.perf_counter() - start
+        assert fresh.blockchain.height == args.collations
+        print(f'{peers:>6} {elapsed:>9.2f} '
+              f'{args.collations / elapsed:>14.1f} '
+              f'{fresh.sync.requests:>9}')
+
+    loop.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Collation sync benchmark')
+
+    parser.add_argument('-c', '--collations',
+                        dest='collations', type=int, default=10000,
+                        help='Length of the chain to sync')
+    parser.add_argument('-t', '--txns',
+                        dest='txns', type=int, default=10,
+                        help='Number of transactions per collation')
+    parser.add_argument('--peers',
+                        dest='peers', type=int, nargs='+', default=[1, 4],
+                        help='Numbers of peers to sync from')
+    parser.add_argument('--pipeline',
+                        dest='pipeline', type=int, default=None,
+                        help='Requests in flight per peer')
+    parser.add_argument('--latency',
+                        dest='latency', type=float, default=0.05,
+                        help='One-way message latency in seconds')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,75 @@
+"""Memory per coin and lookup latency of the UTXO store"""
+
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'antimatter'))
+
+from objects import Coin, UTXOSet, VALUE_SCALE  # noqa: E402
+
+
+def max_rss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def timed(fn, args):
+    start = time.perf_counter()
+    for arg in args:
+        fn(arg)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def main(args):
+    owners = [os.urandom(294) for _ in range(args.owners)]
+    utxo = UTXOSet()
+    coin_ids = list()
+
+    rss_before = max_rss()
+    start = time.perf_counter()
+    for i in range(args.coins):
+        coin = Coin(owner=owners[i % args.owners],
+                    value=random.randint(1, 10 * VALUE_SCALE),
+                    parent_txn=os.urandom(32))
+        utxo.add_coin(coin)
+        if i % (args.coins // args.samples or 1) == 0:
+            coin_ids.append(coin.coin_id)
+    elapsed = time.perf_counter() - start
+    rss_after = max_rss()
+
+    print(f'coins:            {len(utxo)}')
+    print(f'insert:           {elapsed / args.coins * 1e6:.2f} us/coin')
+    print(f'memory:           {(rss_after - rss_before) / args.coins:.0f} '
+          f'bytes/coin (max RSS growth)')
+    print(f'get_coin:         {timed(utxo.get_coin, coin_ids):.2f} us')
+
+    sample_owners = random.sample(owners, min(len(owners), args.samples))
+    print(f'coins_of:         {timed(utxo.coins_of, sample_owners):.2f} us '
+          f'({args.coins // args.owners} coins per owner)')
+    select = timed(lambda o: utxo.select_coins(o, 20 * VALUE_SCALE),
+                   sample_owners)
+    print(f'select_coins:     {select:.2f} us')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='UTXO store benchmark')
+
+    parser.add_argument('-n', '--coins',
+                        dest='coins', type=int, default=10 ** 7,
+                        help='Number of coins to store')
+    parser.add_argument('--owners',
+                        dest='owners', type=int, default=10 ** 5,
+                        help='Number of distinct owner keys')
+    parser.add_argument('--samples',
+                        dest='samples', type=int, default=10000,
+                        help='Number of lookups to time')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,102 @@
+"""Validated collations per second against the number of shards"""
+
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'antimatter'))
+
+from crypto import (  # noqa: E402
+    generate_key, generate_signature, get_pub_key_bytes)
+from objects import Collation, Transaction  # noqa: E402
+from validation import CollationValidator  # noqa: E402
+
+
+def make_collations(shards, per_shard, txns_per_collation, key_type):
+    # one proposer and one sender key per shard, the shard of a sender is
+    # looked up in `owners`
+    owners = dict()
+    collations = list()
+    for shard in range(shards):
+        key = generate_key(key_type)
+        public_key = get_pub_key_bytes(key)
+        owners[public_key] = shard
+        for _ in range(per_shard):
+            txns = list()
+            for _ in range(txns_per_collation):
+                txn = Transaction(src_pk=public_key, dst_pk=public_key,
+                                  inputs=[os.urandom(32)], value=1)
+                txn.sign(key)
+                txns.append(txn)
+            collations.append(Collation(
+                shard_id=shard, parent_hash=os.urandom(32),
+                sign_callable=functools.partial(generate_signature, key),
+                proposer_pk=public_key, txns=txns))
+    return collations, owners
+
+
+def bench(loop, validator, collations):
+    async def run():
+        results = await asyncio.gather(
+            *[validator.validate(collation) for collation in collations])
+        assert all(result.valid for result in results)
+
+    start = time.perf_counter()
+    loop.run_until_complete(run())
+    return len(collations) / (time.perf_counter() - start)
+
+
+def main(args):
+    loop = asyncio.new_event_loop()
+
+    print(f'{"shards":>8} {"collations/s":>14}')
+    shards = 1
+    while shards <= args.max_shards:
+        collations, owners = make_collations(
+            shards, args.collations, args.txns, args.key_type)
+        validator = CollationValidator(
+            loop, args.workers, use_threads=args.threads,
+            shard_of=owners.__getitem__)
+        # warm up the pool so worker start-up is not timed
+        bench(loop, validator, collations[:1])
+
+        print(f'{shards:>8} {bench(loop, validator, collations):>14.1f}')
+        validator.close(wait=True)
+        shards *= 2
+
+    loop.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Collation validation benchmark')
+
+    parser.add_argument('-c', '--collations',
+                        dest='collations', type=int, default=20,
+                        help='Number of collations per shard')
+    parser.add_argument('-t', '--txns',
+                        dest='txns', type=int, default=100,
+                        help='Number of transactions per collation')
+    parser.add_argument('--max-shards',
+                        dest='max_shards', type=int, default=16,
+                        help='Largest shard count to measure')
+    parser.add_argument('--workers',
+                        dest='workers', type=int, default=None,
+                        help='Number of validation workers (default: one '
+                             'per core)')
+    parser.add_argument('--key-type',
+                        dest='key_type', default='rsa',
+                        choices=['rsa', 'ed25519'],
+                        help='Signature scheme of the generated keys')
+    parser.add_argument('--threads',
+                        dest='threads', action='store_true',
+                        help='Use a thread pool instead of a process pool')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
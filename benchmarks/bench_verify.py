@@ -0,0 +1,90 @@
+"""Verified transactions per second against the number of verify workers"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'antimatter'))
+
+from crypto import RSA  # noqa: E402
+from objects import Transaction  # noqa: E402
+from verifier import SignatureVerifier  # noqa: E402
+
+
+def make_txns(count, num_keys=10):
+    keys = [RSA.generate_rsa_key() for _ in range(num_keys)]
+    txns = list()
+    for i in range(count):
+        src_key, dst_key = keys[i % num_keys], keys[(i + 1) % num_keys]
+        txn = Transaction(src_pk=RSA.get_pub_key_bytes(src_key),
+                          dst_pk=RSA.get_pub_key_bytes(dst_key),
+                          inputs=[os.urandom(32)], value=i)
+        txn.sign(src_key)
+        txns.append(txn)
+    return txns
+
+
+def bench_inline(txns):
+    start = time.perf_counter()
+    for txn in txns:
+        assert RSA.verify_signature(txn.src_pk, txn.serialize(), txn.src_sig)
+    return len(txns) / (time.perf_counter() - start)
+
+
+def bench_pool(loop, txns, workers, use_threads):
+    verifier = SignatureVerifier(loop, workers, use_threads=use_threads)
+
+    async def run():
+        futures = [verifier.submit(txn.src_pk, txn.serialize(), txn.src_sig)
+                   for txn in txns]
+        assert all(await asyncio.gather(*futures))
+
+    # warm up the pool so worker start-up is not timed
+    loop.run_until_complete(verifier.submit(
+        txns[0].src_pk, txns[0].serialize(), txns[0].src_sig))
+
+    start = time.perf_counter()
+    loop.run_until_complete(run())
+    elapsed = time.perf_counter() - start
+    verifier.close()
+    return len(txns) / elapsed
+
+
+def main(args):
+    loop = asyncio.new_event_loop()
+    txns = make_txns(args.txns)
+
+    print(f'{"workers":>8} {"verified TPS":>14}')
+    print(f'{"inline":>8} {bench_inline(txns):>14.0f}')
+
+    workers = 1
+    while workers <= args.max_workers:
+        tps = bench_pool(loop, txns, workers, args.threads)
+        print(f'{workers:>8} {tps:>14.0f}')
+        workers *= 2
+
+    loop.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Signature verification benchmark')
+
+    parser.add_argument('-n', '--txns',
+                        dest='txns', type=int, default=20000,
+                        help='Number of signed transactions to verify')
+    parser.add_argument('--max-workers',
+                        dest='max_workers', type=int,
+                        default=os.cpu_count() or 1,
+                        help='Largest worker count to measure')
+    parser.add_argument('--threads',
+                        dest='threads', action='store_true',
+                        help='Use a thread pool instead of a process pool')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,30 @@
+import functools
+import os
+import sys
+
+# the antimatter modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'antimatter'))
+
+from crypto import generate_signature, get_pub_key_bytes  # noqa: E402
+from objects import Collation  # noqa: E402
+
+
+def make_collation(key, shard=0, parent=b'\x00' * 32, txns=(), receipts=(),
+                   **fields):
+    """A collation proposed and signed by `key`
+
+    Args:
+        key: The proposer's private key
+        shard (int): The shard of the collation
+        parent (bytes): The parent hash, genesis by default
+        txns (list): The transactions
+        receipts (list): The CrossShardReceipts consumed
+        **fields: Any other field of the Collation, such as
+            `creation_timestamp` or `txns_merkle_root`
+    """
+
+    return Collation(
+        shard_id=shard, parent_hash=parent,
+        sign_callable=functools.partial(generate_signature, key),
+        proposer_pk=get_pub_key_bytes(key), txns=txns, receipts=receipts,
+        **fields)
@@ -0,0 +1,107 @@
+from blockchain import Blockchain
+
+
+class FakeHeader(object):
+    def __init__(self, collation_id, parent_hash):
+        self.collation_id = collation_id
+        self.parent_hash = parent_hash
+
+
+class FakeCollation(object):
+    def __init__(self, collation_id, parent_hash):
+        self.header = FakeHeader(collation_id, parent_hash)
+
+    def __repr__(self):
+        return f'FakeCollation({self.header.collation_id})'
+
+
+def build(chain, parent, names):
+    collations = list()
+    for name in names:
+        collation = FakeCollation(name, parent)
+        chain.add_collation(collation)
+        collations.append(collation)
+        parent = name
+    return collations
+
+
+def test_linear_chain():
+    chain = Blockchain()
+    assert chain.get_head() is None
+    assert chain.head_hash() == Blockchain.GENESIS_COLLATION_HASH
+
+    a, b, c = build(chain, Blockchain.GENESIS_COLLATION_HASH, 'abc')
+
+    assert chain.get_head() is c
+    assert chain.height == 3
+    assert chain.get_by_height(2) is b
+    assert chain.tips == {'c'}
+
+
+def test_reorg_to_longer_fork():
+    chain = Blockchain()
+    build(chain, Blockchain.GENESIS_COLLATION_HASH, 'abc')
+    d, = build(chain, 'a', 'd')
+    assert chain.head == 'c'
+    assert chain.tips == {'c', 'd'}
+
+    e = FakeCollation('e', 'd')
+    f = FakeCollation('f', 'e')
+    update = chain.add_collation(e)
+    assert update == ([], [])
+
+    update = chain.add_collation(f)
+    assert [x.header.collation_id for x in update.removed] == ['b', 'c']
+    assert update.added == [d, e, f]
+    assert chain.common_ancestor('c', 'f') == 'a'
+    assert chain.get_by_height(4) is f
+
+
+def test_orphans_connected_when_parent_arrives():
+    chain = Blockchain()
+    build(chain, Blockchain.GENESIS_COLLATION_HASH, 'a')
+    c = FakeCollation('c', 'b')
+    assert chain.add_collation(c) == ([], [])
+    assert 'c' not in chain
+
+    b = FakeCollation('b', 'a')
+    update = chain.add_collation(b)
+    assert update.added == [b, c]
+    assert chain.head == 'c'
+
+
+def test_orphans_are_capped(monkeypatch):
+    monkeypatch.setattr(Blockchain, 'MAX_ORPHANS', 3)
+    chain = Blockchain()
+    build(chain, Blockchain.GENESIS_COLLATION_HASH, 'a')
+    # many orphans under one missing parent, and the same one again
+    orphans = [FakeCollation(name, 'b') for name in 'cdef']
+    for orphan in orphans + orphans[-1:]:
+        chain.add_collation(orphan)
+
+    chain.add_collation(FakeCollation('b', 'a'))
+    # the oldest was dropped
+    assert [name in chain for name in 'cdef'] == [False, True, True, True]
+
+
+def test_remove_collation_drops_its_branch():
+    chain = Blockchain()
+    a, b, c = build(chain, Blockchain.GENESIS_COLLATION_HASH, 'abc')
+    d, = build(chain, 'a', 'd')
+
+    update = chain.remove_collation('b')
+    assert update.removed == [b, c]
+    assert update.added == [d]
+    assert chain.head == 'd'
+    assert chain.tips == {'d'}
+    assert 'b' not in chain and 'c' not in chain
+
+    # the parent is a tip again once its only branch is gone
+    update = chain.remove_collation('d')
+    assert update.removed == [d]
+    assert chain.head == 'a'
+    assert chain.tips == {'a'}
+
+    chain.remove_collation('a')
+    assert chain.head is None and chain.height == 0
+    assert chain.remove_collation('a') == ([], [])
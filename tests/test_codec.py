@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import pytest
+
+from codec import CodecError, EncodedMessage, decode, encode
+from crypto import RSA
+from objects import (
+    MAX_INT, Collation, CollationRequest, CollationVote, Transaction)
+
+
+@pytest.fixture(scope='module')
+def keys():
+    return RSA.generate_rsa_key(), RSA.generate_rsa_key()
+
+
+def make_txn(src_key, dst_key):
+    txn = Transaction(src_pk=RSA.get_pub_key_bytes(src_key),
+                      dst_pk=RSA.get_pub_key_bytes(dst_key),
+                      inputs=[b'\x01' * 32, b'\x02' * 32], value=425000000)
+    txn.sign(src_key)
+    return txn
+
+
+def test_transaction_roundtrip(keys):
+    txn = make_txn(*keys)
+    decoded = decode(encode(txn))
+
+    assert decoded.txn_id == txn.txn_id
+    assert decoded.src_pk == txn.src_pk
+    assert decoded.src_sig == txn.src_sig
+    assert RSA.verify_signature(
+        decoded.src_pk, decoded.serialize(), decoded.src_sig)
+
+
+def test_collation_and_vote_roundtrip(keys):
+    src_key, dst_key = keys
+    collation = Collation(
+        shard_id=2, parent_hash=b'\x00' * 32,
+        creation_timestamp=datetime.now().isoformat(),
+        sign_callable=lambda data: RSA.generate_signature(src_key, data),
+        txns=[make_txn(src_key, dst_key) for _ in range(3)])
+    decoded = decode(encode(collation))
+
+    assert decoded.header.collation_id == collation.header.collation_id
+    assert [t.txn_id for t in decoded.txns] == \
+        [t.txn_id for t in collation.txns]
+
+    vote = CollationVote(
+        collation.header.collation_id, RSA.get_pub_key_bytes(dst_key), 2,
+        None,
+        sign_callable=lambda data: RSA.generate_signature(dst_key, data))
+    decoded = decode(encode(vote))
+
+    assert decoded.collator_sig == vote.collator_sig
+    assert decoded.serialize() == vote.serialize()
+
+
+def test_request_roundtrip():
+    decoded = decode(encode(CollationRequest(b'\x05' * 32, latest=True)))
+
+    assert decoded.collation_id == b'\x05' * 32
+    assert decoded.latest
+
+
+def test_encoded_message_is_cached(keys):
+    txn = make_txn(*keys)
+    message = EncodedMessage.of(txn)
+
+    assert EncodedMessage.of(txn) is message
+    assert message.framed[4:] == message.payload == encode(txn)
+
+    # the signature is on the wire, so replacing it drops the encoding
+    txn.src_sig = b'signature'
+    assert EncodedMessage.of(txn) is not message
+
+    received = EncodedMessage.received(encode(txn))
+    assert EncodedMessage.of(received).payload == encode(txn)
+
+
+def test_encoding_follows_nested_objects(keys):
+    src_key, dst_key = keys
+    collation = Collation(
+        shard_id=2, parent_hash=b'\x00' * 32,
+        sign_callable=lambda data: RSA.generate_signature(src_key, data),
+        txns=[make_txn(src_key, dst_key)])
+    message = EncodedMessage.of(collation)
+    assert EncodedMessage.of(collation) is message
+
+    collation.header.shard_id = 1
+    message = EncodedMessage.of(collation)
+    assert decode(message.payload).header.shard_id == 1
+
+    # objects nested deeper are followed as well, as are received ones
+    collation = EncodedMessage.received(message.payload)
+    collation.txns[0].src_sig = b'signature'
+    assert decode(EncodedMessage.of(collation).payload).txns[0].src_sig == \
+        b'signature'
+
+
+def test_malformed():
+    data = encode(CollationRequest(None, latest=False))
+
+    with pytest.raises(CodecError):
+        decode(data[:-1])
+    with pytest.raises(CodecError):
+        decode(b'\xff' + data[1:])
+
+
+def test_values_beyond_the_serializable_range(keys):
+    txn = make_txn(*keys)
+    txn.value = MAX_INT
+    data = encode(txn)
+    assert decode(data).txn_id == txn.txn_id
+
+    # the wire format has room for values the objects cannot serialize
+    limit = MAX_INT.to_bytes(8, 'big')
+    with pytest.raises(CodecError):
+        decode(data.replace(limit, (MAX_INT + 1).to_bytes(8, 'big')))
+    txn.value = MAX_INT + 1
+    with pytest.raises(CodecError):
+        encode(txn)
@@ -0,0 +1,101 @@
+import asyncio
+
+from connections import ConnectionManager, Resolver
+from p2p import Network
+
+
+class FakeNode(object):
+    def __init__(self):
+        self.events = list()
+
+    def handle_peer_connected(self, peer):
+        self.events.append(('connected', peer))
+
+    def handle_peer_lost(self, peer):
+        self.events.append(('lost', peer))
+
+
+class FakeQueue(object):
+    name = None
+
+
+class FakeProtocol(object):
+    def __init__(self, outbound):
+        self.outbound = outbound
+        self.duplicate = False
+        self.peer_port = 9991
+        self.queue = FakeQueue()
+
+    def close_duplicate(self):
+        self.duplicate = True
+
+
+def test_dial_all_stops_after_consecutive_failures():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(loop.create_server(
+        asyncio.Protocol, host='127.0.0.1', port=0))
+    port = server.sockets[0].getsockname()[1]
+    dialed = list()
+
+    def hosts():
+        # nothing listens on 127.0.0.2, so those dials are refused
+        yield from ['127.0.0.1', None, '127.0.0.2', '127.0.0.1']
+        while True:
+            yield '127.0.0.2'
+
+    def factory(host):
+        dialed.append(host)
+        return asyncio.Protocol()
+
+    manager = ConnectionManager(loop, factory, max_parallel=2)
+    protocols = loop.run_until_complete(manager.dial_all(hosts(), port, 3))
+
+    assert len(protocols) == 2
+    assert dialed.count('127.0.0.1') == 2
+
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def test_resolver_caches_lookups():
+    loop = asyncio.new_event_loop()
+    resolver = Resolver(loop)
+
+    first = loop.run_until_complete(resolver.resolve('localhost', 80))
+    assert loop.run_until_complete(resolver.resolve('localhost', 80)) == first
+    assert len(resolver._cache) == 1
+    loop.close()
+
+
+def test_simultaneous_dials_keep_one_connection():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    node = FakeNode()
+    network = Network(node, loop)
+    network.fqdn = 'antimatter-0'
+
+    # we have the smaller name, so our outbound connection wins
+    inbound, outbound = FakeProtocol(False), FakeProtocol(True)
+    assert network.register(inbound, 'antimatter-1')
+    assert network.register(outbound, 'antimatter-1')
+    assert inbound.duplicate and not outbound.duplicate
+    assert network.protocols['antimatter-1'] is outbound
+    assert node.events == [('connected', 'antimatter-1')]
+
+    # the peer's copy of the same race keeps that connection as well
+    late = FakeProtocol(True)
+    network.fqdn = 'antimatter-2'
+    assert not network.register(late, 'antimatter-1')
+    assert late.duplicate
+
+    network.unregister(inbound)
+    assert node.events == [('connected', 'antimatter-1')]
+    network.unregister(outbound)
+    assert node.events[-1] == ('lost', 'antimatter-1')
+
+    network.manager.close()
+    loop.close()
+    asyncio.set_event_loop(None)
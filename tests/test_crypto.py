@@ -1,4 +1,11 @@
-from antimatter.crypto import RSA, VRF
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from antimatter.crypto import (
+    KeyCache, RSA, VRF, generate_key, generate_signature, get_pub_key_bytes,
+    load_private_key, save_private_key, verify_signature)
 
 
 def test_vrf():
@@ -10,3 +17,55 @@ def test_vrf():
     assert vrf.verify(priv_key1.public_key(), b'hello')
     assert not vrf.verify(priv_key2.public_key(), b'hello')
     assert not vrf.verify(priv_key1.public_key(), b'hello-world')
+
+    # the output is fixed by the key and the input
+    assert VRF.compute_vrf(priv_key1, b'hello').value == vrf.value
+    assert VRF.compute_vrf(priv_key2, b'hello').value != vrf.value
+    assert VRF.from_proof(vrf.proof).verify(
+        RSA.get_pub_key_bytes(priv_key1), b'hello')
+
+
+def test_vrf_needs_unique_signatures():
+    # an Ed25519 signer could make many valid proofs for one input
+    key = generate_key('ed25519')
+    with pytest.raises(ValueError):
+        VRF.compute_vrf(key, b'hello')
+    proof = generate_signature(key, b'hello')
+    assert not VRF.from_proof(proof).verify(get_pub_key_bytes(key), b'hello')
+
+
+def test_key_cache():
+    cache = KeyCache(maxsize=2)
+    keys = [RSA.get_pub_key_bytes(RSA.generate_rsa_key()) for _ in range(3)]
+
+    first = cache.get(keys[0])
+    assert cache.get(keys[0]) is first
+    cache.get(keys[1])
+    cache.get(keys[2])
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 3, 1)
+    assert len(cache) == 2
+    assert cache.get(keys[0]) is not first
+
+
+def test_signature_schemes(tmpdir):
+    for scheme in ('rsa', 'ed25519'):
+        key_file = str(tmpdir.join(f'{scheme}.pem'))
+        save_private_key(generate_key(scheme), key_file)
+        priv_key = load_private_key(key_file)
+        pub_key = get_pub_key_bytes(priv_key)
+
+        sig = generate_signature(priv_key, b'hello')
+        assert verify_signature(pub_key, b'hello', sig)
+        assert not verify_signature(pub_key, b'hello-world', sig)
+
+
+def test_unsupported_keys_do_not_verify():
+    ec_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    pub_key = ec_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    assert not verify_signature(pub_key, b'hello', b'\x00' * 64)
+    assert not verify_signature(b'not a key', b'hello', b'\x00' * 64)
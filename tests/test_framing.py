@@ -0,0 +1,31 @@
+import pytest
+
+from framing import FrameDecoder, FrameError, frame
+
+
+def test_multiple_frames_in_one_chunk():
+    decoder = FrameDecoder()
+    data = frame(b'a') + frame(b'bb') + frame(b'')
+
+    assert decoder.feed(data) == [b'a', b'bb', b'']
+    assert len(decoder) == 0
+
+
+def test_frame_split_across_chunks():
+    decoder = FrameDecoder()
+    payload = bytes(range(256)) * 1000
+    data = frame(payload) + frame(b'tail')
+
+    frames = list()
+    for i in range(0, len(data), 7):
+        frames.extend(decoder.feed(data[i:i + 7]))
+
+    assert frames == [payload, b'tail']
+    assert len(decoder) == 0
+
+
+def test_oversized_frame():
+    decoder = FrameDecoder(max_frame_size=4)
+
+    with pytest.raises(FrameError):
+        decoder.feed(frame(b'12345'))
@@ -0,0 +1,106 @@
+import asyncio
+import random
+
+from collections import deque
+
+from gossip import Gossip, TTLCache
+from objects import GossipIHave, GossipIWant, GossipSubscribe
+
+
+class FakeNetwork(object):
+    def __init__(self, name, wire):
+        self.name = name
+        self.wire = wire
+
+    def send_obj(self, peers, obj):
+        for peer in peers:
+            self.wire.append((self.name, peer, obj))
+
+
+class Payload(object):
+    def __init__(self, msg_id):
+        self.msg_id = msg_id
+
+
+def build_cluster(loop, size, fanout=None):
+    wire = deque()
+    nodes = {name: Gossip(FakeNetwork(name, wire), loop, fanout=fanout)
+             for name in range(size)}
+    for name, node in nodes.items():
+        node.topics = {0}
+        for peer in nodes:
+            if peer != name:
+                node.peer_connected(peer)
+    return nodes, wire
+
+
+def deliver(nodes, wire):
+    received = {name: set() for name in nodes}
+    payloads = 0
+    while wire:
+        src, dst, obj = wire.popleft()
+        node = nodes[dst]
+        if isinstance(obj, (GossipSubscribe, GossipIHave, GossipIWant)):
+            node.handle_message(obj, src)
+            continue
+        payloads += 1
+        if node.receive(obj.msg_id):
+            received[dst].add(obj.msg_id)
+            node.publish(0, obj, obj.msg_id, source=src)
+    return received, payloads
+
+
+def test_ttl_cache_expires_oldest_entries():
+    now = [0.]
+    cache = TTLCache(10., clock=lambda: now[0])
+
+    assert cache.add(b'a', 1)
+    now[0] = 5.
+    assert not cache.add(b'a', 2)
+    assert cache.add(b'b', 3)
+    now[0] = 12.
+    assert b'a' not in cache
+    assert cache.get(b'b') == 3
+    assert len(cache) == 1
+
+
+def test_gossip_reaches_every_subscriber_with_limited_fanout():
+    random.seed(1)
+    loop = asyncio.new_event_loop()
+    nodes, wire = build_cluster(loop, 30, fanout=3)
+    deliver(nodes, wire)
+
+    nodes[0].publish(0, Payload(b'\x01' * 32), b'\x01' * 32)
+    reached, payloads = deliver(nodes, wire)
+    # lazy IHAVE/IWANT rounds repair whatever the push missed
+    for _ in range(3):
+        for node in nodes.values():
+            node.heartbeat()
+        repaired, repair_payloads = deliver(nodes, wire)
+        for name in nodes:
+            reached[name] |= repaired[name]
+        payloads += repair_payloads
+
+    assert {name for name in nodes if reached[name]} == set(nodes) - {0}
+    # each node pushes the payload to 3 peers plus a few IWANT replies,
+    # flooding would send it 29 times per node
+    assert payloads < 5 * len(nodes)
+
+    for node in nodes.values():
+        node.close()
+    loop.close()
+
+
+def test_iwant_served_from_history():
+    loop = asyncio.new_event_loop()
+    nodes, wire = build_cluster(loop, 2)
+    deliver(nodes, wire)
+
+    nodes[0].history.add(b'\x02' * 32, (0, Payload(b'\x02' * 32)))
+    nodes[1].handle_message(GossipIHave(0, [b'\x02' * 32]), 0)
+    received, _ = deliver(nodes, wire)
+
+    assert received[1] == {b'\x02' * 32}
+    for node in nodes.values():
+        node.close()
+    loop.close()
@@ -0,0 +1,96 @@
+import asyncio
+
+from codec import decode, encode
+from membership import BootstrapServer, MembershipClient, MembershipView
+from objects import MembershipHeartbeat
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSubscriber(object):
+    def __init__(self):
+        self.sent = list()
+
+    def send(self, obj):
+        # go through the codec like the real connection does
+        self.sent.append(decode(encode(obj)))
+
+
+def test_view_deltas_and_expiry():
+    clock = Clock()
+    view = MembershipView(expiry=10., clock=clock)
+    view.heartbeat('a', 1)
+    view.heartbeat('b', 2)
+    since = view.version
+
+    clock.now = 5.
+    view.heartbeat('a', 1)
+    view.heartbeat('c', 3)
+    clock.now = 12.
+    assert view.expire() == ['b']
+
+    delta = view.delta(since)
+    assert not delta.full
+    assert [(m.name, m.port) for m in delta.joined] == [('c', 3)]
+    assert list(delta.left) == ['b']
+    assert view.delta(view.version).joined == ()
+
+
+def test_trimmed_log_falls_back_to_snapshot():
+    view = MembershipView(max_log=2)
+    for i in range(4):
+        view.heartbeat(f'node-{i}', i)
+
+    assert view.delta(1).full
+    assert not view.delta(2).full
+    assert len(view.delta(0).joined) == 4
+
+
+def test_server_pushes_changes_to_subscribers():
+    loop = asyncio.new_event_loop()
+    server = BootstrapServer(loop)
+    first, second = FakeSubscriber(), FakeSubscriber()
+
+    server.heartbeat(first, MembershipHeartbeat('a', 1, 0))
+    server.heartbeat(second, MembershipHeartbeat('b', 2, 0))
+    # up to date heartbeats are not answered
+    server.heartbeat(second, MembershipHeartbeat('b', 2, server.view.version))
+    assert len(second.sent) == 1
+    server.tick()
+
+    update = first.sent[-1]
+    assert [m.name for m in update.joined] == ['b']
+    assert len(second.sent) == 1
+
+    server.close()
+    loop.close()
+
+
+def test_client_applies_updates():
+    loop = asyncio.new_event_loop()
+    events = list()
+    client = MembershipClient(
+        loop, 'a', 1, None, lambda name, port: events.append(('+', name)),
+        lambda name: events.append(('-', name)))
+    view = MembershipView()
+    for name in ('a', 'b', 'c'):
+        view.heartbeat(name, 1)
+
+    client.apply(view.delta(0))
+    assert client.members == {'b': 1, 'c': 1}
+    view.members.pop('b')
+    view._change('b', None)
+    client.apply(view.delta(client.version))
+    assert events == [('+', 'b'), ('+', 'c'), ('-', 'b')]
+
+    # a full update replaces the view
+    view.heartbeat('d', 1)
+    client.apply(view.snapshot())
+    assert client.members == {'c': 1, 'd': 1}
+    loop.close()
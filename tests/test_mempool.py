@@ -0,0 +1,66 @@
+from mempool import Mempool
+from objects import Transaction
+
+
+def make_txn(sender, inputs, value=1):
+    return Transaction(src_pk=sender, dst_pk=b'dst',
+                       inputs=[bytes([i]) * 32 for i in inputs], value=value)
+
+
+def shard_of(public_key):
+    return public_key[-1] % 2
+
+
+class FakeCollation(object):
+    def __init__(self, txns):
+        self.txns = txns
+        self.receipts = ()
+
+
+def test_per_shard_queues_in_arrival_order():
+    pool = Mempool(shard_of=shard_of)
+    txns = [make_txn(bytes([i]), [i]) for i in range(5)]
+    for txn in txns:
+        assert pool.add(txn)
+
+    assert not pool.add(txns[0])
+    assert pool.shard_size(0) == 3
+    assert list(pool.peek(1)) == [txns[1], txns[3]]
+
+
+def test_conflicting_inputs():
+    pool = Mempool(shard_of=shard_of)
+    first = make_txn(b'\x00', [1, 2])
+    double_spend = make_txn(b'\x00', [2, 3], value=2)
+
+    assert pool.add(first)
+    assert not pool.add(double_spend)
+
+    pool.remove(first.txn_id)
+    assert pool.add(double_spend)
+
+
+def test_accepted_collation_drops_included_and_conflicting():
+    pool = Mempool(shard_of=shard_of)
+    pooled = make_txn(b'\x00', [1])
+    other = make_txn(b'\x00', [2])
+    pool.add(pooled)
+    pool.add(other)
+
+    # a collation from another proposer spending coin 1 differently
+    pool.remove_collation(FakeCollation([make_txn(b'\x00', [1], value=5)]))
+    assert pooled.txn_id not in pool
+    assert other.txn_id in pool
+    assert len(pool) == 1
+
+
+def test_eviction_under_memory_cap():
+    txns = [make_txn(b'\x00', [i]) for i in range(10)]
+    size = len(txns[0].serialize())
+    pool = Mempool(max_bytes=4 * size, shard_of=shard_of)
+    for txn in txns:
+        pool.add(txn)
+
+    assert len(pool) == 4
+    assert pool.evicted == 6
+    assert list(pool.peek(0)) == txns[-4:]
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from merkle import EMPTY_ROOT, MerkleTree
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8, 13])
+def test_inclusion_proofs(size):
+    leaves = [os.urandom(32) for _ in range(size)]
+    tree = MerkleTree(leaves)
+
+    for index, leaf in enumerate(leaves):
+        proof = tree.proof(index)
+        assert proof.verify(leaf, tree.root)
+        assert not proof.verify(os.urandom(32), tree.root)
+
+
+def test_root_commits_to_leaves():
+    leaves = [os.urandom(32) for _ in range(4)]
+
+    assert MerkleTree(leaves).root != MerkleTree(leaves[::-1]).root
+    assert MerkleTree(leaves[:3]).root != MerkleTree(leaves).root
+    assert MerkleTree([]).root == EMPTY_ROOT
+
+
+def test_tampered_proof():
+    leaves = [os.urandom(32) for _ in range(6)]
+    tree = MerkleTree(leaves)
+    proof = tree.proof(4)
+
+    proof.siblings.append(os.urandom(32))
+    assert not proof.verify(leaves[4], tree.root)
@@ -0,0 +1,113 @@
+from objects import (
+    GENESIS_VALUE, Coin, State, Transaction, genesis_coins, serialize_items)
+
+
+def test_serialize_items_is_unambiguous():
+    assert serialize_items([b'ab', b'c']) != serialize_items([b'a', b'bc'])
+    assert serialize_items([1]) != serialize_items([1.])
+    assert serialize_items([None]) != serialize_items([b''])
+
+
+def test_serialization_cached_until_field_changes():
+    txn = Transaction(src_pk=b'src', dst_pk=b'dst', inputs=[b'\x01' * 32],
+                      value=2)
+    serialized = txn.serialize()
+    txn_id = txn.txn_id
+
+    assert txn.serialize() is serialized
+    txn.src_sig = b'signature'
+    assert txn.serialize() is serialized
+
+    txn.value = 3
+    assert txn.serialize() != serialized
+    assert txn.txn_id != txn_id
+
+
+def test_coin_id_is_deterministic():
+    coin = Coin(owner=b'owner', value=1, parent_txn=b'\x00' * 32)
+
+    assert coin.coin_id == \
+        Coin(owner=b'owner', value=1, parent_txn=b'\x00' * 32).coin_id
+
+
+def test_genesis_coins():
+    coins = genesis_coins([b'a', b'b', bytearray(b'a')])
+
+    assert [coin.owner for coin in coins] == [b'a', b'b']
+    assert all(coin.value == GENESIS_VALUE for coin in coins)
+    assert [c.coin_id for c in coins] == \
+        [c.coin_id for c in genesis_coins([b'a', b'b'])]
+
+
+def test_state_overlay():
+    state = State()
+    coins = [Coin(owner=b'owner', value=i, parent_txn=b'\x00' * 32)
+             for i in range(3)]
+    state.add_coin(coins[0])
+    state.add_coin(coins[1])
+
+    overlay = state.overlay()
+    overlay.remove_coin(coins[0].coin_id)
+    overlay.add_coin(coins[2])
+    assert overlay.get_coin(coins[0].coin_id) is None
+    assert overlay.get_coin(coins[1].coin_id).coin_id == coins[1].coin_id
+    assert state.get_coin(coins[0].coin_id).coin_id == coins[0].coin_id
+    assert state.get_coin(coins[2].coin_id) is None
+
+    nested = overlay.overlay()
+    nested.remove_coin(coins[2].coin_id)
+    nested.discard()
+    assert overlay.get_coin(coins[2].coin_id) is coins[2]
+
+    overlay.commit()
+    assert len(overlay) == 0
+    assert set(state.utxo) == {coins[1].coin_id, coins[2].coin_id}
+
+
+def test_utxo_owner_index_and_selection():
+    state = State()
+    coins = [Coin(owner=b'alice' if i % 2 else b'bob', value=10 * (i + 1),
+                  parent_txn=bytes([i]) * 32) for i in range(6)]
+    for coin in coins:
+        state.add_coin(coin)
+
+    assert state.utxo.coins_of(b'alice') == \
+        [c.coin_id for c in coins if c.owner == b'alice']
+    assert state.utxo.balance(b'alice') == 20 + 40 + 60
+
+    selection = state.select_coins(b'alice', 50)
+    assert selection.coin_ids == [coins[1].coin_id, coins[3].coin_id]
+    assert selection.total == 60
+    assert state.select_coins(b'alice', 121) is None
+    assert state.select_coins(b'carol', 1) is None
+
+    removed = state.remove_coin(coins[1].coin_id)
+    assert (removed.owner, removed.value) == (b'alice', 20)
+    assert coins[1].coin_id not in state.utxo.coins_of(b'alice')
+
+
+def test_state_undo():
+    state = State()
+    coins = [Coin(owner=b'owner', value=i, parent_txn=b'\x00' * 32)
+             for i in range(2)]
+    state.add_coin(coins[0])
+    state.credit(b'\x01' * 32)
+    before = set(state.utxo), set(state.credited)
+
+    overlay = state.overlay()
+    overlay.remove_coin(coins[0].coin_id)
+    overlay.add_coin(coins[1])
+    overlay.credit(b'\x01' * 32)
+    overlay.credit(b'\x02' * 32)
+    undo = overlay.undo()
+    overlay.commit()
+    assert state.is_credited(b'\x02' * 32)
+
+    # reverted through an overlay first, then for real
+    reverted = state.overlay()
+    undo.apply(reverted)
+    assert not reverted.is_credited(b'\x02' * 32)
+    assert reverted.is_credited(b'\x01' * 32)
+    assert reverted.get_coin(coins[1].coin_id) is None
+    reverted.commit()
+    assert (set(state.utxo), set(state.credited)) == before
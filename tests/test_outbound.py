@@ -0,0 +1,88 @@
+import asyncio
+
+from outbound import OutboundQueue
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.writes = list()
+        self.closed = False
+        self.aborted = False
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.limits = (high, low)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def writelines(self, data):
+        self.writes.append(list(data))
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def run_once(loop):
+    loop.run_until_complete(asyncio.sleep(0))
+
+
+def test_frames_are_batched_per_loop_iteration():
+    loop = asyncio.new_event_loop()
+    transport = FakeTransport()
+    queue = OutboundQueue(transport, loop)
+
+    for i in range(3):
+        queue.write(bytes([i]))
+    assert len(queue) == 3
+    run_once(loop)
+
+    assert transport.writes == [[b'\x00', b'\x01', b'\x02']]
+    assert queue.stats()['sent_frames'] == 3
+    assert queue.stats()['batches'] == 1
+    loop.close()
+
+
+def test_paused_queue_holds_frames_until_resumed():
+    loop = asyncio.new_event_loop()
+    transport = FakeTransport()
+    queue = OutboundQueue(transport, loop)
+
+    queue.pause()
+    queue.write(b'frame')
+    run_once(loop)
+    assert transport.writes == []
+    assert queue.stats()['queued_bytes'] == 5
+
+    queue.resume()
+    assert transport.writes == [[b'frame']]
+    assert len(queue) == 0
+    loop.close()
+
+
+def test_backlogged_peer_is_disconnected():
+    loop = asyncio.new_event_loop()
+    transport = FakeTransport()
+    queue = OutboundQueue(transport, loop, max_bytes=10)
+
+    queue.pause()
+    queue.write(b'x' * 8)
+    assert not transport.aborted
+    queue.write(b'x' * 8)
+    assert transport.aborted
+    loop.close()
+
+
+def test_stalled_peer_is_aborted():
+    loop = asyncio.new_event_loop()
+    transport = FakeTransport()
+    queue = OutboundQueue(transport, loop, max_stall=0.01)
+    queue.pause()
+    queue.write(b'frame')
+    loop.run_until_complete(asyncio.sleep(0.05))
+    # closing would wait for a peer that no longer reads
+    assert transport.aborted and not transport.closed
+    assert queue.stats()['queued_bytes'] == 0
+    loop.close()
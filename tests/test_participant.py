@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+
+from blockchain import Blockchain, Shard
+from crypto import generate_key, get_pub_key_bytes
+from gossip import Gossip
+from mempool import Mempool
+from objects import (
+    Coin, CrossShardReceipt, State, Transaction, VoteCertificate,
+    genesis_coins)
+from participant import Participant
+from snapshot import Snapshotter
+from storage import CollationLog
+from validation import CollationValidator
+
+from tests.conftest import make_collation
+
+
+def key_in_shard(shard=None, other_than=None):
+    while True:
+        key = generate_key('ed25519')
+        found = Shard.shard_of_key(get_pub_key_bytes(key))
+        if found != other_than and shard in (None, found):
+            return key
+
+
+class FakeNetwork(object):
+    def send_obj(self, peers, obj):
+        pass
+
+    def broadcast_obj_to_clients(self, obj):
+        pass
+
+
+class FakeProposer(object):
+    def notify(self):
+        pass
+
+
+class FakeVotes(object):
+    def observe(self, collation_id):
+        pass
+
+
+class FakeSync(object):
+    def __init__(self):
+        self.started = 0
+
+    def start(self):
+        self.started += 1
+
+
+def restart(directory, genesis=()):
+    """A participant as far as restoring its chain and state goes"""
+    node = Participant.__new__(Participant)
+    node.logger = logging.getLogger(Participant.__name__)
+    node.state = State()
+    node.mempool = Mempool()
+    node.blockchain = Blockchain()
+    node.network = FakeNetwork()
+    node._held, node._held_count = dict(), 0
+    node.genesis = list(genesis)
+    node.snapshots = Snapshotter(node, asyncio.new_event_loop(),
+                                 os.path.join(directory, 'snapshots'))
+    node.collation_log = CollationLog(os.path.join(directory, 'collations'))
+    node._restore()
+    return node
+
+
+def test_restart_replays_received_transfers(tmpdir):
+    src_key = key_in_shard()
+    src_pk = get_pub_key_bytes(src_key)
+    dst_key = key_in_shard(other_than=Shard.shard_of_key(src_pk))
+    dst_pk = get_pub_key_bytes(dst_key)
+    shard = Shard.shard_of_key(dst_pk)
+
+    transfer = Transaction(src_pk=src_pk, dst_pk=dst_pk,
+                           inputs=[os.urandom(32)], value=5)
+    transfer.sign(src_key)
+    source = make_collation(src_key, Shard.shard_of_key(src_pk),
+                            b'\x00' * 32, [transfer])
+    receipt = CrossShardReceipt.from_collation(
+        source, VoteCertificate(source.header.collation_id, 0, 1), shard, [0])
+
+    # spend the received coin within the destination shard
+    received = Coin(owner=dst_pk, value=5, parent_txn=transfer.txn_id)
+    spend = Transaction(src_pk=dst_pk, dst_pk=dst_pk,
+                        inputs=[received.coin_id], value=5)
+    spend.sign(dst_key)
+    first = make_collation(dst_key, shard, b'\x00' * 32, receipts=[receipt])
+    second = make_collation(dst_key, shard, first.header.collation_id,
+                            txns=[spend])
+
+    log = CollationLog(str(tmpdir.join('collations')))
+    log.append(first)
+    log.append(second)
+    log.close()
+
+    node = restart(str(tmpdir))
+    assert node.blockchain.height == 2
+    assert node.state.is_credited(transfer.txn_id)
+    assert node.state.get_coin(received.coin_id) is None
+    minted = Coin(owner=dst_pk, value=5, parent_txn=spend.txn_id)
+    assert node.state.get_coin(minted.coin_id) is not None
+
+
+def test_forged_copy_does_not_shadow_txn():
+    loop = asyncio.new_event_loop()
+    node = Participant.__new__(Participant)
+    node.logger = logging.getLogger(Participant.__name__)
+    node.verifier = None
+    node.mempool = Mempool()
+    node.proposer = FakeProposer()
+    node.gossip = Gossip(FakeNetwork(), loop)
+
+    key = key_in_shard()
+    txn = Transaction(src_pk=get_pub_key_bytes(key),
+                      dst_pk=get_pub_key_bytes(key),
+                      inputs=[os.urandom(32)], value=1)
+    txn.sign(key)
+    node.shard = Shard(Shard.shard_of_key(txn.src_pk))
+    forged = Transaction(txn.src_pk, txn.dst_pk, txn.inputs, txn.value,
+                         src_sig=bytes(len(txn.src_sig)))
+
+    node.handle_transaction(forged)
+    assert txn.txn_id not in node.mempool
+    node.handle_transaction(txn)
+    assert txn.txn_id in node.mempool
+
+    node.gossip.close()
+    loop.close()
+
+
+def spend(key, coin, value):
+    pk = get_pub_key_bytes(key)
+    txn = Transaction(src_pk=pk, dst_pk=pk, inputs=[coin.coin_id],
+                      value=value)
+    txn.sign(key)
+    return txn, Coin(owner=pk, value=value, parent_txn=txn.txn_id)
+
+
+def contents(state):
+    return set(state.utxo), set(state.credited)
+
+
+def test_reorg_only_replays_the_fork(tmpdir, monkeypatch):
+    key = key_in_shard()
+    shard = Shard.shard_of_key(get_pub_key_bytes(key))
+    genesis = genesis_coins([get_pub_key_bytes(key)])
+
+    def extend(parent, coin, values):
+        chain = list()
+        for value in values:
+            txn, coin = spend(key, coin, value)
+            chain.append(make_collation(key, shard, parent, [txn]))
+            parent = chain[-1].header.collation_id
+        return chain
+
+    first = extend(b'\x00' * 32, genesis[0], [100])
+    _, coin = spend(key, genesis[0], 100)
+    ours = extend(first[0].header.collation_id, coin, [10, 9])
+    theirs = extend(first[0].header.collation_id, coin, [20, 19, 18])
+
+    node = restart(str(tmpdir.mkdir('a')), genesis)
+    for collation in first + ours:
+        node.accept_collation(collation)
+    monkeypatch.setattr(node, '_rebuild_state', None)
+    for collation in theirs:
+        node.accept_collation(collation)
+    assert node.blockchain.head_hash() == theirs[-1].header.collation_id
+
+    replayed = restart(str(tmpdir.mkdir('b')), genesis)
+    for collation in first + theirs:
+        replayed.accept_collation(collation)
+    assert contents(node.state) == contents(replayed.state)
+
+
+def test_forks_are_checked_against_their_own_state(tmpdir):
+    key = key_in_shard()
+    pk = get_pub_key_bytes(key)
+    shard = Shard.shard_of_key(pk)
+    genesis = genesis_coins([pk])
+    node = restart(str(tmpdir), genesis)
+    node.shard = Shard(shard)
+
+    first_txn, coin = spend(key, genesis[0], 100)
+    first = make_collation(key, shard, b'\x00' * 32, [first_txn])
+    ours_txn, ours_coin = spend(key, coin, 10)
+    ours = make_collation(key, shard, first.header.collation_id, [ours_txn])
+    node.accept_collation(first)
+    node.accept_collation(ours)
+
+    # the coin spent on our chain is still there on a fork below it
+    theirs_txn, theirs_coin = spend(key, coin, 20)
+    theirs = make_collation(key, shard, first.header.collation_id,
+                            [theirs_txn])
+    assert node._apply_collation(
+        node._collation_base_state(theirs), theirs) is not None
+    # while a coin only minted on our chain is not
+    stolen = make_collation(key, shard, first.header.collation_id,
+                            [spend(key, ours_coin, 1)[0]])
+    assert node._apply_collation(
+        node._collation_base_state(stolen), stolen) is None
+
+    # a longer fork applied unchecked is dropped on replay
+    node.accept_collation(theirs)
+    again = make_collation(key, shard, theirs.header.collation_id,
+                           [theirs_txn])
+    node.accept_collation(again)
+    assert again.header.collation_id not in node.blockchain
+    assert node.blockchain.head_hash() in (
+        ours.header.collation_id, theirs.header.collation_id)
+    head_coin = ours_coin if node.blockchain.head_hash() == \
+        ours.header.collation_id else theirs_coin
+    assert node.state.get_coin(head_coin.coin_id) is not None
+    assert node._state_head == node.blockchain.head_hash()
+
+
+def test_collations_wait_for_their_parent(tmpdir):
+    loop = asyncio.new_event_loop()
+    key = key_in_shard()
+    pk = get_pub_key_bytes(key)
+    shard = Shard.shard_of_key(pk)
+    genesis = genesis_coins([pk])
+    node = restart(str(tmpdir), genesis)
+    node.shard = Shard(shard)
+    node.gossip = Gossip(FakeNetwork(), loop)
+    node.votes = FakeVotes()
+    node.sync = FakeSync()
+    node.validator = CollationValidator(loop, workers=1, use_threads=True)
+
+    txn, coin = spend(key, genesis[0], 100)
+    parent = make_collation(key, shard, b'\x00' * 32, [txn])
+    child = make_collation(key, shard, parent.header.collation_id,
+                           [spend(key, coin, 10)[0]])
+    # not even validated while its parent is missing
+    node.handle_collation(child)
+    assert node.validator.in_flight == 0
+    assert node.sync.started == 1
+
+    node.handle_collation(parent)
+    for _ in range(100):
+        if node.blockchain.height == 2:
+            break
+        loop.run_until_complete(asyncio.sleep(0.01))
+    assert node.blockchain.head_hash() == child.header.collation_id
+
+    # collations of shards we do not serve are not validated at all
+    other = make_collation(key, (shard + 1) % Shard.TOTAL_SHARDS,
+                           b'\x00' * 32, [txn])
+    node.handle_collation(other)
+    assert node.validator.in_flight == 0
+
+    node.validator.close()
+    node.gossip.close()
+    loop.close()
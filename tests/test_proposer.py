@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+from blockchain import Blockchain, Shard
+from crypto import generate_key, get_pub_key_bytes
+from mempool import Mempool
+from objects import Coin, State, Transaction
+from participant import Participant
+from proposer import CollationProposer
+
+
+class FakeGossip(object):
+    def __init__(self):
+        self.sent = list()
+
+    def publish(self, topic, message, msg_id, source=None):
+        self.sent.append(message)
+
+
+class FakeNode(object):
+    def __init__(self, loop):
+        self.evloop = loop
+        self.shard = Shard()
+        self.mempool = Mempool(shard_of=lambda public_key: 0)
+        self.state = State()
+        self.blockchain = Blockchain()
+        self.gossip = FakeGossip()
+        self.priv_key = generate_key('ed25519')
+
+    def _validate_txn(self, state, txn):
+        return True
+
+    def accept_collation(self, collation):
+        self.blockchain.add_collation(collation)
+        self.mempool.remove_collation(collation)
+
+
+def test_propose_full_and_partial_collations():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    node = FakeNode(loop)
+    proposer = CollationProposer(node, collation_size=3)
+
+    for i in range(4):
+        node.mempool.add(Transaction(src_pk=b'src', dst_pk=b'dst',
+                                     inputs=[bytes([i]) * 32], value=1))
+
+    collation = loop.run_until_complete(proposer.propose(min_txns=3))
+    assert len(collation.txns) == 3
+    assert node.gossip.sent == [collation]
+    assert len(node.mempool) == 1
+
+    # a single txn is only proposed once the interval forces it
+    assert loop.run_until_complete(proposer.propose(min_txns=3)) is None
+    partial = loop.run_until_complete(proposer.propose(min_txns=1))
+    assert partial.header.parent_hash == collation.header.collation_id
+    assert len(node.mempool) == 0
+
+    proposer.close()
+    loop.close()
+
+
+
+class StatefulNode(FakeNode):
+    """Checks txns against its state like a participant"""
+
+    _validate_txn = Participant._validate_txn
+
+    def __init__(self, loop):
+        super().__init__(loop)
+        self.logger = logging.getLogger(Participant.__name__)
+
+    def accept_collation(self, collation):
+        overlay = self.state.overlay()
+        for txn in collation.txns:
+            assert self._validate_txn(overlay, txn)
+        overlay.commit()
+        super().accept_collation(collation)
+
+
+def test_txns_wait_for_missing_inputs():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    node = StatefulNode(loop)
+    proposer = CollationProposer(node, collation_size=3)
+    src = get_pub_key_bytes(generate_key('ed25519'))
+    thief = get_pub_key_bytes(generate_key('ed25519'))
+    coin, other = [Coin(owner=src, value=5, parent_txn=bytes([i]) * 32)
+                   for i in range(2)]
+    node.state.add_coin(coin)
+    node.state.add_coin(other)
+
+    parent = Transaction(src_pk=src, dst_pk=src, inputs=[coin.coin_id],
+                         value=5)
+    minted = Coin(owner=src, value=5, parent_txn=parent.txn_id)
+    child = Transaction(src_pk=src, dst_pk=src, inputs=[minted.coin_id],
+                        value=5)
+    stolen = Transaction(src_pk=thief, dst_pk=thief,
+                         inputs=[b'\x02' * 32, other.coin_id], value=5)
+
+    # the child arrives before the txn minting its input
+    node.mempool.add(child)
+    assert loop.run_until_complete(proposer.propose(min_txns=1)) is None
+    assert child.txn_id in node.mempool
+
+    node.mempool.add(parent)
+    node.mempool.add(stolen)
+    first = loop.run_until_complete(proposer.propose(min_txns=1))
+    assert list(first.txns) == [parent]
+    # spending a coin of someone else never becomes valid
+    assert stolen.txn_id not in node.mempool
+    second = loop.run_until_complete(proposer.propose(min_txns=1))
+    assert list(second.txns) == [child]
+
+    # an input that never shows up is given up on eventually
+    orphan = Transaction(src_pk=src, dst_pk=src, inputs=[b'\x01' * 32],
+                         value=1)
+    node.mempool.add(orphan)
+    proposer.input_wait = 0.01
+    loop.run_until_complete(proposer.propose(min_txns=1))
+    assert orphan.txn_id in node.mempool
+    loop.run_until_complete(asyncio.sleep(0.02))
+    loop.run_until_complete(proposer.propose(min_txns=1))
+    assert orphan.txn_id not in node.mempool
+
+    proposer.close()
+    loop.close()
@@ -0,0 +1,95 @@
+import asyncio
+import os
+
+from codec import decode, encode
+from crypto import generate_key, get_pub_key_bytes
+from objects import CrossShardReceipt, State, Transaction, VoteCertificate
+from validation import CollationValidator
+
+from tests.conftest import make_collation
+
+SOURCE_KEY = generate_key('ed25519')
+SOURCE_PK = get_pub_key_bytes(SOURCE_KEY)
+PROPOSER_KEY = generate_key('ed25519')
+NEAR_PK = get_pub_key_bytes(generate_key('ed25519'))
+FAR_PK = get_pub_key_bytes(generate_key('ed25519'))
+# FAR_PK lives in shard 1, every other key in shard 0
+SHARDS = {FAR_PK: 1}
+
+
+def shard_of(public_key):
+    return SHARDS.get(bytes(public_key), 0)
+
+
+def make_receipt():
+    txns = list()
+    for dst_pk in (NEAR_PK, FAR_PK, NEAR_PK, FAR_PK):
+        txn = Transaction(src_pk=SOURCE_PK, dst_pk=dst_pk,
+                          inputs=[os.urandom(32)], value=3)
+        txn.sign(SOURCE_KEY)
+        txns.append(txn)
+    source = make_collation(PROPOSER_KEY, 0, txns=txns)
+    certificate = VoteCertificate(source.header.collation_id, 0, 1)
+    return source, CrossShardReceipt.from_collation(
+        source, certificate, 1, [1, 3])
+
+
+def credit(overlay, receipt):
+    fresh = [txn for txn in receipt.txns
+             if not overlay.is_credited(txn.txn_id)]
+    for txn in fresh:
+        overlay.credit(txn.txn_id)
+    return bool(fresh)
+
+
+def test_receipt_proves_transfers_out_of_a_collation():
+    source, receipt = make_receipt()
+    decoded = decode(encode(receipt))
+
+    assert decoded.digest() == receipt.digest()
+    assert decoded.verify(shard_of) is None
+
+    decoded.txns[0].value = 30
+    assert 'is not in the collation' in decoded.verify(shard_of)
+
+    local = CrossShardReceipt.from_collation(
+        source, receipt.certificate, 1, [0])
+    assert 'is not a transfer' in local.verify(shard_of)
+
+    receipt.certificate = VoteCertificate(b'\x01' * 32, 0, 1)
+    assert receipt.verify(shard_of) == \
+        'certificate is not for the source collation'
+
+
+def test_destination_credits_each_transfer_once():
+    _, receipt = make_receipt()
+    collation = make_collation(PROPOSER_KEY, 1, receipts=[receipt])
+    state = State()
+
+    async def certified(receipts):
+        return valid_certificates
+
+    loop = asyncio.new_event_loop()
+    validator = CollationValidator(loop, workers=1, use_threads=True,
+                                   shard_of=shard_of)
+
+    def validate():
+        return loop.run_until_complete(validator.validate(
+            collation, state_of=lambda c: state,
+            validate_txn=lambda overlay, txn: True,
+            validate_receipt=credit, certified=certified))
+
+    valid_certificates = False
+    assert validate().reason == 'receipt is not certified'
+    valid_certificates = True
+    assert validate().valid
+
+    overlay = state.overlay()
+    assert credit(overlay.overlay(), receipt)
+    assert credit(overlay, receipt)
+    overlay.commit()
+    assert all(state.is_credited(txn.txn_id) for txn in receipt.txns)
+    assert 'credits nothing' in validate().reason
+
+    validator.close()
+    loop.close()
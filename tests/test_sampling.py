@@ -0,0 +1,78 @@
+from crypto import generate_key, get_pub_key_bytes
+from sampling import CommitteeSampler
+
+
+def test_committees_have_the_configured_size_on_average():
+    nodes = 100
+    samplers = [CommitteeSampler(generate_key('rsa'), committee_size=10,
+                                 committee_sizes={3: 40})
+                for _ in range(nodes)]
+
+    sizes = [0] * 4
+    for sampler in samplers:
+        for shard in sampler.assign(7, range(4), nodes):
+            sizes[shard] += 1
+
+    # 30 and 40 seats are expected, with a standard deviation of about 5
+    assert 12 <= sum(sizes[:3]) <= 50
+    assert 20 <= sizes[3] <= 60
+
+
+def test_small_clusters_seat_every_node():
+    sampler = CommitteeSampler(generate_key('rsa'), committee_size=16)
+    assert sorted(sampler.assign(1, range(3), 5)) == [0, 1, 2]
+
+    # Ed25519 keys cannot prove their outputs are not ground
+    sampler = CommitteeSampler(generate_key('ed25519'), committee_size=16)
+    assert sampler.assign(1, range(3), 5) == {}
+
+
+def test_claims_are_verified_once():
+    key = generate_key('rsa')
+    public_key = get_pub_key_bytes(key)
+    seats = CommitteeSampler(key, committee_size=4).assign(3, [0, 1], 4)
+    proof = seats[0]
+    sampler = CommitteeSampler(committee_size=4)
+
+    assert sampler.verify(public_key, 3, 0, proof, 4)
+    assert sampler.verify(public_key, 3, 0, proof, 4)
+    assert sampler.stats()['hits'] == 1
+
+    # the proof only holds for its epoch, shard and key
+    other = get_pub_key_bytes(generate_key('rsa'))
+    assert not sampler.verify(public_key, 4, 0, proof, 4)
+    assert not sampler.verify(public_key, 3, 1, proof, 4)
+    assert not sampler.verify(other, 3, 0, proof, 4)
+    assert not sampler.verify(public_key, 3, 0, None, 4)
+
+
+def test_epochs_follow_the_clock():
+    now = [125.]
+    sampler = CommitteeSampler(epoch_length=60., clock=lambda: now[0])
+
+    assert sampler.epoch() == 2
+    assert sampler.next_epoch_in() == 55.
+    assert sampler.seed(1) != sampler.seed(2)
+    # the seeds of epochs to come are not known yet
+    assert sampler.seed(3) is None
+
+
+def test_seeds_mix_in_certified_collations():
+    now = [125.]
+    sampler = CommitteeSampler(epoch_length=60., clock=lambda: now[0])
+    same = CommitteeSampler(epoch_length=60., clock=lambda: now[0])
+    other = CommitteeSampler(epoch_length=60., clock=lambda: now[0])
+    for collation_id in (b'\x01' * 32, b'\x02' * 32):
+        assert sampler.add_certified(2, collation_id)
+    # the order the certificates arrived in does not matter
+    for collation_id in (b'\x02' * 32, b'\x01' * 32):
+        same.add_certified(2, collation_id)
+    other.add_certified(2, b'\x01' * 32)
+
+    now[0] += 120.
+    seed = sampler.seed(4)
+    assert seed == same.seed(4)
+    assert seed != other.seed(4)
+    # certificates arriving once the seed is in use do not change it
+    assert not sampler.add_certified(2, b'\x03' * 32)
+    assert sampler.seed(4) == seed
@@ -0,0 +1,37 @@
+import os
+
+from collections import Counter
+
+from crypto import generate_key, get_pub_key_bytes
+from shardmap import ShardMap
+
+
+def test_keys_spread_over_all_shards():
+    shard_map = ShardMap(4)
+    counts = Counter(shard_map.shard_of_fingerprint(os.urandom(32))
+                     for _ in range(4000))
+
+    assert set(counts) == set(range(4))
+    assert min(counts.values()) > 4000 / 4 / 2
+
+
+def test_adding_a_shard_moves_few_keys():
+    before, after = ShardMap(8), ShardMap(9)
+    fingerprints = [os.urandom(32) for _ in range(4000)]
+    moved = [fp for fp in fingerprints
+             if before.shard_of_fingerprint(fp) !=
+             after.shard_of_fingerprint(fp)]
+
+    # only keys taken over by the new shard move, about 1/9 of them
+    assert all(after.shard_of_fingerprint(fp) == 8 for fp in moved)
+    assert len(moved) < len(fingerprints) / 4
+
+
+def test_shard_of_key_is_cached_per_map():
+    public_key = get_pub_key_bytes(generate_key('ed25519'))
+    small, large = ShardMap(1), ShardMap(64)
+
+    assert small.shard_of_key(public_key) == 0
+    shard = large.shard_of_key(public_key)
+    assert large.shard_of_key(public_key) == shard
+    assert small.shard_of_key(public_key) == 0
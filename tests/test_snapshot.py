@@ -0,0 +1,153 @@
+import asyncio
+import os
+
+from blockchain import Blockchain, Shard
+from objects import Coin, Collation, SnapshotRequest
+from snapshot import Snapshotter, load_state
+from sync import CollationSync
+
+
+class FakeNetwork(object):
+    def __init__(self, name, loop, nodes):
+        self.name = name
+        self.loop = loop
+        self.nodes = nodes
+
+    def send_obj(self, peers, obj):
+        for peer in peers:
+            self.loop.call_soon(self.nodes[peer].receive, obj, self.name)
+
+
+class FakeGossip(object):
+    def __init__(self, peers):
+        self.peers = peers
+
+    def subscribers(self, topic):
+        return list(self.peers)
+
+
+class FakeNode(object):
+    def __init__(self, name, loop, nodes, directory, peers=()):
+        self.blockchain = Blockchain()
+        self.shard = Shard(0)
+        self.network = FakeNetwork(name, loop, nodes)
+        self.gossip = FakeGossip(peers)
+        self.sync = CollationSync(self, loop, pipeline=1, timeout=1.)
+        self.snapshots = Snapshotter(self, loop, directory, bits=4,
+                                     interval=10, chunk_batch=3)
+        self.state, _ = self.snapshots.restore(self.blockchain)
+        nodes[name] = self
+
+    def receive(self, message, peer):
+        if isinstance(message, SnapshotRequest):
+            self.snapshots.serve(message, peer)
+        else:
+            self.sync.handle_response(message, peer)
+
+
+def add_coins(state, count):
+    coins = [Coin(owner=b'owner-%d' % (i % 7), value=i + 1,
+                  parent_txn=os.urandom(32)) for i in range(count)]
+    for coin in coins:
+        state.add_coin(coin)
+    return coins
+
+
+def contents(state):
+    return ({coin_id: state.get_coin(coin_id).serialize()
+             for coin_id in state.utxo}, set(state.credited))
+
+
+def test_snapshots_are_incremental(tmpdir):
+    loop = asyncio.new_event_loop()
+    node = FakeNode('a', loop, {}, str(tmpdir))
+    state = node.state
+    coins = add_coins(state, 200)
+    state.credit(os.urandom(32))
+
+    first = loop.run_until_complete(
+        node.snapshots.take(state, 10, b'\x01' * 32))
+    assert node.snapshots.chunks_written == 16
+    assert contents(load_state(node.snapshots.store.directory, first)) == \
+        contents(state)
+
+    # only the chunk of the spent coin is rewritten
+    state.remove_coin(coins[0].coin_id)
+    assert node.snapshots.maybe_take(state, 15, b'\x02' * 32) is None
+    second = loop.run_until_complete(
+        node.snapshots.maybe_take(state, 20, b'\x02' * 32))
+    assert node.snapshots.chunks_written == 17
+    changed = [a != b for a, b in zip(first.chunk_hashes,
+                                      second.chunk_hashes)]
+    assert changed.count(True) == 1
+    assert contents(load_state(node.snapshots.store.directory, second)) == \
+        contents(state)
+
+    # the same state snapshotted from scratch has the same root
+    other = FakeNode('b', loop, {}, str(tmpdir.join('other')))
+    for coin in coins[1:]:
+        other.state.add_coin(coin)
+    for txn_id in state.credited:
+        other.state.credit(txn_id)
+    third = loop.run_until_complete(
+        other.snapshots.take(other.state, 20, b'\x02' * 32))
+    assert third.root == second.root
+
+    # credits rolled back by a reorg leave the next snapshot too
+    state.uncredit(next(iter(state.credited)))
+    fourth = loop.run_until_complete(
+        node.snapshots.maybe_take(state, 30, b'\x03' * 32))
+    assert not load_state(node.snapshots.store.directory, fourth).credited
+    loop.close()
+
+
+def test_restore_follows_the_chain(tmpdir):
+    loop = asyncio.new_event_loop()
+    node = FakeNode('a', loop, {}, str(tmpdir))
+    add_coins(node.state, 20)
+    loop.run_until_complete(node.snapshots.take(node.state, 10, b'\x01' * 32))
+
+    restarted = FakeNode('a', loop, {}, str(tmpdir))
+    assert restarted.snapshots.base.height == 10
+    assert contents(restarted.state) == contents(node.state)
+
+    class OtherChain(object):
+        def get_by_height(self, height):
+            return Collation(shard_id=0, parent_hash=b'\x03' * 32,
+                             proposer_sig=b'', txns=())
+
+    # a snapshot of another fork is not used
+    state, height = restarted.snapshots.restore(OtherChain())
+    assert height == 0 and len(state.utxo) == 0
+    loop.close()
+
+
+def test_fast_sync_from_several_peers(tmpdir):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    nodes = dict()
+    for name in ('a', 'b', 'c'):
+        FakeNode(name, loop, nodes, str(tmpdir.join(name)))
+    coins = add_coins(nodes['a'].state, 300)
+    for name in ('a', 'b', 'c'):
+        state = nodes[name].state
+        if name != 'a':
+            for coin in coins:
+                state.add_coin(coin)
+        loop.run_until_complete(
+            nodes[name].snapshots.take(state, 10, b'\x01' * 32))
+
+    # a peer serving corrupt chunks is routed around
+    def corrupt(digests):
+        return [b'\x00' + chunk for chunk in read_many(digests)]
+    read_many = nodes['c'].snapshots.store.read_many
+    nodes['c'].snapshots.store.read_many = corrupt
+
+    fresh = FakeNode('d', loop, nodes, str(tmpdir.join('d')),
+                     peers=['a', 'b', 'c'])
+    state = loop.run_until_complete(fresh.snapshots.fast_sync())
+    assert contents(state) == contents(nodes['a'].state)
+    assert fresh.snapshots.base.height == 10
+    assert fresh.snapshots.chunks_fetched == 16
+    assert fresh.sync.failures > 0
+    loop.close()
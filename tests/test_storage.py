@@ -0,0 +1,95 @@
+import os
+
+from datetime import datetime
+
+import pytest
+
+from crypto import generate_key, get_pub_key_bytes
+from objects import Transaction
+from storage import CollationLog, StorageError
+
+from tests.conftest import make_collation
+
+
+@pytest.fixture(scope='module')
+def collations():
+    key = generate_key('ed25519')
+    pub_key = get_pub_key_bytes(key)
+    parent = b'\x00' * 32
+    collations = list()
+    for i in range(4):
+        txn = Transaction(src_pk=pub_key, dst_pk=pub_key,
+                          inputs=[os.urandom(32)], value=i)
+        txn.sign(key)
+        collation = make_collation(
+            key, 0, parent, [txn],
+            creation_timestamp=datetime.now().isoformat())
+        parent = collation.header.collation_id
+        collations.append(collation)
+    return collations
+
+
+def ids(collations):
+    return [c.header.collation_id for c in collations]
+
+
+def test_append_and_reopen(tmpdir, collations):
+    log = CollationLog(str(tmpdir), batch_size=3)
+    for collation in collations:
+        log.append(collation)
+    assert ids(log) == ids(collations)
+    log.close()
+
+    log = CollationLog(str(tmpdir))
+    assert ids(log) == ids(collations)
+    restored = log.get(collations[2].header.collation_id)
+    assert restored.header.serialize() == collations[2].header.serialize()
+    log.close()
+
+
+def test_segments_roll_over(tmpdir, collations):
+    log = CollationLog(str(tmpdir), segment_size=1)
+    for collation in collations:
+        log.append(collation)
+    log.close()
+
+    assert len(os.listdir(str(tmpdir))) == len(collations)
+    assert ids(CollationLog(str(tmpdir))) == ids(collations)
+
+
+def test_recovery_after_crash_at_any_point(tmpdir, collations):
+    source = tmpdir.mkdir('source')
+    log = CollationLog(str(source))
+    record_ends = list()
+    for collation in collations:
+        log.append(collation)
+        log.flush()
+        record_ends.append(log._file.tell())
+    log.close()
+
+    data = source.join('00000000.log').read_binary()
+    for cut in range(len(data) + 1):
+        crashed = tmpdir.mkdir(f'crash-{cut}')
+        crashed.join('00000000.log').write_binary(data[:cut])
+
+        log = CollationLog(str(crashed))
+        survivors = sum(1 for end in record_ends if end <= cut)
+        assert ids(log) == ids(collations[:survivors])
+
+        # the log stays usable after recovery
+        log.append(collations[-1])
+        log.close()
+        assert ids(CollationLog(str(crashed)))[-1] == \
+            collations[-1].header.collation_id
+
+
+def test_corrupt_sealed_segment(tmpdir, collations):
+    log = CollationLog(str(tmpdir), segment_size=1)
+    for collation in collations[:2]:
+        log.append(collation)
+    log.close()
+
+    first = tmpdir.join('00000000.log')
+    first.write_binary(first.read_binary()[:-1])
+    with pytest.raises(StorageError):
+        CollationLog(str(tmpdir))
@@ -0,0 +1,188 @@
+import asyncio
+
+import pytest
+
+from blockchain import Blockchain, Shard
+from crypto import generate_key, get_pub_key_bytes
+from objects import (
+    Collation, CollationRequest, CollationResponse, Transaction)
+from sync import CollationSync, HeaderStore, SyncError
+from validation import ValidationResult
+
+from tests.conftest import make_collation
+
+
+class FakeNetwork(object):
+    def __init__(self, name, loop, nodes):
+        self.name = name
+        self.loop = loop
+        self.nodes = nodes
+
+    def send_obj(self, peers, obj):
+        for peer in peers:
+            self.loop.call_soon(self.nodes[peer].receive, obj, self.name)
+
+
+class FakeGossip(object):
+    def __init__(self, peers):
+        self.peers = peers
+
+    def subscribers(self, topic):
+        return list(self.peers)
+
+
+class FakeNode(object):
+    def __init__(self, name, loop, nodes, peers=(), path=None, **kwargs):
+        self.blockchain = Blockchain()
+        self.shard = Shard(0)
+        self.network = FakeNetwork(name, loop, nodes)
+        self.gossip = FakeGossip(peers)
+        self.sync = CollationSync(self, loop, path, header_batch=64,
+                                  body_batch=16, timeout=1., **kwargs)
+        self.loop = loop
+        # ids of the collations the validator would reject
+        self.invalid = set()
+        nodes[name] = self
+
+    def verify_collation(self, collation):
+        future = self.loop.create_future()
+        future.set_result(ValidationResult(
+            collation, collation.header.collation_id not in self.invalid,
+            'invalid txn'))
+        return future
+
+    def accept_collation(self, collation):
+        self.blockchain.add_collation(collation)
+
+    def receive(self, message, peer):
+        if isinstance(message, CollationRequest):
+            self.sync.serve(message, peer)
+        else:
+            self.sync.handle_response(message, peer)
+
+
+def make_chain(length):
+    key = generate_key('ed25519')
+    chain = list()
+    parent = Blockchain.GENESIS_COLLATION_HASH
+    for height in range(length):
+        txn = Transaction(src_pk=get_pub_key_bytes(key), dst_pk=b'dst',
+                          inputs=[height.to_bytes(32, 'big')], value=1)
+        collation = make_collation(key, 0, parent, [txn],
+                                   creation_timestamp=None)
+        chain.append(collation)
+        parent = collation.header.collation_id
+    return chain
+
+
+def build(loop, chain, servers=2, path=None):
+    nodes = dict()
+    for name in range(1, servers + 1):
+        server = FakeNode(name, loop, nodes)
+        for collation in chain:
+            server.blockchain.add_collation(collation)
+    fresh = FakeNode(0, loop, nodes, peers=range(1, servers + 1), path=path)
+    return nodes, fresh
+
+
+def test_fresh_node_syncs_to_the_tip():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    chain = make_chain(300)
+    nodes, fresh = build(loop, chain)
+
+    assert loop.run_until_complete(fresh.sync.sync_once())
+    assert fresh.blockchain.height == 300
+    assert fresh.blockchain.head_hash() == chain[-1].header.collation_id
+    assert fresh.sync.headers_fetched == 300
+    assert fresh.sync.bodies_fetched == 300
+    # nothing left to do
+    assert not loop.run_until_complete(fresh.sync.sync_once())
+    loop.close()
+
+
+def test_catches_up_from_a_partial_chain():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    chain = make_chain(200)
+    nodes, node = build(loop, chain, servers=1)
+    for collation in chain[:150]:
+        node.blockchain.add_collation(collation)
+
+    loop.run_until_complete(node.sync.sync_once())
+    assert node.blockchain.height == 200
+    # only the window below our head is fetched again
+    assert node.sync.headers_fetched == 50 + CollationSync.REORG_WINDOW
+    assert node.sync.bodies_fetched == 50
+    loop.close()
+
+
+def test_bad_bodies_are_fetched_from_another_peer():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    chain = make_chain(100)
+    nodes, fresh = build(loop, chain)
+
+    # peer 1 swaps the txns of every collation it serves
+    serve = nodes[1].sync.serve
+
+    def tampering_serve(request, peer):
+        if not request.collation_ids:
+            return serve(request, peer)
+        forged = list()
+        for collation_id in request.collation_ids:
+            header = nodes[1].blockchain.get(collation_id).header
+            forged.append(Collation(
+                shard_id=0, parent_hash=header.parent_hash,
+                txns_merkle_root=header.txns_merkle_root,
+                proposer_pk=header.proposer_pk,
+                proposer_sig=header.proposer_sig, txns=chain[0].txns))
+        nodes[1].network.send_obj([peer], CollationResponse(
+            request.request_id, 100, collations=forged))
+    nodes[1].sync.serve = tampering_serve
+
+    loop.run_until_complete(fresh.sync.sync_once())
+    assert fresh.blockchain.head_hash() == chain[-1].header.collation_id
+    assert fresh.sync.failures > 0
+    loop.close()
+
+
+def test_invalid_collations_end_the_sync():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    chain = make_chain(100)
+    nodes, fresh = build(loop, chain)
+    fresh.invalid.add(chain[60].header.collation_id)
+
+    with pytest.raises(SyncError):
+        loop.run_until_complete(fresh.sync.sync_once())
+    assert fresh.blockchain.height == 60
+    assert chain[60].header.collation_id not in fresh.blockchain
+    loop.close()
+
+
+def test_interrupted_sync_resumes_from_stored_headers(tmp_path):
+    path = str(tmp_path / 'headers.log')
+    chain = make_chain(150)
+
+    store = HeaderStore(path)
+    for height, collation in enumerate(chain[:100], 1):
+        store.add(height, collation.header)
+    store.flush()
+    store.close()
+    # a torn record left by a crash
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00partial')
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    nodes, fresh = build(loop, chain, servers=1, path=path)
+    assert len(fresh.sync.store) == 100
+
+    loop.run_until_complete(fresh.sync.sync_once())
+    assert fresh.blockchain.height == 150
+    assert fresh.sync.headers_fetched == 50
+    # the store is dropped once the sync is complete
+    assert len(fresh.sync.store) == 0
+    fresh.sync.close()
+    loop.close()
@@ -0,0 +1,79 @@
+import asyncio
+import os
+
+from crypto import generate_key, get_pub_key_bytes
+from objects import State, Transaction
+from validation import CollationValidator
+
+from tests.conftest import make_collation
+
+
+def make_txns(key, count, inputs=None):
+    txns = list()
+    for i in range(count):
+        txn = Transaction(src_pk=get_pub_key_bytes(key), dst_pk=b'dst',
+                          inputs=[inputs or os.urandom(32)], value=1)
+        txn.sign(key)
+        txns.append(txn)
+    return txns
+
+
+def run_validator(collation, **kwargs):
+    loop = asyncio.new_event_loop()
+    validator = CollationValidator(loop, workers=2, use_threads=True,
+                                   chunk_size=2, shard_of=lambda pk: 0)
+    try:
+        return loop.run_until_complete(
+            validator.validate(collation, **kwargs))
+    finally:
+        validator.close()
+        loop.close()
+
+
+def test_valid_collation():
+    key = generate_key('ed25519')
+    result = run_validator(make_collation(key, txns=make_txns(key, 5)))
+
+    assert result.valid
+    assert result.reason is None
+
+
+def test_rejects_tampered_collations():
+    key = generate_key('ed25519')
+    other = generate_key('ed25519')
+
+    forged = make_collation(key, txns=make_txns(key, 3))
+    forged.header.proposer_pk = get_pub_key_bytes(other)
+    forged.header.collation_id = forged.digest()
+    assert run_validator(forged).reason == 'invalid proposer signature'
+
+    wrong_root = make_collation(key, txns=make_txns(key, 3),
+                                txns_merkle_root=b'\x01' * 32)
+    assert run_validator(wrong_root).reason == \
+        'txns do not match the merkle root'
+
+    txns = make_txns(key, 3)
+    txns[2].src_sig = txns[1].src_sig
+    assert run_validator(make_collation(key, txns=txns)).reason == \
+        'invalid txn signature'
+
+    double_spend = make_collation(key, txns=make_txns(key, 2, b'\x02' * 32))
+    assert 'spent twice' in run_validator(double_spend).reason
+
+
+def test_checks_txns_against_state():
+    key = generate_key('ed25519')
+    collation = make_collation(key, txns=make_txns(key, 2))
+    state = State()
+    seen = list()
+
+    def validate_txn(overlay, txn):
+        seen.append(txn.txn_id)
+        return len(seen) < 2
+
+    result = run_validator(collation, state_of=lambda c: state,
+                           validate_txn=validate_txn)
+
+    assert not result.valid
+    assert seen == [txn.txn_id for txn in collation.txns]
+    assert len(state.utxo) == 0
@@ -0,0 +1,43 @@
+import asyncio
+
+from crypto import RSA
+from verifier import SignatureVerifier, verify_batch
+
+
+def test_batched_verification():
+    loop = asyncio.new_event_loop()
+    key = RSA.generate_rsa_key()
+    public_key = RSA.get_pub_key_bytes(key)
+    sig = RSA.generate_signature(key, b'data')
+
+    verifier = SignatureVerifier(loop, workers=2, use_threads=True,
+                                 batch_size=4)
+    futures = [verifier.submit(public_key, b'data', sig) for _ in range(9)]
+    futures.append(verifier.submit(public_key, b'other data', sig))
+
+    results = loop.run_until_complete(asyncio.gather(*futures))
+    verifier.close()
+    loop.close()
+
+    assert results == [True] * 9 + [False]
+
+
+def test_malformed_items_fail_alone():
+    key = RSA.generate_rsa_key()
+    public_key = RSA.get_pub_key_bytes(key)
+    sig = RSA.generate_signature(key, b'data')
+
+    assert verify_batch([(public_key, b'data', sig),
+                         (public_key, b'data', None),
+                         (b'not a key', b'data', sig),
+                         (public_key, b'data', sig)]) == \
+        [True, False, False, True]
+
+    loop = asyncio.new_event_loop()
+    verifier = SignatureVerifier(loop, workers=1, use_threads=True)
+    future = verifier.submit(public_key, b'data', None)
+    # rejected before it is queued
+    assert future.done() and not future.result()
+    assert not verifier.pending
+    verifier.close()
+    loop.close()
@@ -0,0 +1,148 @@
+import asyncio
+import functools
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from crypto import generate_key, generate_signature, get_pub_key_bytes
+from objects import CollationVote, VoteCertificate
+from sampling import CommitteeSampler
+from votes import VoteAggregator
+
+COLLATION_ID = b'\x07' * 32
+
+
+def make_votes(count, epoch=1, shard=0, collation_id=COLLATION_ID):
+    votes = list()
+    for _ in range(count):
+        key = generate_key('rsa')
+        # with a committee as large as the cluster every node is seated
+        proof = CommitteeSampler(key, committee_size=count).assign(
+            epoch, [shard], count)[shard]
+        votes.append(CollationVote(
+            collation_id, get_pub_key_bytes(key), shard, proof,
+            sign_callable=functools.partial(generate_signature, key),
+            epoch=epoch))
+    return votes
+
+
+def make_aggregator(loop, population, **kwargs):
+    now = [0.]
+    certificates = list()
+    aggregator = VoteAggregator(
+        loop, CommitteeSampler(committee_size=population),
+        lambda: population, batch_size=4,
+        on_certificate=certificates.append, clock=lambda: now[0], **kwargs)
+    return aggregator, certificates, now
+
+
+def drain(loop):
+    loop.run_until_complete(asyncio.sleep(0.05))
+
+
+def test_quorum_emits_one_certificate():
+    loop = asyncio.new_event_loop()
+    aggregator, certificates, now = make_aggregator(loop, 6)
+    aggregator.observe(COLLATION_ID)
+    votes = make_votes(6)
+
+    now[0] = 1.5
+    for vote in votes[:4]:
+        assert aggregator.add(vote)
+    # the same vote again is dropped before it is checked
+    assert not aggregator.add(votes[0])
+    drain(loop)
+
+    assert len(certificates) == 1
+    certificate = certificates[0]
+    assert certificate.signer_indices() == [0, 1, 2, 3]
+    assert aggregator.finality_latency(COLLATION_ID) == 1.5
+    assert aggregator.stats()['duplicates'] == 1
+
+    # later votes do not certify the collation again
+    for vote in votes[4:]:
+        aggregator.add(vote)
+    drain(loop)
+    assert len(certificates) == 1
+    aggregator.close()
+    loop.close()
+
+
+def test_rejects_forged_votes():
+    loop = asyncio.new_event_loop()
+    aggregator, certificates, _ = make_aggregator(loop, 3)
+    votes = make_votes(3)
+    votes[0].collator_sig = votes[1].collator_sig
+    # a proof for another shard does not seat the collator
+    votes[1].proof = make_votes(1, shard=1)[0].proof
+
+    for vote in votes:
+        aggregator.add(vote)
+    aggregator.flush()
+    drain(loop)
+
+    assert aggregator.rejected == 2
+    assert not certificates
+    aggregator.close()
+    loop.close()
+
+
+def test_bad_votes_fail_alone():
+    loop = asyncio.new_event_loop()
+    aggregator, certificates, _ = make_aggregator(loop, 6)
+    votes = make_votes(4)
+    # a key of a type no scheme verifies
+    ec_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    forged = make_votes(1)[0]
+    forged.collator_pk = ec_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    # checked in one batch with the honest votes
+    for vote in votes[:3] + [forged]:
+        aggregator.add(vote)
+    drain(loop)
+    aggregator.add(votes[3])
+    aggregator.flush()
+    drain(loop)
+
+    assert aggregator.rejected == 1
+    assert len(certificates) == 1
+    aggregator.close()
+    loop.close()
+
+
+def test_certificates_are_checked_by_other_nodes():
+    loop = asyncio.new_event_loop()
+    aggregator, certificates, _ = make_aggregator(loop, 4)
+    for vote in make_votes(4):
+        aggregator.add(vote)
+    drain(loop)
+    certificate = certificates[0]
+
+    other, received, _ = make_aggregator(loop, 4)
+    assert loop.run_until_complete(other.add_certificate(certificate))
+    assert received == [certificate]
+    assert other.certified(COLLATION_ID, 0, 1)
+
+    forged = make_aggregator(loop, 4)[0]
+    certificate.signatures = certificate.signatures[1:] + \
+        certificate.signatures[:1]
+    assert not loop.run_until_complete(forged.add_certificate(certificate))
+    loop.close()
+
+
+def test_rejects_certificates_counting_a_collator_twice():
+    loop = asyncio.new_event_loop()
+    aggregator, received, _ = make_aggregator(loop, 4)
+    vote = make_votes(4)[0]
+
+    certificate = VoteCertificate(
+        COLLATION_ID, 0, 1, committee=[vote.collator_pk] * 4,
+        proofs=[vote.proof] * 4, signers=b'\xf0',
+        signatures=[vote.collator_sig] * 4)
+    assert not loop.run_until_complete(
+        aggregator.add_certificate(certificate))
+    assert not received
+    loop.close()